@@ -0,0 +1,125 @@
+"""Compare benchmark results against a stored baseline.
+
+Flags benchmarks that got slower, or that allocate more memory (the
+peak_memory_mb recorded in their extra_info), by more than a threshold.
+
+Usage::
+
+    pytest benchmarks/test_bench_utils.py --benchmark-json=utils.json
+    python benchmarks/compare.py benchmarks/baselines/utils.json utils.json
+
+Add --update to store the new results as the baseline instead.
+The exit code is 1 if any benchmark regressed, so it can be used in CI.
+"""
+import argparse
+import json
+import sys
+
+
+def load_results(filename):
+    """Load benchmark results from a pytest-benchmark JSON file or baseline.
+
+    Parameters
+    ----------
+    filename : str
+        Either the output of pytest --benchmark-json, or a baseline file
+        saved by this script.
+
+    Returns
+    -------
+    dict
+        Dictionary with structure {"benchmark name": {"mean": seconds,
+        "peak_memory_mb": megabytes or None}}
+    """
+    with open(filename) as f:
+        data = json.load(f)
+    if isinstance(data.get('benchmarks'), dict):
+        return data['benchmarks']  # already a baseline
+    results = {}
+    for benchmark in data['benchmarks']:
+        results[benchmark['fullname']] = {
+            'mean': benchmark['stats']['mean'],
+            'peak_memory_mb': benchmark['extra_info'].get('peak_memory_mb'),
+        }
+    return results
+
+
+def save_baseline(results, filename):
+    """Save benchmark results as a baseline file."""
+    with open(filename, 'w') as f:
+        json.dump({'benchmarks': results}, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def compare(baseline, results, time_threshold=0.25, memory_threshold=0.1):
+    """Find the benchmarks that regressed compared to the baseline.
+
+    Parameters
+    ----------
+    baseline : dict
+        Baseline results, see load_results().
+    results : dict
+        New results, see load_results().
+    time_threshold : float, optional
+        Flag benchmarks more than this fraction slower, by default 0.25.
+    memory_threshold : float, optional
+        Flag benchmarks with a peak memory more than this fraction larger,
+        by default 0.1.
+
+    Returns
+    -------
+    list of str
+        Description of each regression.
+    """
+    regressions = []
+    for name in sorted(set(baseline) & set(results)):
+        old, new = baseline[name], results[name]
+        time_change = new['mean'] / old['mean'] - 1
+        if time_change > time_threshold:
+            regressions.append("{}: {:.1%} slower ({:.4g} s -> {:.4g} s)"
+                               .format(name, time_change, old['mean'],
+                                       new['mean']))
+        if old.get('peak_memory_mb') and new.get('peak_memory_mb'):
+            memory_change = new['peak_memory_mb'] / old['peak_memory_mb'] - 1
+            if memory_change > memory_threshold:
+                regressions.append(
+                    "{}: {:.1%} more memory ({:.1f} MB -> {:.1f} MB)".format(
+                        name, memory_change, old['peak_memory_mb'],
+                        new['peak_memory_mb']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('baseline', help="baseline JSON file")
+    parser.add_argument('results', help="pytest --benchmark-json output")
+    parser.add_argument('--time-threshold', type=float, default=0.25,
+                        help="slowdown fraction to flag (default 0.25)")
+    parser.add_argument('--memory-threshold', type=float, default=0.1,
+                        help="peak memory increase fraction to flag "
+                             "(default 0.1)")
+    parser.add_argument('--update', action='store_true',
+                        help="save the results as the new baseline")
+    args = parser.parse_args(argv)
+
+    results = load_results(args.results)
+    if args.update:
+        save_baseline(results, args.baseline)
+        print("Saved {} benchmarks to {}".format(len(results), args.baseline))
+        return 0
+    baseline = load_results(args.baseline)
+    missing = sorted(set(baseline) - set(results))
+    for name in missing:
+        print("Missing from results: {}".format(name))
+    regressions = compare(baseline, results,
+                          time_threshold=args.time_threshold,
+                          memory_threshold=args.memory_threshold)
+    for regression in regressions:
+        print("REGRESSION {}".format(regression))
+    print("{} benchmarks compared, {} regressions".format(
+        len(set(baseline) & set(results)), len(regressions)))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
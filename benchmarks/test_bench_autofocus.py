@@ -0,0 +1,61 @@
+"""Autofocus benchmarks on the simulated objective stage and detector.
+
+Besides the run time, each benchmark records the number of images taken
+and the focus error in nanometers in its extra_info.
+"""
+import numpy as np
+import pytest
+
+from piescope.data.mocktypes import MockBasler, MockStageController
+import piescope.lm.focus
+import piescope.utils
+
+pytest.importorskip('pytest_benchmark')
+
+FOCUS_POSITIONS = [-7300, -1200, 2500, 8800]
+
+
+@pytest.mark.parametrize("method", [
+    ('golden'),
+    ('coarse_to_fine'),
+])
+@pytest.mark.parametrize("metric", [
+    ('variance_of_laplacian'),
+    ('brenner'),
+    ('normalized_variance'),
+])
+def test_bench_autofocus(benchmark, method, metric):
+    results = []
+
+    def run():
+        for focus_position in FOCUS_POSITIONS:
+            stage = MockStageController(position=0)
+            detector = MockBasler(stage, focus_position=focus_position)
+            result = piescope.lm.focus.autofocus(
+                detector, stage, method=method, metric=metric, time_delay=0)
+            results.append((result, focus_position))
+
+    benchmark.pedantic(run, rounds=1, iterations=1)
+    num_grabs = [result['num_grabs'] for result, _ in results]
+    errors = [abs(result['position'] - focus_position)
+              for result, focus_position in results]
+    benchmark.extra_info['mean_num_grabs'] = sum(num_grabs) / len(num_grabs)
+    benchmark.extra_info['max_focus_error_nm'] = max(errors)
+
+
+@pytest.mark.parametrize("metric", [
+    ('variance_of_laplacian'),
+    ('brenner'),
+    ('normalized_variance'),
+    ('signal'),
+])
+@pytest.mark.parametrize("downsample_factor", [
+    (1),
+    (2),
+    (4),
+])
+def test_bench_focus_metric(benchmark, metric, downsample_factor):
+    image = MockBasler().camera_grab()
+    metric_function = piescope.lm.focus.METRICS[metric]
+    benchmark(lambda: metric_function(piescope.utils.downsample(
+        image, downsample_factor, edges='drop', dtype=np.float32)))
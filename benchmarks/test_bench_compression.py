@@ -0,0 +1,72 @@
+"""Compressed TIFF saving benchmarks: file size against throughput.
+
+Each benchmark saves a sample image with save_image, and records in its
+extra_info:
+
+* compression_ratio: image size in memory divided by the file size.
+* throughput_mb_s: image megabytes saved per second.
+
+Codecs that need the optional imagecodecs package are skipped without it.
+"""
+import os
+
+import numpy as np
+import pytest
+import scipy.ndimage
+
+import piescope.data
+import piescope.utils
+
+pytest.importorskip('pytest_benchmark')
+
+COMPRESSION_SETTINGS = {
+    'none': {},
+    'zlib_1': {'compression': 'zlib', 'compression_level': 1},
+    'zlib_6': {'compression': 'zlib', 'compression_level': 6},
+    'zlib_1_predictor': {'compression': 'zlib', 'compression_level': 1,
+                         'predictor': True},
+    'lzw': {'compression': 'lzw'},
+    'lzw_predictor': {'compression': 'lzw', 'predictor': True},
+    'zstd': {'compression': 'zstd'},
+    'zstd_predictor': {'compression': 'zstd', 'predictor': True},
+}
+
+
+def synthetic_volume(shape=(20, 512, 512, 2)):
+    """Smooth fluorescence-like uint16 volume with camera noise."""
+    random = np.random.RandomState(0)
+    blobs = scipy.ndimage.gaussian_filter(
+        random.random_sample(shape).astype(np.float32), sigma=(1, 8, 8, 0))
+    blobs = (blobs - blobs.min()) / (blobs.max() - blobs.min())
+    volume = 100 + 3000 * blobs ** 4 + random.normal(0, 5, shape)
+    return volume.astype(np.uint16)
+
+
+SAMPLES = {
+    'basler': piescope.data.basler_image,
+    'autoscript': piescope.data.autoscript_image,
+    'synthetic_volume': synthetic_volume,
+}
+
+
+@pytest.mark.parametrize("setting", list(COMPRESSION_SETTINGS))
+@pytest.mark.parametrize("sample", list(SAMPLES))
+def test_bench_save_image_compression(benchmark, tmpdir, sample, setting):
+    options = COMPRESSION_SETTINGS[setting]
+    compression = options.get('compression')
+    if (compression is not None
+            and compression not in piescope.utils.available_compression()):
+        pytest.skip("{} compression is not available".format(compression))
+    image = SAMPLES[sample]()
+    filename = os.path.join(str(tmpdir), 'image.tif')
+
+    def save():
+        return piescope.utils.save_image(image, filename, timestamp=False,
+                                         allow_overwrite=True, **options)
+
+    benchmark.pedantic(save, rounds=3, iterations=1)
+    benchmark.extra_info['compression_ratio'] = (
+        image.nbytes / os.path.getsize(filename))
+    if benchmark.stats is not None:  # None with --benchmark-disable
+        benchmark.extra_info['throughput_mb_s'] = (
+            image.nbytes / 1e6 / benchmark.stats.stats.mean)
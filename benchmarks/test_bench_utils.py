@@ -0,0 +1,216 @@
+"""Benchmarks for the piescope image functions.
+
+Image sizes range from Basler detector frames (1200 x 1920 pixels) to
+ion beam images (4096 x 6144 pixels) and fluorescence volumes.
+Besides the run time, each benchmark records in its extra_info:
+
+* peak_memory_mb: peak memory allocated during one call, from tracemalloc.
+* memory_ratio: peak memory divided by the size of the input image.
+
+Compare the results against the stored baselines with benchmarks/compare.py
+"""
+import os
+import tracemalloc
+
+import numpy as np
+import pytest
+
+import piescope.projection
+import piescope.pyramid
+import piescope.utils
+
+pytest.importorskip('pytest_benchmark')
+
+SHAPES = {
+    'basler': (1200, 1920),
+    'ion': (4096, 6144),
+}
+VOLUME_SHAPE = (20, 1200, 1920)
+SMALL_VOLUME_SHAPE = (10, 512, 512)
+
+
+def random_image(shape, dtype):
+    random = np.random.RandomState(0)
+    if np.dtype(dtype).kind == 'f':
+        return random.random_sample(shape).astype(dtype)
+    return random.randint(0, np.iinfo(dtype).max, shape, dtype=dtype)
+
+
+def record_memory(benchmark, function, image):
+    tracemalloc.start()
+    function()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    benchmark.extra_info['peak_memory_mb'] = peak_memory / 2 ** 20
+    benchmark.extra_info['memory_ratio'] = peak_memory / image.nbytes
+
+
+def bench(benchmark, function, image, rounds=3):
+    record_memory(benchmark, function, image)
+    benchmark.pedantic(function, rounds=rounds, iterations=1)
+
+
+@pytest.mark.parametrize("dtype", [
+    (np.uint8),
+    (np.uint16),
+    (np.float32),
+])
+@pytest.mark.parametrize("shape", [
+    ('basler'),
+    ('ion'),
+])
+def test_bench_save_image(benchmark, tmpdir, shape, dtype):
+    image = random_image(SHAPES[shape], dtype)
+    filename = os.path.join(str(tmpdir), 'image.tif')
+    bench(benchmark, lambda: piescope.utils.save_image(
+        image, filename, allow_overwrite=True, timestamp=False), image)
+
+
+@pytest.mark.parametrize("dtype", [
+    (np.uint8),
+    (np.uint16),
+])
+@pytest.mark.parametrize("channels", [
+    (1),
+    (2),
+    (3),
+])
+def test_bench_save_image_channels(benchmark, tmpdir, channels, dtype):
+    image = random_image(SHAPES['basler'] + (channels,), dtype)
+    filename = os.path.join(str(tmpdir), 'image.tif')
+    bench(benchmark, lambda: piescope.utils.save_image(
+        image, filename, allow_overwrite=True, timestamp=False), image)
+
+
+@pytest.mark.parametrize("dtype", [
+    (np.uint8),
+    (np.uint16),
+])
+@pytest.mark.parametrize("channels", [
+    (1),
+    (3),
+])
+def test_bench_save_image_volume(benchmark, tmpdir, channels, dtype):
+    image = random_image(SMALL_VOLUME_SHAPE + (channels,), dtype)
+    filename = os.path.join(str(tmpdir), 'volume.tif')
+    bench(benchmark, lambda: piescope.utils.save_image(
+        image, filename, allow_overwrite=True, timestamp=False), image)
+
+
+@pytest.mark.parametrize("dtype", [
+    (np.uint8),
+    (np.uint16),
+])
+@pytest.mark.parametrize("channels", [
+    (1),
+    (2),
+    (3),
+])
+def test_bench_max_intensity_projection(benchmark, channels, dtype):
+    image = random_image(VOLUME_SHAPE + (channels,), dtype)
+    bench(benchmark,
+          lambda: piescope.utils.max_intensity_projection(image), image)
+
+
+@pytest.mark.parametrize("num_workers", [
+    (1),
+    (4),
+])
+@pytest.mark.parametrize("projections", [
+    (('max',)),
+    (piescope.projection.PROJECTIONS),
+])
+def test_bench_project(benchmark, projections, num_workers):
+    image = random_image(VOLUME_SHAPE + (2,), np.uint16)
+    bench(benchmark, lambda: piescope.projection.project(
+        image, projections, num_workers=num_workers), image)
+
+
+@pytest.mark.parametrize("dtype", [
+    (np.uint8),
+    (np.uint16),
+])
+@pytest.mark.parametrize("channels", [
+    (None),
+    (1),
+    (2),
+    (3),
+])
+@pytest.mark.parametrize("shape", [
+    ('basler'),
+    ('ion'),
+])
+def test_bench_rgb_image(benchmark, shape, channels, dtype):
+    if channels is None:
+        image = random_image(SHAPES[shape], dtype)  # grayscale
+    else:
+        image = random_image(SHAPES[shape] + (channels,), dtype)
+    bench(benchmark, lambda: piescope.utils.rgb_image(image), image)
+
+
+@pytest.mark.parametrize("dtype", [
+    (np.uint8),
+    (np.uint16),
+])
+@pytest.mark.parametrize("channels", [
+    (1),
+    (3),
+    (4),
+])
+@pytest.mark.parametrize("shape", [
+    ('basler'),
+    ('ion'),
+])
+def test_bench_channel_compositor(benchmark, shape, channels, dtype):
+    image = random_image(SHAPES[shape] + (channels,), dtype)
+    compositor = piescope.utils.ChannelCompositor()
+    out = compositor.composite(image)  # LUTs are kept between frames
+    bench(benchmark, lambda: compositor.composite(image, out=out), image)
+
+
+@pytest.mark.parametrize("dtype", [
+    (np.uint8),
+    (np.uint16),
+    (np.float32),
+])
+@pytest.mark.parametrize("shape", [
+    ('basler'),
+    ('ion'),
+])
+def test_bench_approximate_percentile(benchmark, shape, dtype):
+    image = random_image(SHAPES[shape], dtype)
+    bench(benchmark, lambda: piescope.utils.approximate_percentile(
+        image, (0.5, 99.5)), image, rounds=10)
+
+
+@pytest.mark.parametrize("dtype", [
+    (np.uint8),
+    (np.uint16),
+])
+def test_bench_write_pyramid(benchmark, tmpdir, dtype):
+    image = random_image(SHAPES['ion'], dtype)
+    filename = os.path.join(str(tmpdir), 'pyramid.tif')
+    bench(benchmark, lambda: piescope.pyramid.write_pyramid(filename, image),
+          image)
+
+
+def test_bench_pyramid_read_region(benchmark, tmpdir):
+    image = random_image(SHAPES['ion'], np.uint16)
+    filename = os.path.join(str(tmpdir), 'pyramid.tif')
+    piescope.pyramid.write_pyramid(filename, image)
+    with piescope.pyramid.PyramidReader(filename) as pyramid:
+        # overview of the whole image in a 1024 x 1024 pixel window
+        bench(benchmark, lambda: pyramid.read_region(max_shape=(1024, 1024)),
+              image, rounds=10)
+
+
+@pytest.mark.parametrize("memmap", [
+    (True),
+    (False),
+])
+def test_bench_load_image(benchmark, tmpdir, memmap):
+    image = random_image(VOLUME_SHAPE + (2,), np.uint16)
+    filename = piescope.utils.save_image(
+        image, os.path.join(str(tmpdir), 'volume.tif'), timestamp=False)
+    bench(benchmark, lambda: piescope.utils.load_image(
+        filename, memmap=memmap), image)
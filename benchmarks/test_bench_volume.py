@@ -0,0 +1,97 @@
+"""End-to-end volume acquisition benchmarks on simulated hardware.
+
+The simulated detector, lasers and objective stage wait for a configurable
+time on each command, see LATENCIES. Besides the run time, each benchmark
+records in its extra_info:
+
+* frames_per_second: acquisition throughput.
+* overhead_per_frame_ms: wall time not spent waiting for the simulated
+  hardware, per frame. This is the cost of the acquisition software itself.
+* peak_memory_mb: peak memory allocated during one acquisition,
+  measured with tracemalloc in a separate run.
+"""
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from piescope.data.mocktypes import MockBasler, MockStageController
+from piescope.data.mocktypes import mock_lasers
+import piescope.lm.pipeline
+import piescope.lm.volume
+
+pytest.importorskip('pytest_benchmark')
+
+# Simulated hardware latencies in seconds
+LATENCIES = {
+    'none': {'readout_time': 0., 'switch_time': 0., 'move_time': 0.,
+             'time_delay': 0.},
+    'lab': {'readout_time': 0.005, 'switch_time': 0.002, 'move_time': 0.002,
+            'time_delay': 0.005},
+}
+# Top level stages only: 'retry' is timed inside 'correction'
+HARDWARE_STAGES = ('laser', 'grab', 'move', 'settle', 'correction')
+LASER_NAMES = ["laser640", "laser561", "laser488", "laser405"]
+EXPOSURE_TIME = 1000  # microseconds
+
+
+def simulated_hardware(frame_shape, latency):
+    image = np.random.RandomState(0).randint(
+        0, 255, frame_shape).astype(np.uint8)
+    detector = MockBasler(image=image, readout_time=latency['readout_time'],
+                          simulate_exposure=True)
+    lasers = mock_lasers(switch_time=latency['switch_time'])
+    objective_stage = MockStageController(move_time=latency['move_time'])
+    return detector, lasers, objective_stage
+
+
+@pytest.mark.parametrize("latency", [
+    ('none'),
+    ('lab'),
+])
+@pytest.mark.parametrize("frame_shape", [
+    ((256, 256)),
+    ((1200, 1920)),
+])
+@pytest.mark.parametrize("num_channels", [
+    (1),
+    (4),
+])
+@pytest.mark.parametrize("num_z_slices", [
+    (5),
+    (20),
+])
+def test_bench_volume_acquisition(benchmark, num_z_slices, num_channels,
+                                  frame_shape, latency):
+    latency = LATENCIES[latency]
+    laser_dict = {name: (1, EXPOSURE_TIME)
+                  for name in LASER_NAMES[:num_channels]}
+    timers = []
+
+    def run():
+        detector, lasers, objective_stage = simulated_hardware(
+            frame_shape, latency)
+        timer = piescope.lm.pipeline.StageTimer()
+        piescope.lm.volume.volume_acquisition(
+            laser_dict, num_z_slices, 100, time_delay=latency['time_delay'],
+            detector=detector, lasers=lasers, objective_stage=objective_stage,
+            storage='memory', pipelined=True, timer=timer)
+        timers.append(timer)
+
+    tracemalloc.start()
+    run()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    timers = []
+    benchmark.pedantic(run, rounds=3, iterations=1)
+
+    num_frames = num_z_slices * num_channels
+    wall_time = np.mean([timer.wall_time for timer in timers])
+    hardware_time = np.mean([
+        sum(timer.busy_time[name] for name in HARDWARE_STAGES)
+        for timer in timers])
+    benchmark.extra_info['num_frames'] = num_frames
+    benchmark.extra_info['frames_per_second'] = num_frames / wall_time
+    benchmark.extra_info['overhead_per_frame_ms'] = (
+        1e3 * (wall_time - hardware_time) / num_frames)
+    benchmark.extra_info['peak_memory_mb'] = peak_memory / 2 ** 20
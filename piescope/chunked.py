@@ -0,0 +1,294 @@
+"""Module for chunked, compressed storage of large image volumes.
+
+Volumes are stored in the zarr version 2 directory layout, with OME-Zarr
+(NGFF 0.4) style metadata, so they can be opened by zarr, napari and Fiji
+(MoBIE, BigDataViewer) as well as by piescope, without installing zarr.
+Each chunk is a separate file, and only the chunks overlapping the
+requested region are read.
+
+Layout of a volume::
+
+    volume.zarr/
+        .zgroup
+        .zattrs          # axes, voxel size and acquisition metadata
+        0/.zarray        # shape, chunks, data type and compressor
+        0/t/c/z/y/x      # one zlib compressed file per chunk
+"""
+import concurrent.futures
+import itertools
+import json
+import logging
+import os
+import zlib
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+AXES = ('t', 'c', 'z', 'y', 'x')
+DEFAULT_CHUNKS = (1, 1, 16, 512, 512)
+
+
+def _axes_metadata():
+    """OME-Zarr metadata of AXES."""
+    axes = []
+    for name in AXES:
+        if name == 't':
+            axes.append({'name': name, 'type': 'time', 'unit': 'second'})
+        elif name == 'c':
+            axes.append({'name': name, 'type': 'channel'})
+        else:
+            axes.append({'name': name, 'type': 'space',
+                         'unit': 'micrometer'})
+    return axes
+
+
+def _chunk_slices(shape, chunks):
+    """Chunk grid indices and array slices, in C order."""
+    grid = [range(-(-size // chunk)) for size, chunk in zip(shape, chunks)]
+    for index in itertools.product(*grid):
+        yield index, tuple(slice(i * chunk, (i + 1) * chunk)
+                           for i, chunk in zip(index, chunks))
+
+
+def write_chunked(path, volume, voxel_size=None, laser_dict=None,
+                  metadata=None, chunks=DEFAULT_CHUNKS, compression='zlib',
+                  compression_level=1, max_workers=None):
+    """Write an image volume to a chunked, compressed zarr directory.
+
+    Parameters
+    ----------
+    path : str
+        Directory to create, by convention with a .zarr extension.
+    volume : ndarray
+        Image volume with dimensions (time, channels, z_slices, rows,
+        columns), or (z_slices, rows, columns, channels) as returned by
+        piescope.lm.volume.volume_acquisition().
+    voxel_size : tuple of float, optional
+        Voxel size (z, y, x) in micrometers, by default None (unknown).
+    laser_dict : dict, optional
+        Dictionary with structure: {"name": (power, exposure)} of the laser
+        of each channel, saved in the channel metadata.
+    metadata : dict, optional
+        Any other JSON serializable acquisition metadata.
+    chunks : tuple of int, optional
+        Chunk shape (time, channels, z_slices, rows, columns), clipped to
+        the volume shape. By default DEFAULT_CHUNKS.
+    compression : {'zlib', None}, optional
+        Chunk compression, by default 'zlib'.
+    compression_level : int, optional
+        zlib compression level, by default 1 (fastest).
+    max_workers : int, optional
+        Number of threads compressing and writing chunks in parallel,
+        by default None, meaning concurrent.futures picks a number.
+
+    Raises
+    ------
+    ValueError
+        Raised if the volume dimensions or compression are not supported,
+        or the path already exists.
+    """
+    if volume.ndim == 4:
+        # (z, y, x, c) acquisition volume, without copying it
+        volume = np.moveaxis(volume, -1, 0)[np.newaxis]
+    elif volume.ndim != 5:
+        raise ValueError("expecting numpy.array with dimensions "
+                         "(t, c, z, y, x) or (pln, row, col, ch)")
+    if compression not in ('zlib', None):
+        raise ValueError("Unknown compression '{}'. Expected either 'zlib' "
+                         "or None.".format(compression))
+    if os.path.exists(path):
+        raise ValueError("{} already exists".format(path))
+    chunks = tuple(int(min(chunk, size))
+                   for chunk, size in zip(chunks, volume.shape))
+    chunks = tuple(max(chunk, 1) for chunk in chunks)
+
+    array_path = os.path.join(path, '0')
+    os.makedirs(array_path)
+    scale = [1., 1.] + (list(voxel_size) if voxel_size is not None
+                        else [1., 1., 1.])
+    attributes = {
+        'multiscales': [{
+            'version': '0.4',
+            'name': os.path.splitext(os.path.basename(path))[0],
+            'axes': _axes_metadata(),
+            'datasets': [{
+                'path': '0',
+                'coordinateTransformations': [
+                    {'type': 'scale', 'scale': scale}],
+            }],
+        }],
+        'piescope': {
+            'voxel_size': list(voxel_size) if voxel_size is not None
+            else None,
+            'channels': [{'name': name, 'laser_power': power,
+                          'exposure_time': exposure}
+                         for name, (power, exposure)
+                         in (laser_dict or {}).items()],
+            'metadata': metadata if metadata is not None else {},
+        },
+    }
+    array_metadata = {
+        'zarr_format': 2,
+        'shape': list(volume.shape),
+        'chunks': list(chunks),
+        'dtype': volume.dtype.str,
+        'compressor': ({'id': 'zlib', 'level': compression_level}
+                       if compression is not None else None),
+        'fill_value': 0,
+        'order': 'C',
+        'filters': None,
+        'dimension_separator': '/',
+    }
+    with open(os.path.join(path, '.zgroup'), 'w') as f:
+        json.dump({'zarr_format': 2}, f)
+    with open(os.path.join(path, '.zattrs'), 'w') as f:
+        json.dump(attributes, f, indent=2)
+    with open(os.path.join(array_path, '.zarray'), 'w') as f:
+        json.dump(array_metadata, f, indent=2)
+
+    def write_chunk(index, slices):
+        chunk = volume[slices]
+        if chunk.shape != chunks:
+            # edge chunks are padded to the full chunk shape
+            padding = [(0, full - size)
+                       for full, size in zip(chunks, chunk.shape)]
+            chunk = np.pad(chunk, padding, mode='constant')
+        data = np.ascontiguousarray(chunk).tobytes()
+        if compression is not None:
+            data = zlib.compress(data, compression_level)
+        directory = os.path.join(array_path, *map(str, index[:-1]))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, str(index[-1])), 'wb') as f:
+            f.write(data)
+        return len(data)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        nbytes = sum(executor.map(lambda args: write_chunk(*args),
+                                  _chunk_slices(volume.shape, chunks)))
+    logging.debug("Saved: {} ({} bytes in chunks)".format(path, nbytes))
+
+
+class ChunkedVolume():
+    """Lazy reader of volumes written by write_chunked().
+
+    Indexing reads and decompresses only the chunks overlapping the
+    requested region.
+
+    Parameters
+    ----------
+    path : str
+        Zarr directory written by write_chunked(), or any zarr version 2
+        array with zlib or no compression.
+
+    Examples
+    --------
+    >>> volume = ChunkedVolume('volume.zarr')
+    >>> volume.shape  # (t, c, z, y, x)
+    (1, 4, 200, 1200, 1920)
+    >>> z_slice = volume[0, :, 100]  # reads 4 * 12 chunks
+    """
+    def __init__(self, path):
+        self.path = path
+        self._array_path = os.path.join(path, '0')
+        if not os.path.exists(os.path.join(self._array_path, '.zarray')):
+            self._array_path = path  # a bare zarr array
+        with open(os.path.join(self._array_path, '.zarray')) as f:
+            array_metadata = json.load(f)
+        self.attributes = {}
+        if os.path.exists(os.path.join(path, '.zattrs')):
+            with open(os.path.join(path, '.zattrs')) as f:
+                self.attributes = json.load(f)
+        compressor = array_metadata['compressor']
+        if compressor is not None and compressor['id'] != 'zlib':
+            raise ValueError("Unsupported zarr compressor '{}'".format(
+                compressor['id']))
+        if array_metadata.get('filters') or array_metadata['order'] != 'C':
+            raise ValueError("Unsupported zarr filters or memory order")
+        self.shape = tuple(array_metadata['shape'])
+        self.chunks = tuple(array_metadata['chunks'])
+        self.dtype = np.dtype(array_metadata['dtype'])
+        self.fill_value = array_metadata['fill_value'] or 0
+        self._compressed = compressor is not None
+        self._separator = array_metadata.get('dimension_separator', '.')
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def voxel_size(self):
+        """Voxel size (z, y, x) in micrometers, or None if unknown."""
+        return self.attributes.get('piescope', {}).get('voxel_size')
+
+    @property
+    def metadata(self):
+        """Acquisition metadata and channel laser settings."""
+        return self.attributes.get('piescope', {})
+
+    def _read_chunk(self, index):
+        filename = os.path.join(
+            self._array_path, self._separator.join(map(str, index)))
+        if not os.path.exists(filename):
+            return None  # chunks that were never written
+        with open(filename, 'rb') as f:
+            data = f.read()
+        if self._compressed:
+            data = zlib.decompress(data)
+        return np.frombuffer(data, dtype=self.dtype).reshape(self.chunks)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if Ellipsis in key:
+            position = key.index(Ellipsis)
+            key = (key[:position]
+                   + (slice(None),) * (self.ndim - len(key) + 1)
+                   + key[position + 1:])
+        if len(key) > self.ndim:
+            raise IndexError("too many indices for {} dimensional "
+                             "volume".format(self.ndim))
+        key += (slice(None),) * (self.ndim - len(key))
+        ranges, steps, squeeze = [], [], []
+        for axis, (item, size) in enumerate(zip(key, self.shape)):
+            if isinstance(item, slice):
+                start, stop, step = item.indices(size)
+                if step < 1:
+                    raise IndexError("only positive slice steps are "
+                                     "supported")
+                ranges.append((start, max(start, stop)))
+                steps.append(step)
+            else:
+                index = int(item)
+                if index < 0:
+                    index += size
+                if not 0 <= index < size:
+                    raise IndexError("index {} is out of bounds for axis {} "
+                                     "with size {}".format(item, axis, size))
+                ranges.append((index, index + 1))
+                steps.append(1)
+                squeeze.append(axis)
+
+        out = np.full([stop - start for start, stop in ranges],
+                      self.fill_value, dtype=self.dtype)
+        grid = [range(start // chunk, -(-stop // chunk))
+                for (start, stop), chunk in zip(ranges, self.chunks)]
+        for index in itertools.product(*grid):
+            chunk = self._read_chunk(index)
+            if chunk is None:
+                continue
+            source, destination = [], []
+            for i, chunk_size, (start, stop) in zip(index, self.chunks,
+                                                    ranges):
+                low = max(start, i * chunk_size)
+                high = min(stop, (i + 1) * chunk_size)
+                source.append(slice(low - i * chunk_size,
+                                    high - i * chunk_size))
+                destination.append(slice(low - start, high - start))
+            out[tuple(destination)] = chunk[tuple(source)]
+        out = out[tuple(slice(None, None, step) for step in steps)]
+        return out.squeeze(axis=tuple(squeeze)) if squeeze else out
+
+    def __array__(self, dtype=None):
+        volume = self[()]
+        return volume.astype(dtype) if dtype is not None else volume
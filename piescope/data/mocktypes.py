@@ -1,7 +1,14 @@
 """Module with classes approximating autoscript objects.
 
 For use when autoscript is unavailable. Limited functionality.
+
+Also includes simulated fluorescence microscope hardware (detector, lasers
+and objective stage), for offline testing and benchmarking of acquisitions.
 """
+import time
+
+import numpy as np
+import scipy.ndimage
 
 
 class MockPixelSize:
@@ -95,3 +102,211 @@ class MockStagePosition:
         self.z = z
         self.t = t
         self.r = r
+
+
+class MockStageController:
+    """Simulated SMARACT objective lens stage.
+
+    Parameters
+    ----------
+    position : int, optional
+        Starting position in nanometers, by default 0.
+    move_time : float, optional
+        Simulated time in seconds for each stage command, by default 0.
+    speed : float, optional
+        Simulated stage speed in nanometers per second, by default None,
+        meaning movements are instantaneous. Like the real stage,
+        movements at a limited speed run in the background: the position
+        changes over time after the move command returns.
+    """
+
+    def __init__(self, position=0, move_time=0., speed=None):
+        self.move_time = move_time
+        self.speed = speed
+        self.num_moves = 0
+        self.travel = 0.
+        self._start_position = float(position)
+        self._target = float(position)
+        self._start_time = time.perf_counter()
+
+    @property
+    def position(self):
+        """Simulated position in nm at the current time."""
+        if not self.speed:
+            return self._target
+        elapsed = time.perf_counter() - self._start_time
+        distance = self._target - self._start_position
+        travelled = min(elapsed * self.speed, abs(distance))
+        return self._start_position + np.copysign(travelled, distance)
+
+    def _move_to(self, position):
+        if self.move_time > 0:
+            time.sleep(self.move_time)
+        start_position = self.position
+        self.num_moves += 1
+        self.travel += abs(float(position) - start_position)
+        self._start_position = start_position
+        self._target = float(position)
+        self._start_time = time.perf_counter()
+
+    def move_absolute(self, position, hold=0):
+        self._move_to(float(position))
+
+    def move_relative(self, distance, hold=0):
+        self._move_to(self.position + float(distance))
+
+    def set_closed_loop_speed(self, speed):
+        """Set the stage speed in nm/s, 0 for instantaneous movements."""
+        start_position = self.position
+        self._start_position = start_position
+        self._start_time = time.perf_counter()
+        self.speed = float(speed) if speed else None
+
+    def wait(self):
+        """Wait for the current movement to finish."""
+        if self.speed:
+            remaining = abs(self._target - self.position) / self.speed
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def current_position(self):
+        """Current position in nm as a string, like StageController."""
+        return str(int(round(self.position)))
+
+
+class MockLaser:
+    """Simulated laser.
+
+    Parameters
+    ----------
+    name : str
+        Laser name, eg: "laser488".
+    switch_time : float, optional
+        Simulated serial communication time in seconds for each command,
+        by default 0.
+    """
+
+    def __init__(self, name, switch_time=0.):
+        self.NAME = name
+        self.switch_time = switch_time
+        self.laser_power = 0.
+        self.emitting = False
+
+    def _command(self):
+        if self.switch_time > 0:
+            time.sleep(self.switch_time)
+
+    def emission_on(self):
+        self._command()
+        self.emitting = True
+
+    def emission_off(self):
+        self._command()
+        self.emitting = False
+
+
+def mock_lasers(switch_time=0.):
+    """Dictionary of simulated lasers, like initialize_lasers()."""
+    names = ["laser640", "laser561", "laser488", "laser405"]
+    return {name: MockLaser(name, switch_time=switch_time) for name in names}
+
+
+class MockBasler:
+    """Simulated Basler fluorescence detector.
+
+    Images are blurred in proportion to how far the objective stage
+    is from the focus position.
+
+    Parameters
+    ----------
+    objective_stage : MockStageController, optional
+        Simulated objective stage, by default None (always in focus).
+    image : ndarray, optional
+        In focus image, by default piescope.data.basler_image()
+    focus_position : float, optional
+        Objective stage position of best focus in nm, by default 0.
+    depth_of_field : float, optional
+        Stage distance in nm for each pixel of blur, by default 1000.
+    readout_time : float, optional
+        Simulated time in seconds for each grab, in addition to the
+        exposure time, by default 0.
+    simulate_exposure : bool, optional
+        Whether to wait for the exposure time when grabbing,
+        by default False.
+    """
+
+    def __init__(self, objective_stage=None, image=None, focus_position=0.,
+                 depth_of_field=1000., readout_time=0.,
+                 simulate_exposure=False):
+        if image is None:
+            import piescope.data
+            image = piescope.data.basler_image()
+        self.objective_stage = objective_stage
+        self.focus_image = np.asarray(image)
+        self.focus_position = focus_position
+        self.depth_of_field = depth_of_field
+        self.readout_time = readout_time
+        self.simulate_exposure = simulate_exposure
+        self.num_grabs = 0
+        self.image = []
+        self.exposure_positions = []
+
+    def defocus(self):
+        """Distance in nm between the stage and the focus position."""
+        if self.objective_stage is None:
+            return 0.
+        return self.objective_stage.position - self.focus_position
+
+    def _render(self):
+        sigma = abs(self.defocus()) / self.depth_of_field
+        if sigma > 0:
+            return scipy.ndimage.gaussian_filter(self.focus_image, sigma)
+        return self.focus_image.copy()
+
+    def camera_grab(self, exposure_time=None, flip_image=True):
+        delay = self.readout_time
+        if self.simulate_exposure and exposure_time is not None:
+            delay += float(exposure_time) * 1e-6
+        if delay > 0:
+            time.sleep(delay)
+        self.num_grabs += 1
+        self.image = self._render()
+        return self.image
+
+    def free_run(self, num_frames, exposure_time=None, frame_rate=None,
+                 flip_image=True):
+        """Grab a sequence of images at a fixed frame rate, like Basler.
+
+        Each image is rendered at the objective stage position half way
+        through its exposure, recorded in exposure_positions. Like hardware
+        timestamps, the timestamp is the end of the exposure even when the
+        simulation runs late.
+        """
+        exposure = 0.
+        if exposure_time is not None:
+            exposure = float(exposure_time) * 1e-6
+        period = self.readout_time + exposure
+        if frame_rate:
+            period = max(period, 1. / frame_rate)
+        images = []
+        timestamps = []
+        self.exposure_positions = []
+        start_time = time.perf_counter()
+        for index in range(int(num_frames)):
+            end_time = start_time + (index + 1) * period
+            delay = end_time - exposure / 2. - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            middle_time = time.perf_counter()
+            if self.objective_stage is not None:
+                self.exposure_positions.append(
+                    self.objective_stage.position)
+            images.append(self._render())
+            delay = end_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            timestamps.append(middle_time + exposure / 2.)
+            self.num_grabs += 1
+        images = np.stack(images)
+        self.image = images[-1]
+        return images, np.array(timestamps)
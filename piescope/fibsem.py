@@ -92,6 +92,30 @@ def move_to_electron_microscope(microscope, x=-50.0e-3, y=0.0):
     return microscope.specimen.stage.current_position
 
 
+def move_to_position(microscope, x, y):
+    """Move the sample stage to an absolute x, y position.
+
+    Parameters
+    ----------
+    microscope : Autoscript microscope object.
+    x : float
+        Absolute x position of the FIBSEM sample stage, in meters.
+    y : float
+        Absolute y position of the FIBSEM sample stage, in meters.
+
+    Returns
+    -------
+    StagePosition
+        FIBSEM microscope sample stage position after moving.
+        The z, rotation and tilt of the sample stage are unchanged.
+    """
+    from autoscript_sdb_microscope_client.structures import StagePosition
+
+    new_position = StagePosition(x=x, y=y)
+    microscope.specimen.stage.absolute_move(new_position)
+    return microscope.specimen.stage.current_position
+
+
 def new_ion_image(microscope, settings=None):
     """Take new ion beam image.
 
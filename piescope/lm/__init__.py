@@ -1,4 +1,11 @@
+import piescope.lm.checkpoint
 import piescope.lm.detector
+import piescope.lm.focus
 import piescope.lm.laser
 import piescope.lm.objective
+import piescope.lm.pipeline
+import piescope.lm.planner
+import piescope.lm.sweep
+import piescope.lm.timelapse
+import piescope.lm.trace
 import piescope.lm.volume
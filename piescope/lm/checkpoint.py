@@ -0,0 +1,99 @@
+"""Module for checkpointing volume acquisitions, so they can be resumed.
+
+A checkpoint directory holds the partially acquired volume, memory-mapped
+from a BigTIFF file, and an append-only journal of the acquisition settings
+and the (z_slice, channel) images completed so far.
+"""
+import json
+import logging
+import os
+
+import tifffile
+
+logger = logging.getLogger(__name__)
+
+
+class AcquisitionJournal():
+    """Journal of the progress of a volume acquisition.
+
+    The first line of the journal file holds the acquisition settings,
+    every following line records one completed (z_slice, channel) image.
+
+    Parameters
+    ----------
+    directory : str
+        Checkpoint directory, created if it does not already exist.
+    """
+    JOURNAL_FILENAME = 'journal.jsonl'
+    VOLUME_FILENAME = 'volume.tif'
+
+    def __init__(self, directory):
+        self.directory = os.path.normpath(directory)
+        self.journal_filename = os.path.join(self.directory,
+                                             self.JOURNAL_FILENAME)
+        self.volume_filename = os.path.join(self.directory,
+                                            self.VOLUME_FILENAME)
+
+    def exists(self):
+        """Whether there is a previous acquisition to resume."""
+        return (os.path.exists(self.journal_filename)
+                and os.path.exists(self.volume_filename))
+
+    def start(self, settings):
+        """Start a new journal, overwriting any previous one.
+
+        Parameters
+        ----------
+        settings : dict
+            JSON serializable acquisition settings.
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        with open(self.journal_filename, 'w') as f:
+            f.write(json.dumps({'settings': settings}) + '\n')
+        logger.debug("Started acquisition journal: {}".format(
+            self.journal_filename))
+
+    def record(self, z_slice, channel, frame=None):
+        """Record that the image at (z_slice, channel) is complete.
+
+        The signature matches the frame callbacks of
+        piescope.lm.pipeline.FrameWriter, so it can be used as one.
+        """
+        with open(self.journal_filename, 'a') as f:
+            f.write(json.dumps({'completed': [int(z_slice), int(channel)]})
+                    + '\n')
+
+    def load(self):
+        """Load the acquisition settings and completed images.
+
+        Returns
+        -------
+        settings : dict
+            Acquisition settings, as passed to start().
+        completed : set
+            Set of completed (z_slice, channel) tuples.
+        """
+        settings = None
+        completed = set()
+        with open(self.journal_filename) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line may be cut short by a crash
+                    logger.warning("Skipping incomplete journal entry: "
+                                   "{}".format(line))
+                    continue
+                if 'settings' in entry:
+                    settings = entry['settings']
+                elif 'completed' in entry:
+                    completed.add(tuple(entry['completed']))
+        if settings is None:
+            raise ValueError("No acquisition settings found in journal "
+                             "{}".format(self.journal_filename))
+        return settings, completed
+
+    def open_volume(self):
+        """Memory-map the partially acquired volume for writing."""
+        return tifffile.memmap(self.volume_filename, mode='r+')
@@ -1,5 +1,6 @@
 """Module for the Basler fluorescence detector."""
 import sys
+import time
 
 import numpy as np
 
@@ -61,6 +62,72 @@ class Basler():
             self.image = np.flipud(self.image)
         return self.image
 
+    def free_run(self, num_frames, exposure_time=None, frame_rate=None,
+                 flip_image=True):
+        """Grab a sequence of images with the camera running continuously.
+
+        Parameters
+        ----------
+        num_frames : int
+            Number of images to grab.
+        exposure_time : int, optional
+            Exposure time, in microseconds (us).
+        frame_rate : float, optional
+            Acquisition frame rate in frames per second. By default None,
+            meaning the camera runs as fast as the exposure time allows.
+
+        Returns
+        -------
+        images : numpy array
+            Images with shape (num_frames, rows, columns).
+        timestamps : numpy array
+            Time each image was received, from time.perf_counter(), in seconds.
+        """
+        self.camera.Open()
+        self.camera.ExposureMode.SetValue('Timed')
+        try:
+            if exposure_time is not None:
+                try:
+                    self.camera.ExposureTime.SetValue(float(exposure_time))
+                except Exception:
+                    self.camera.ExposureTimeAbs.SetValue(float(exposure_time))
+            if frame_rate is not None:
+                self.camera.AcquisitionFrameRateEnable.SetValue(True)
+                try:
+                    self.camera.AcquisitionFrameRate.SetValue(
+                        float(frame_rate))
+                except Exception:
+                    self.camera.AcquisitionFrameRateAbs.SetValue(
+                        float(frame_rate))
+        except Exception as e:
+            self.camera.Close()
+            raise e
+
+        images = []
+        timestamps = []
+        self.camera.StartGrabbingMax(int(num_frames))
+        try:
+            while self.camera.IsGrabbing():
+                grabResult = self.camera.RetrieveResult(
+                    5000, pylon.TimeoutHandling_ThrowException)
+                timestamps.append(time.perf_counter())
+                if grabResult.GrabSucceeded():
+                    images.append(grabResult.Array)
+                else:
+                    raise RuntimeError("Error: " + str(grabResult.ErrorCode)
+                                       + '\n' + grabResult.ErrorDescription)
+                grabResult.Release()
+        finally:
+            self.camera.StopGrabbing()
+            if frame_rate is not None:
+                self.camera.AcquisitionFrameRateEnable.SetValue(False)
+            self.camera.Close()
+        images = np.stack(images)
+        if flip_image is True:
+            images = images[:, ::-1, :]
+        self.image = images[-1]
+        return images, np.array(timestamps)
+
     def minimum_exposure(self):
         """Minimum alloable exposure time."""
         try:
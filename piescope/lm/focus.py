@@ -0,0 +1,340 @@
+"""Module for image signal and focus metrics, and objective autofocus.
+
+The metrics are vectorized with numpy, and work on a subsample of the image
+so they are cheap enough to run on every frame during an acquisition.
+"""
+import logging
+import math
+import time
+
+import numpy as np
+
+import piescope.utils
+
+logger = logging.getLogger(__name__)
+
+
+def signal_metric(image, step=4):
+    """Signal level of an image above its background.
+
+    Parameters
+    ----------
+    image : ndarray
+        2D image.
+    step : int, optional
+        Only every step-th pixel in each dimension is used, by default 4.
+
+    Returns
+    -------
+    float
+        99th percentile minus the median (background) pixel value.
+    """
+    pixels = np.asarray(image)[::step, ::step]
+    background, high = piescope.utils.approximate_percentile(
+        pixels, (50, 99), max_samples=pixels.size)
+    return float(high - background)
+
+
+def variance_of_laplacian(image):
+    """Focus metric: variance of the image Laplacian.
+
+    Parameters
+    ----------
+    image : ndarray
+        2D image.
+
+    Returns
+    -------
+    float
+        Larger values are more in focus.
+    """
+    image = np.asarray(image, dtype=np.float32)
+    laplacian = (image[:-2, 1:-1] + image[2:, 1:-1] + image[1:-1, :-2]
+                 + image[1:-1, 2:] - 4 * image[1:-1, 1:-1])
+    return float(laplacian.var())
+
+
+def brenner_gradient(image):
+    """Focus metric: Brenner gradient, mean squared difference of pixels
+    two apart, in both image dimensions.
+
+    Parameters
+    ----------
+    image : ndarray
+        2D image.
+
+    Returns
+    -------
+    float
+        Larger values are more in focus.
+    """
+    image = np.asarray(image, dtype=np.float32)
+    horizontal = image[:, 2:] - image[:, :-2]
+    vertical = image[2:, :] - image[:-2, :]
+    return float(np.mean(horizontal ** 2) + np.mean(vertical ** 2))
+
+
+def normalized_variance(image):
+    """Focus metric: image variance divided by the mean intensity.
+
+    Parameters
+    ----------
+    image : ndarray
+        2D image.
+
+    Returns
+    -------
+    float
+        Larger values are more in focus.
+    """
+    image = np.asarray(image, dtype=np.float32)
+    mean = image.mean()
+    if mean == 0:
+        return 0.
+    return float(image.var() / mean)
+
+
+METRICS = {
+    'signal': signal_metric,
+    'variance_of_laplacian': variance_of_laplacian,
+    'brenner': brenner_gradient,
+    'normalized_variance': normalized_variance,
+}
+
+
+def _get_metric(metric):
+    if callable(metric):
+        return metric
+    try:
+        return METRICS[metric]
+    except KeyError:
+        raise ValueError("Unknown image metric '{}'. Expected a callable or "
+                         "one of {}".format(metric, sorted(METRICS)))
+
+
+class AdaptiveZRange():
+    """Skip empty slices of a volume, using the signal of a reference channel.
+
+    At each z slice the reference channel is imaged first, and its signal
+    metric decides whether to image the other channels.
+
+    Parameters
+    ----------
+    reference_channel : str
+        Laser name of the reference channel, eg: "laser488".
+    threshold : float
+        Images with a signal metric below the threshold count as empty.
+    patience : int, optional
+        Number of consecutive empty slices before slices are skipped,
+        by default 3.
+    mode : {'stop', 'skip'}, optional
+        * 'stop': stop the sweep once the signal falls below the threshold
+          for patience consecutive slices, after having been above it.
+        * 'skip': only image the reference channel while the signal has been
+          below the threshold for patience consecutive slices.
+        By default 'stop'.
+    metric : str or callable, optional
+        Name of a metric in METRICS, or a function taking an image and
+        returning a float. By default 'signal', see signal_metric().
+
+    Attributes
+    ----------
+    signal : dict
+        Signal metric of the reference channel at each z slice imaged.
+    stopped : bool
+        Whether the sweep has been stopped.
+    """
+    MODES = ('stop', 'skip')
+
+    def __init__(self, reference_channel, threshold, patience=3,
+                 mode='stop', metric='signal'):
+        if mode not in self.MODES:
+            raise ValueError("Unknown adaptive z range mode '{}'. Expected "
+                             "one of {}".format(mode, self.MODES))
+        self.reference_channel = reference_channel
+        self.threshold = float(threshold)
+        self.patience = int(patience)
+        self.mode = mode
+        self.metric = _get_metric(metric)
+        self.reset()
+
+    def reset(self):
+        """Forget the signal seen so far, eg: before a new volume."""
+        self.signal = {}
+        self.stopped = False
+        self._low_count = 0
+        self._seen_signal = False
+
+    def update(self, z_slice, image):
+        """Compute the signal metric of a reference channel image.
+
+        Parameters
+        ----------
+        z_slice : int
+            Volume z slice index.
+        image : ndarray
+            Reference channel image at this z slice.
+
+        Returns
+        -------
+        float
+            Signal metric of the image.
+        """
+        value = self.metric(image)
+        self.signal[z_slice] = value
+        if value < self.threshold:
+            self._low_count += 1
+        else:
+            self._low_count = 0
+            self._seen_signal = True
+        if (self.mode == 'stop' and self._seen_signal
+                and self._low_count >= self.patience):
+            logger.info("Signal below threshold for {} slices, stopping "
+                        "the sweep at z_slice {}".format(self.patience,
+                                                         z_slice))
+            self.stopped = True
+        return value
+
+    def skip(self, laser_name):
+        """Whether to skip the next image with this laser.
+
+        Parameters
+        ----------
+        laser_name : str
+            Laser name of the next image.
+
+        Returns
+        -------
+        bool
+            True if the image should be skipped.
+        """
+        if self.stopped:
+            return True
+        if self.mode == 'skip' and laser_name != self.reference_channel:
+            return self._low_count >= self.patience
+        return False
+
+
+AUTOFOCUS_METHODS = ('golden', 'coarse_to_fine')
+_INVERSE_GOLDEN_RATIO = (math.sqrt(5) - 1) / 2
+
+
+def autofocus(detector, objective_stage, search_range=20000, tolerance=200,
+              method='golden', coarse_steps=5, metric='variance_of_laplacian',
+              roi=None, downsample_factor=2, exposure_time=None, laser=None,
+              time_delay=0.1):
+    """Move the objective lens stage to the position of best focus.
+
+    The search starts with a coarse scan across the search range, to
+    bracket the focus, then refines it with a golden-section search
+    (one new image per iteration) or repeated finer scans.
+    Images are cropped to the region of interest and downsampled before
+    computing the focus metric.
+
+    Parameters
+    ----------
+    detector : piescope.lm.detector.Basler()
+        Fluorescence detector class instance.
+    objective_stage : piescope.lm.objective.StageController()
+        Objective lens stage class instance.
+    search_range : int, optional
+        Total height in nm to search, centered on the current stage
+        position. By default 20000 nm (20 microns).
+    tolerance : int, optional
+        Stop once the focus position is known to within this many nm,
+        by default 200 nm.
+    method : {'golden', 'coarse_to_fine'}, optional
+        Refinement method after the coarse scan, by default 'golden'.
+    coarse_steps : int, optional
+        Number of stage positions in each coarse scan, at least 4 so each
+        scan narrows the bracket. By default 5.
+    metric : str or callable, optional
+        Focus metric, the name of a function in METRICS or a function
+        taking an image and returning a float.
+        By default 'variance_of_laplacian'.
+    roi : tuple of slice, optional
+        Region of interest (rows, columns) to crop the images to,
+        eg: (slice(100, 400), slice(200, 600)). By default the whole image.
+    downsample_factor : int, optional
+        Block averaging factor applied to the images, by default 2.
+    exposure_time : int, optional
+        Exposure time in microseconds, by default None.
+    laser : piescope.lm.laser.Laser(), optional
+        Laser to switch on during each image, by default None.
+    time_delay : float, optional
+        Pause after each stage movement, by default 0.1 seconds.
+
+    Returns
+    -------
+    dict
+        Dictionary with keys 'position' (best focus position in nm),
+        'metric' (focus metric there), 'num_grabs' (number of images taken)
+        and 'evaluations' (list of (position, metric) tuples).
+
+    Raises
+    ------
+    ValueError
+        Raised if the autofocus method is not recognised.
+    """
+    if method not in AUTOFOCUS_METHODS:
+        raise ValueError("Unknown autofocus method '{}'. Expected one of "
+                         "{}".format(method, AUTOFOCUS_METHODS))
+    metric_function = _get_metric(metric)
+    center = float(objective_stage.current_position())
+    evaluations = {}
+
+    def focus(position):
+        position = int(round(position))
+        if position not in evaluations:
+            objective_stage.move_absolute(position)
+            time.sleep(time_delay)
+            if laser is not None:
+                laser.emission_on()
+            try:
+                image = detector.camera_grab(exposure_time)
+            finally:
+                if laser is not None:
+                    laser.emission_off()
+            if roi is not None:
+                image = image[roi]
+            evaluations[position] = metric_function(
+                piescope.utils.downsample(image, downsample_factor,
+                                          edges='drop', dtype=np.float32))
+            logger.debug("Autofocus position: {}, metric: {}".format(
+                position, evaluations[position]))
+        return evaluations[position]
+
+    low, high = center - search_range / 2., center + search_range / 2.
+    coarse_steps = max(int(coarse_steps), 4)
+    while True:
+        # Scan the bracket, then narrow it around the best position
+        positions = np.linspace(low, high, coarse_steps)
+        values = [focus(position) for position in positions]
+        best = int(np.argmax(values))
+        step = positions[1] - positions[0]
+        low = max(positions[best] - step, low)
+        high = min(positions[best] + step, high)
+        if method == 'golden' or step <= tolerance:
+            break
+    if method == 'golden':
+        a, b = low, high
+        c = b - _INVERSE_GOLDEN_RATIO * (b - a)
+        d = a + _INVERSE_GOLDEN_RATIO * (b - a)
+        while b - a > tolerance:
+            if focus(c) > focus(d):
+                b, d = d, c
+                c = b - _INVERSE_GOLDEN_RATIO * (b - a)
+            else:
+                a, c = c, d
+                d = a + _INVERSE_GOLDEN_RATIO * (b - a)
+    best_position = max(evaluations, key=evaluations.get)
+    objective_stage.move_absolute(best_position)
+    time.sleep(time_delay)
+    logger.info("Autofocus found best focus at {} nm after {} images".format(
+        best_position, len(evaluations)))
+    return {
+        'position': best_position,
+        'metric': evaluations[best_position],
+        'num_grabs': len(evaluations),
+        'evaluations': sorted(evaluations.items()),
+    }
@@ -4,6 +4,7 @@ SMARACT stage hardware.
 """
 import logging
 import socket
+import threading
 
 logger = logging.getLogger(__name__)
 
@@ -37,6 +38,9 @@ class StageController(socket.socket):
         """
         super().__init__(family=socket.AF_INET, type=socket.SOCK_STREAM)
         self.settimeout(timeout)
+        # Pairs each command with its reply when several threads use the
+        # stage, eg: a sweep acquisition sampling the stage position
+        self._command_lock = threading.Lock()
         if not testing:
             # try:
             self.connect((host, port))
@@ -223,6 +227,31 @@ class StageController(socket.socket):
         else:
             return ans
 
+    def set_closed_loop_speed(self, speed):
+        """Set the speed of closed loop movements of the objective lens stage.
+
+        Parameters
+        ----------
+        speed : int
+            Speed in nanometers per second (nm/s).
+            0 disables speed control, so the stage moves at full speed.
+
+        Returns
+        -------
+        ans : string
+            Return string from the stage controller.
+            Gives information about whether or not call succeeded.
+        """
+        try:
+            cmd = 'SCLS0,' + str(int(speed))
+            ans = self.send_command(cmd)
+        except Exception as e:
+            logger.error(e)
+            logger.error("Unable to set the stage speed.")
+            raise e
+        else:
+            return ans
+
     def current_position(self):
         """Current position of the fluorescence objective lens stage.
 
@@ -265,12 +294,13 @@ class StageController(socket.socket):
         Raises an exception if unable to send the command through the socket.
         """
         cmd = bytes(pre_string + cmd + post_string, 'utf-8')
-        try:
-            self.sendall(cmd)
-        except Exception as e:
-            logger.error(e)
-            logger.error("Unable to send command to controller: "
-                         "{}".format(cmd))
-            raise e
-        else:
-            return self.recv(1024)
+        with self._command_lock:
+            try:
+                self.sendall(cmd)
+            except Exception as e:
+                logger.error(e)
+                logger.error("Unable to send command to controller: "
+                             "{}".format(cmd))
+                raise e
+            else:
+                return self.recv(1024)
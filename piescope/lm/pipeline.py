@@ -0,0 +1,223 @@
+"""Module for pipelined image acquisition.
+
+Frame handling (copying into the volume array, disk writes and any other
+per-frame processing) runs in a background thread, so it can overlap with
+objective stage movements. Camera exposures, laser switching and stage
+movements always stay in the calling thread, in their original order.
+"""
+import collections
+import contextlib
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StageTimer():
+    """Record the time spent busy in each stage of an acquisition.
+
+    Stages are timed with the stage() context manager, from any thread.
+    Stages running in different threads may overlap, so the utilization
+    of all stages can add up to more than one.
+    """
+    def __init__(self):
+        self.busy_time = collections.defaultdict(float)
+        self.counts = collections.defaultdict(int)
+        self.start_time = None
+        self.stop_time = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the wall clock for the acquisition."""
+        self.start_time = time.perf_counter()
+        self.stop_time = None
+
+    def resume(self):
+        """Start the wall clock, or keep it running if it already started.
+
+        Acquisitions call resume() rather than start(), so a timer shared by
+        several volumes, eg: of a multi-position acquisition or time-lapse,
+        keeps a single wall clock, and all its stage times add up within it.
+        """
+        if self.start_time is None:
+            self.start()
+        else:
+            self.stop_time = None
+
+    def stop(self):
+        """Stop the wall clock for the acquisition."""
+        self.stop_time = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name, **args):
+        """Context manager timing one run of an acquisition stage.
+
+        Parameters
+        ----------
+        name : str
+            Stage name, eg: 'grab', 'move', 'settle' or 'write'.
+        **args
+            Details of this run, eg: z_slice=3. Only kept by subclasses
+            recording individual runs, see piescope.lm.trace.Tracer.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, start, time.perf_counter(), args)
+
+    def _record(self, name, start, stop, args):
+        with self._lock:
+            self.busy_time[name] += stop - start
+            self.counts[name] += 1
+
+    @property
+    def wall_time(self):
+        """Elapsed wall time in seconds since start() was called."""
+        if self.start_time is None:
+            return 0.
+        stop_time = self.stop_time
+        if stop_time is None:
+            stop_time = time.perf_counter()
+        return stop_time - self.start_time
+
+    def utilization(self):
+        """Fraction of the wall time each stage was busy.
+
+        Returns
+        -------
+        dict
+            Dictionary with structure {"stage name": fraction}
+        """
+        wall_time = self.wall_time
+        if wall_time <= 0:
+            return {name: 0. for name in self.busy_time}
+        return {name: busy_time / wall_time
+                for name, busy_time in self.busy_time.items()}
+
+    def report(self):
+        """Human readable summary of the time spent in each stage."""
+        lines = ["Wall time: {:.3f} s".format(self.wall_time)]
+        utilization = self.utilization()
+        for name, busy_time in sorted(self.busy_time.items(),
+                                      key=lambda item: -item[1]):
+            lines.append("{}: {:.3f} s, {} calls, {:.1%} utilization".format(
+                name, busy_time, self.counts[name], utilization[name]))
+        return "\n".join(lines)
+
+
+class FrameWriter():
+    """Write acquired frames into a volume array.
+
+    With pipelined=True the frames are handed to a background thread
+    through a bounded queue, so the next stage movement can start while
+    the previous frames are still being written. Errors raised in the
+    background thread are re-raised in the calling thread by the next
+    call to put() or close().
+
+    Parameters
+    ----------
+    volume : numpy array
+        Volume array with shape (z_slices, columns, rows, channels).
+    pipelined : bool, optional
+        Whether to write frames in a background thread, by default True.
+    maxsize : int, optional
+        Maximum number of frames waiting in the queue, by default 8.
+        put() blocks when the queue is full, limiting memory use.
+    timer : StageTimer, optional
+        Records the time spent writing frames, and waiting for the queue.
+    callbacks : list of callable, optional
+        Functions called as callback(z_slice, channel, frame) after each
+        frame has been written into the volume.
+    """
+    DEFAULT_MAXSIZE = 8
+
+    def __init__(self, volume, pipelined=True, maxsize=DEFAULT_MAXSIZE,
+                 timer=None, callbacks=None):
+        self.volume = volume
+        self.callbacks = list(callbacks) if callbacks is not None else []
+        self.timer = timer if timer is not None else StageTimer()
+        self.error = None
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        if pipelined:
+            self._thread = threading.Thread(target=self._run, daemon=True,
+                                            name='FrameWriter')
+            self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._stop()  # don't hide the original exception
+
+    @property
+    def queue_depth(self):
+        """Number of frames waiting to be written."""
+        return self._queue.qsize()
+
+    def put(self, z_slice, channel, frame):
+        """Write a frame into the volume at (z_slice, channel).
+
+        Parameters
+        ----------
+        z_slice : int
+            Volume z slice index.
+        channel : int
+            Volume channel index.
+        frame : numpy array
+            Image with shape (columns, rows).
+            The frame must not be modified after it is passed in.
+        """
+        if self._thread is None:
+            self._write(z_slice, channel, frame)
+            return
+        self._raise_error()
+        with self.timer.stage('queue'):
+            self._queue.put((z_slice, channel, frame))
+
+    def close(self):
+        """Wait for all queued frames to be written.
+
+        Raises
+        ------
+        Exception
+            Any error raised while writing frames in the background thread.
+        """
+        self._stop()
+        self._raise_error()
+
+    def _stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _write(self, z_slice, channel, frame):
+        with self.timer.stage('write', z_slice=z_slice, channel=channel):
+            self.volume[z_slice, :, :, channel] = frame
+            for callback in self.callbacks:
+                callback(z_slice, channel, frame)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue  # drain the queue after an error
+            try:
+                self._write(*item)
+            except Exception as e:
+                logger.error("Error writing frame: {}".format(e))
+                self.error = e
@@ -0,0 +1,403 @@
+"""Module for planning fluorescence volume acquisitions.
+
+An acquisition plan is a list of (z_slice, channel) tuples, in the order
+the images are acquired. The objective lens stage only moves when the
+z_slice changes between consecutive steps of the plan.
+"""
+import json
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ACQUISITION_ORDERS = ('interleaved', 'channel_major', 'snake')
+POSITION_ORDER_METHODS = ('nearest_neighbour', 'two_opt')
+
+
+class TimingModel():
+    """Timing model of the fluorescence microscope hardware.
+
+    Parameters
+    ----------
+    settle_time : float, optional
+        Pause after each objective stage movement, in seconds.
+        Equivalent to the time_delay argument of volume_acquisition().
+        By default 1 second.
+    move_overhead : float, optional
+        Fixed time for each objective stage movement, in seconds.
+        Includes the socket round trip to the stage controller.
+        By default 0.05 seconds.
+    stage_speed : float, optional
+        Objective stage speed in nanometers per second.
+        By default 1e6 nm/s (1 mm/s).
+    channel_switch_time : float, optional
+        Time to switch from one laser channel to another, in seconds.
+        Includes changing the camera exposure time.
+        By default 0.02 seconds.
+    grab_overhead : float, optional
+        Time for each camera grab in addition to the exposure, in seconds.
+        Includes opening the camera, readout and transfer.
+        By default 0.1 seconds.
+    laser_time : float, optional
+        Time to switch the laser emission on and off for each image,
+        in seconds. By default 0.01 seconds.
+    correction_time : float, optional
+        Average time checking and correcting the stage position after each
+        movement, in seconds. Includes any retries. By default 0.01 seconds.
+    """
+    PARAMETERS = ('settle_time', 'move_overhead', 'stage_speed',
+                  'channel_switch_time', 'grab_overhead', 'laser_time',
+                  'correction_time')
+
+    def __init__(self, settle_time=1., move_overhead=0.05, stage_speed=1e6,
+                 channel_switch_time=0.02, grab_overhead=0.1, laser_time=0.01,
+                 correction_time=0.01):
+        self.settle_time = float(settle_time)
+        self.move_overhead = float(move_overhead)
+        self.stage_speed = float(stage_speed)
+        self.channel_switch_time = float(channel_switch_time)
+        self.grab_overhead = float(grab_overhead)
+        self.laser_time = float(laser_time)
+        self.correction_time = float(correction_time)
+
+    def __repr__(self):
+        parameters = ", ".join("{}={}".format(name, getattr(self, name))
+                               for name in self.PARAMETERS)
+        return "TimingModel({})".format(parameters)
+
+    def move_time(self, distance):
+        """Time in seconds to move the stage a distance in nm and settle."""
+        return (self.move_overhead + abs(distance) / self.stage_speed
+                + self.settle_time + self.correction_time)
+
+    def grab_time(self, exposure_time):
+        """Time in seconds to grab an image, exposure time in microseconds."""
+        return self.grab_overhead + float(exposure_time) * 1e-6
+
+    def to_dict(self):
+        """Dictionary of the timing model parameters."""
+        return {name: getattr(self, name) for name in self.PARAMETERS}
+
+    def save(self, filename):
+        """Save the timing model parameters to a JSON file."""
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+    @classmethod
+    def load(cls, filename):
+        """Load a timing model from a JSON file saved with save()."""
+        with open(filename) as f:
+            parameters = json.load(f)
+        return cls(**parameters)
+
+    @classmethod
+    def from_timer(cls, timer, laser_dict, default=None):
+        """Calibrate a timing model from a previous volume acquisition.
+
+        Parameters
+        ----------
+        timer : piescope.lm.pipeline.StageTimer
+            Timer passed to a previous volume_acquisition() call.
+        laser_dict : dict
+            The laser_dict used for that volume acquisition.
+        default : TimingModel, optional
+            Timing model to take any parameters the timer has no
+            measurements for. Default value is None, which uses the
+            default TimingModel().
+
+        Returns
+        -------
+        TimingModel
+            Timing model calibrated to the measured stage durations.
+            The stage distance dependence is folded into move_overhead.
+        """
+        if default is None:
+            default = cls()
+        parameters = default.to_dict()
+        busy_time, counts = timer.busy_time, timer.counts
+
+        def mean_time(stage):
+            return busy_time[stage] / counts[stage]
+
+        if counts['grab'] > 0:
+            exposure_times = [exposure for (_, exposure) in laser_dict.values()]
+            mean_exposure = sum(exposure_times) / len(exposure_times) * 1e-6
+            parameters['grab_overhead'] = max(
+                mean_time('grab') - mean_exposure, 0.)
+        if counts['laser'] > 0:
+            parameters['laser_time'] = 2 * mean_time('laser')  # on and off
+        if counts['move'] > 0:
+            parameters['move_overhead'] = mean_time('move')
+            parameters['stage_speed'] = float('inf')
+        if counts['settle'] > 0:
+            parameters['settle_time'] = mean_time('settle')
+        if counts['correction'] > 0:
+            parameters['correction_time'] = mean_time('correction')
+        return cls(**parameters)
+
+
+def acquisition_plan(num_z_slices, num_channels, order='interleaved'):
+    """Order of the (z_slice, channel) steps for a volume acquisition.
+
+    Parameters
+    ----------
+    num_z_slices : int
+        Amount of slices to take for total volume.
+    num_channels : int
+        Number of laser channels.
+    order : str, optional
+        One of:
+        * 'interleaved': all channels at each z slice, then move the stage.
+        * 'channel_major': a full z sweep for each channel in turn,
+          returning to the top of the volume between channels.
+        * 'snake': a full z sweep for each channel in turn,
+          alternating the sweep direction between channels.
+        By default 'interleaved'.
+
+    Returns
+    -------
+    list of tuple
+        List of (z_slice, channel) tuples, in acquisition order.
+
+    Raises
+    ------
+    ValueError
+        Raised if the acquisition order is not recognised.
+    """
+    z_slices = range(int(num_z_slices))
+    channels = range(int(num_channels))
+    if order == 'interleaved':
+        return [(z, c) for z in z_slices for c in channels]
+    elif order == 'channel_major':
+        return [(z, c) for c in channels for z in z_slices]
+    elif order == 'snake':
+        return [(z, c) for c in channels
+                for z in (z_slices if c % 2 == 0 else reversed(z_slices))]
+    else:
+        raise ValueError("Unknown acquisition order '{}'. Expected one of "
+                         "{}".format(order, ACQUISITION_ORDERS))
+
+
+def plan_phase_times(plan, exposure_times, z_slice_distance, timing):
+    """Estimated time in seconds spent in each phase of an acquisition plan.
+
+    The estimate does not include the initial move to the top of the
+    volume, which is the same for every acquisition order.
+
+    Parameters
+    ----------
+    plan : list of tuple
+        List of (z_slice, channel) tuples, see acquisition_plan().
+    exposure_times : list
+        Exposure time in microseconds for each channel.
+    z_slice_distance : int
+        Distance in nm between each z slice.
+    timing : TimingModel
+        Timing model for the microscope hardware.
+
+    Returns
+    -------
+    dict
+        Estimated time in seconds for each phase, with keys
+        'grab', 'laser', 'channel_switch', 'move', 'settle' and 'retries'.
+    """
+    phases = dict.fromkeys(('grab', 'laser', 'channel_switch', 'move',
+                            'settle', 'retries'), 0.)
+    previous_z, previous_channel = plan[0] if plan else (None, None)
+    for z_slice, channel in plan:
+        if z_slice != previous_z:
+            distance = (z_slice - previous_z) * z_slice_distance
+            phases['move'] += (timing.move_overhead
+                               + abs(distance) / timing.stage_speed)
+            phases['settle'] += timing.settle_time
+            phases['retries'] += timing.correction_time
+        if channel != previous_channel:
+            phases['channel_switch'] += timing.channel_switch_time
+        phases['grab'] += timing.grab_time(exposure_times[channel])
+        phases['laser'] += timing.laser_time
+        previous_z, previous_channel = z_slice, channel
+    return phases
+
+
+def plan_time(plan, exposure_times, z_slice_distance, timing):
+    """Estimated time in seconds to carry out an acquisition plan.
+
+    See plan_phase_times() for a breakdown of the estimate by phase.
+
+    Parameters
+    ----------
+    plan : list of tuple
+        List of (z_slice, channel) tuples, see acquisition_plan().
+    exposure_times : list
+        Exposure time in microseconds for each channel.
+    z_slice_distance : int
+        Distance in nm between each z slice.
+    timing : TimingModel
+        Timing model for the microscope hardware.
+
+    Returns
+    -------
+    float
+        Estimated acquisition time in seconds.
+    """
+    return sum(plan_phase_times(
+        plan, exposure_times, z_slice_distance, timing).values())
+
+
+def plan_acquisition(laser_dict, num_z_slices, z_slice_distance,
+                     timing=None, orders=ACQUISITION_ORDERS):
+    """Choose the fastest acquisition order for a volume.
+
+    Parameters
+    ----------
+    laser_dict : dict
+        Dictionary with structure: {"name": (power, exposure)} with types
+        {str: (int, int)}
+    num_z_slices : int
+        Amount of slices to take for total volume.
+    z_slice_distance : int
+        Distance in nm between each z slice.
+    timing : TimingModel, optional
+        Timing model for the microscope hardware.
+        Default value is None, which uses the default TimingModel().
+    orders : tuple of str, optional
+        Acquisition orders to choose from, by default all of them.
+
+    Returns
+    -------
+    order : str
+        Name of the fastest acquisition order.
+    plan : list of tuple
+        List of (z_slice, channel) tuples, in acquisition order.
+    """
+    if timing is None:
+        timing = TimingModel()
+    exposure_times = [exposure for (power, exposure) in laser_dict.values()]
+    best = None
+    for order in orders:
+        plan = acquisition_plan(num_z_slices, len(laser_dict), order=order)
+        estimate = plan_time(plan, exposure_times, z_slice_distance, timing)
+        logger.debug("Acquisition order '{}' estimated time: "
+                     "{:.3f} s".format(order, estimate))
+        if best is None or estimate < best[0]:
+            best = (estimate, order, plan)
+    estimate, order, plan = best
+    return order, plan
+
+
+def path_length(positions, start=None):
+    """Total travel distance visiting positions in the order given.
+
+    Parameters
+    ----------
+    positions : array-like
+        Array of (x, y) stage positions with shape (N, 2).
+    start : tuple, optional
+        (x, y) stage position before visiting the first position.
+
+    Returns
+    -------
+    float
+        Total travel distance, in the same units as the positions.
+    """
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+    if start is not None:
+        positions = np.concatenate([np.reshape(start, (1, 2)), positions])
+    steps = np.diff(positions, axis=0)
+    return float(np.sum(np.hypot(steps[:, 0], steps[:, 1])))
+
+
+def order_positions(positions, start=None, method='two_opt',
+                    max_iterations=100):
+    """Order stage positions to minimize the total stage travel.
+
+    The route is built with a nearest neighbour heuristic, then optionally
+    improved with 2-opt segment reversals until no reversal shortens it.
+    Both steps are vectorized with numpy and stay fast for hundreds of
+    positions.
+
+    Parameters
+    ----------
+    positions : array-like
+        Array of (x, y) stage positions with shape (N, 2).
+    start : tuple, optional
+        Current (x, y) stage position the route starts from.
+        Default value is None, which starts from the first position.
+    method : {'nearest_neighbour', 'two_opt'}, optional
+        Route heuristic, by default 'two_opt'.
+    max_iterations : int, optional
+        Maximum number of 2-opt passes over the route, by default 100.
+
+    Returns
+    -------
+    numpy array
+        Indices into positions, in the order to visit them.
+
+    Raises
+    ------
+    ValueError
+        Raised if the route heuristic is not recognised.
+    """
+    if method not in POSITION_ORDER_METHODS:
+        raise ValueError("Unknown position ordering method '{}'. Expected "
+                         "one of {}".format(method, POSITION_ORDER_METHODS))
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+    if len(positions) < 2:
+        return np.arange(len(positions))
+    # Node zero is the start of the route, which never moves
+    if start is None:
+        points = positions
+    else:
+        points = np.concatenate([np.reshape(start, (1, 2)), positions])
+    differences = points[:, np.newaxis, :] - points[np.newaxis, :, :]
+    distances = np.hypot(differences[..., 0], differences[..., 1])
+
+    route = _nearest_neighbour_route(distances)
+    if method == 'two_opt':
+        route = _two_opt_route(route, distances, max_iterations)
+    if start is not None:
+        route = route[1:] - 1
+    return route
+
+
+def _nearest_neighbour_route(distances):
+    """Greedy route from node zero, always visiting the closest node next."""
+    num_nodes = len(distances)
+    route = np.zeros(num_nodes, dtype=np.intp)
+    unvisited = np.ones(num_nodes, dtype=bool)
+    unvisited[0] = False
+    for step in range(1, num_nodes):
+        candidates = np.where(unvisited, distances[route[step - 1]], np.inf)
+        route[step] = np.argmin(candidates)
+        unvisited[route[step]] = False
+    return route
+
+
+def _two_opt_route(route, distances, max_iterations=100):
+    """Improve an open route by reversing segments, keeping node zero first.
+
+    Reversing route[i:j + 1] replaces edges (i - 1, i) and (j, j + 1) with
+    (i - 1, j) and (i, j + 1). All choices of j are checked at once.
+    """
+    route = route.copy()
+    num_nodes = len(route)
+    for _ in range(max_iterations):
+        improved = False
+        for i in range(1, num_nodes - 1):
+            a, b = route[i - 1], route[i]
+            j = np.arange(i + 1, num_nodes)
+            c = route[j]
+            delta = distances[a, c] - distances[a, b]
+            has_next = j + 1 < num_nodes
+            d = route[j[has_next] + 1]
+            delta[has_next] += (distances[b, d]
+                                - distances[c[has_next], d])
+            best = np.argmin(delta)
+            if delta[best] < -1e-12:
+                end = j[best]
+                route[i:end + 1] = route[i:end + 1][::-1]
+                improved = True
+        if not improved:
+            break
+    return route
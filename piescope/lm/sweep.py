@@ -0,0 +1,258 @@
+"""Module for continuous-sweep z acquisitions.
+
+Instead of stopping and settling at every z slice, the objective stage moves
+at a constant speed across the whole volume while the detector runs at a
+fixed frame rate. The stage position is sampled in a background thread, and
+the z position of each image is interpolated from the image timestamps.
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+
+import piescope.lm.volume
+from piescope.lm.pipeline import StageTimer
+
+logger = logging.getLogger(__name__)
+
+
+class PositionSampler():
+    """Sample the objective stage position in a background thread.
+
+    Parameters
+    ----------
+    objective_stage : piescope.lm.objective.StageController()
+        Objective lens stage class instance.
+    interval : float, optional
+        Time in seconds between position samples, by default 0.005 seconds.
+
+    Attributes
+    ----------
+    times : list of float
+        Time of each sample, from time.perf_counter(), in seconds.
+        Each sample is timed half way through its position query.
+    positions : list of float
+        Stage position of each sample, in nm.
+    """
+    def __init__(self, objective_stage, interval=0.005):
+        self.objective_stage = objective_stage
+        self.interval = interval
+        self.times = []
+        self.positions = []
+        self.error = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop(raise_error=exc_type is None)
+
+    def start(self):
+        """Start sampling the stage position."""
+        self.times = []
+        self.positions = []
+        self.error = None
+        self._stop_event.clear()
+        self._sample()  # the first sample is taken before returning
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='PositionSampler')
+        self._thread.start()
+
+    def stop(self, raise_error=True):
+        """Stop sampling the stage position.
+
+        Raises
+        ------
+        Exception
+            Any error raised while sampling the position in the background.
+        """
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+            self._sample()
+        if raise_error and self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _sample(self):
+        start = time.perf_counter()
+        position = float(self.objective_stage.current_position())
+        stop = time.perf_counter()
+        self.times.append((start + stop) / 2.)
+        self.positions.append(position)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self._sample()
+            except Exception as e:
+                logger.error("Error sampling stage position: {}".format(e))
+                self.error = e
+                break
+
+
+def interpolate_positions(frame_times, sample_times, sample_positions):
+    """Stage position at each frame time, from timed position samples.
+
+    Parameters
+    ----------
+    frame_times : array_like
+        Time of each frame, in seconds.
+    sample_times : array_like
+        Increasing time of each position sample, in seconds.
+    sample_positions : array_like
+        Stage position of each sample, in nm.
+
+    Returns
+    -------
+    numpy array
+        Linearly interpolated stage position in nm at each frame time.
+        Frames outside the sampled time range get the nearest sample position.
+    """
+    return np.interp(np.asarray(frame_times, dtype=float),
+                     np.asarray(sample_times, dtype=float),
+                     np.asarray(sample_positions, dtype=float))
+
+
+def sweep_acquisition(laser_dict, num_z_slices, z_slice_distance,
+                      frame_rate=None, time_delay=1, direction='down',
+                      detector=None, lasers=None, objective_stage=None,
+                      sample_interval=0.005, timestamp_offset=None,
+                      return_to_center=True, timer=None):
+    """Acquire a single channel image volume in one continuous z sweep.
+
+    The objective stage moves at a constant speed of
+    z_slice_distance * frame_rate from one end of the volume to the other
+    while the detector runs freely, so there is no settle time per slice.
+    Because the stage keeps moving, each image is slightly blurred in z
+    over its exposure time.
+
+    Parameters
+    ----------
+    laser_dict : dict
+        Dictionary with structure: {"name": (power, exposure)} with types
+        {str: (int, int)}, holding a single laser.
+    num_z_slices : int
+        Amount of images to take during the sweep.
+    z_slice_distance : int
+        Distance in nm travelled by the stage between consecutive images.
+    frame_rate : float, optional
+        Detector frame rate in frames per second. By default None, which is
+        the fastest the exposure time allows. If the detector runs slower
+        than requested, the stage reaches the end of the volume early and
+        the last images are all taken there.
+    time_delay : float, optional
+        Pause after moving to the start of the sweep, by default 1 second.
+    direction : {'down', 'up'}, optional
+        Sweep from the top of the volume down, or from the bottom up.
+        Either way, the first image of the returned volume is at the top.
+        By default 'down'.
+    detector : piescope.lm.detector.Basler(), optional
+        Fluorescence detector class instance.
+    lasers : piescope.lm.lasers.Laser(), optional
+        Lasers.
+    objective_stage : piescope.lm.objective.StageController(), optional
+        Objective lens stage class instance.
+    sample_interval : float, optional
+        Time in seconds between stage position samples, by default 0.005.
+    timestamp_offset : float, optional
+        Time in seconds from the middle of each exposure to its detector
+        timestamp. By default None, which is half the exposure time.
+    return_to_center : bool, optional
+        Whether to move the objective stage back to its starting position
+        after the sweep, by default True.
+    timer : piescope.lm.pipeline.StageTimer, optional
+        Records the time spent in each stage of the acquisition.
+
+    Returns
+    -------
+    volume : numpy array
+        Image volume with shape (num_z_slices, columns, rows, 1).
+    z_positions : numpy array
+        Objective stage position in nm at the middle of each image exposure.
+
+    Raises
+    ------
+    ValueError
+        Raised if laser_dict does not hold exactly one laser.
+    """
+    if len(laser_dict) != 1:
+        raise ValueError("Sweep acquisitions image a single laser channel, "
+                         "got {} lasers.".format(len(laser_dict)))
+    if direction not in ('down', 'up'):
+        raise ValueError("Unknown sweep direction '{}'. Expected either "
+                         "'down' or 'up'.".format(direction))
+    if timer is None:
+        timer = StageTimer()
+    timer.resume()
+
+    detector, lasers, objective_stage = (
+        piescope.lm.volume._initialize_hardware(
+            detector, lasers, objective_stage))
+
+    (laser_name, (laser_power, exposure_time)), = laser_dict.items()
+    lasers[laser_name].laser_power = laser_power
+    if frame_rate is None:
+        frame_rate = 1e6 / float(exposure_time)
+    if timestamp_offset is None:
+        timestamp_offset = float(exposure_time) * 1e-6 / 2.
+
+    center_position = float(objective_stage.current_position())
+    total_volume_height = (num_z_slices - 1) * z_slice_distance
+    speed = z_slice_distance * frame_rate
+    # Start early enough for the stage to reach the first slice half way
+    # through the first exposure, and finish half a slice after the last one
+    exposure = float(exposure_time) * 1e-6
+    lead = z_slice_distance * max(1. - exposure * frame_rate / 2., 0.)
+    top = center_position + total_volume_height / 2.
+    bottom = center_position - total_volume_height / 2.
+    if direction == 'down':
+        start, end = top + lead, bottom - z_slice_distance / 2.
+    else:
+        start, end = bottom - lead, top + z_slice_distance / 2.
+
+    with timer.stage('move'):
+        objective_stage.move_absolute(int(round(start)))
+    with timer.stage('settle'):
+        time.sleep(time_delay)
+    logger.debug("Sweeping objective lens stage from {} to {} nm at {} "
+                 "nm/s".format(start, end, speed))
+
+    sampler = PositionSampler(objective_stage, interval=sample_interval)
+    objective_stage.set_closed_loop_speed(speed)
+    try:
+        with timer.stage('laser'):
+            lasers[laser_name].emission_on()
+        try:
+            with sampler:
+                objective_stage.move_absolute(int(round(end)))
+                with timer.stage('grab'):
+                    images, timestamps = detector.free_run(
+                        num_z_slices, exposure_time=exposure_time,
+                        frame_rate=frame_rate)
+        finally:
+            with timer.stage('laser'):
+                lasers[laser_name].emission_off()
+    finally:
+        objective_stage.set_closed_loop_speed(0)
+        if return_to_center:
+            with timer.stage('move'):
+                objective_stage.move_absolute(int(round(center_position)))
+
+    z_positions = interpolate_positions(
+        np.asarray(timestamps) - timestamp_offset,
+        sampler.times, sampler.positions)
+    volume = np.asarray(images)[..., np.newaxis]
+    if direction == 'up':
+        volume = volume[::-1]
+        z_positions = z_positions[::-1]
+    timer.stop()
+    logger.info("Sweep acquisition of {} images took {:.3f} s, {} stage "
+                "position samples".format(num_z_slices, timer.wall_time,
+                                          len(sampler.times)))
+    return volume, z_positions
@@ -0,0 +1,204 @@
+"""Module for time-lapse acquisitions of repeated image volumes.
+
+Timepoints are scheduled on a monotonic clock timeline that starts when the
+time-lapse starts, so small delays never accumulate into drift.
+"""
+import logging
+import os
+import time
+
+import piescope.lm.volume
+
+logger = logging.getLogger(__name__)
+
+OVERRUN_POLICIES = ('skip', 'compress', 'shift')
+
+
+class TimelapseScheduler():
+    """Schedule acquisitions at regular intervals on a monotonic clock.
+
+    Parameters
+    ----------
+    interval : float
+        Time in seconds between the start of consecutive timepoints.
+    num_timepoints : int
+        Number of timepoints in the time-lapse.
+    overrun : {'skip', 'compress', 'shift'}, optional
+        What to do when an acquisition runs past the start of the next one:
+        * 'skip': skip any timepoints that should already have started,
+          and wait for the next one. The timeline never changes.
+        * 'compress': start the late timepoints immediately, one after the
+          other, until the acquisitions catch up with the timeline.
+        * 'shift': start the next timepoint immediately, and delay all
+          the following timepoints by the same amount.
+        By default 'skip'.
+    clock : callable, optional
+        Monotonic clock function returning the time in seconds,
+        by default time.monotonic
+    sleep : callable, optional
+        Function to pause for a number of seconds, by default time.sleep
+
+    Attributes
+    ----------
+    records : list of dict
+        Timing for each timepoint, with keys 'timepoint', 'planned',
+        'actual', 'duration' and 'skipped'. Times are in seconds relative
+        to the start of the time-lapse. 'actual' and 'duration' are None
+        for skipped timepoints.
+    """
+    def __init__(self, interval, num_timepoints, overrun='skip',
+                 clock=time.monotonic, sleep=time.sleep):
+        if overrun not in OVERRUN_POLICIES:
+            raise ValueError("Unknown overrun policy '{}'. Expected one of "
+                             "{}".format(overrun, OVERRUN_POLICIES))
+        self.interval = float(interval)
+        self.num_timepoints = int(num_timepoints)
+        self.overrun = overrun
+        self.clock = clock
+        self.sleep = sleep
+        self.records = []
+
+    def run(self, acquire):
+        """Run the time-lapse.
+
+        Parameters
+        ----------
+        acquire : callable
+            Function called as acquire(timepoint) at each timepoint.
+
+        Returns
+        -------
+        list
+            Return value of acquire() for each timepoint,
+            or None for skipped timepoints.
+        """
+        self.records = []
+        results = []
+        start_time = self.clock()
+        offset = 0.  # timeline shift, for the 'shift' overrun policy
+        timepoint = 0
+        while timepoint < self.num_timepoints:
+            planned = timepoint * self.interval + offset
+            now = self.clock() - start_time
+            if now < planned:
+                self.sleep(planned - now)
+                now = self.clock() - start_time
+            elif now > planned and timepoint > 0 and self.overrun == 'skip':
+                logger.warning("Time-lapse overrun, skipped timepoint "
+                               "{}".format(timepoint))
+                self.records.append({'timepoint': timepoint,
+                                     'planned': planned,
+                                     'actual': None,
+                                     'duration': None,
+                                     'skipped': True})
+                results.append(None)
+                timepoint += 1
+                continue
+            elif now > planned and self.overrun == 'shift':
+                offset += now - planned
+                planned = now
+            # with the 'compress' policy, late timepoints start immediately
+            logger.debug("Timepoint {}: planned {:.3f} s, actual {:.3f} "
+                         "s".format(timepoint, planned, now))
+            results.append(acquire(timepoint))
+            duration = self.clock() - start_time - now
+            self.records.append({'timepoint': timepoint,
+                                 'planned': planned,
+                                 'actual': now,
+                                 'duration': duration,
+                                 'skipped': False})
+            timepoint += 1
+        return results
+
+
+def timelapse_volume_acquisition(laser_dict, num_z_slices, z_slice_distance,
+                                 interval, num_timepoints, overrun='skip',
+                                 bidirectional=False, detector=None,
+                                 lasers=None, objective_stage=None,
+                                 checkpoint=None, **kwargs):
+    """Acquire an image volume at regular intervals.
+
+    The hardware connections stay open for the whole time-lapse.
+
+    Parameters
+    ----------
+    laser_dict : dict
+        Dictionary with structure: {"name": (power, exposure)} with types
+        {str: (int, int)}
+    num_z_slices : int
+        Amount of slices to take for each volume
+    z_slice_distance : int
+        Distance in nm between each z slice
+    interval : float
+        Time in seconds between the start of consecutive volumes.
+    num_timepoints : int
+        Number of timepoints in the time-lapse.
+    overrun : {'skip', 'compress', 'shift'}, optional
+        What to do when a volume takes longer than the interval,
+        see TimelapseScheduler. By default 'skip'.
+    bidirectional : bool, optional
+        Whether to alternate top-down and bottom-up z sweeps between
+        consecutive volumes, around the current objective stage position.
+        The first sweep goes in the direction keyword argument, by default
+        'down'. This avoids moving the objective stage back to the top of
+        the volume for every timepoint. By default False.
+    detector : piescope.lm.detector.Basler(), optional
+        Fluorescence detector class instance.
+    lasers : piescope.lm.lasers.Laser(), optional
+        Lasers.
+    objective_stage : piescope.lm.objective.StageController(), optional
+        Objective lens stage class instance.
+    checkpoint : str, optional
+        Directory to checkpoint the acquisitions in. Each timepoint gets its
+        own subdirectory named 'timepoint_<index>'. Default value is None.
+    **kwargs
+        Any other keyword arguments for volume_acquisition() except
+        filename, eg: time_delay, storage, pipelined, order.
+
+    Returns
+    -------
+    volumes : list
+        Image volume for each timepoint, or None for skipped timepoints.
+    records : list of dict
+        Planned and actual start time of each timepoint,
+        see TimelapseScheduler.
+
+    Raises
+    ------
+    ValueError
+        Raised if a filename is given.
+    """
+    piescope.lm.volume._check_no_filename(kwargs)
+    detector, lasers, objective_stage = (
+        piescope.lm.volume._initialize_hardware(
+            detector, lasers, objective_stage))
+    direction = kwargs.pop('direction', 'down')
+    if bidirectional:
+        kwargs['center_position'] = objective_stage.current_position()
+        # skipped timepoints don't move the stage, so the directions
+        # alternate between the volumes actually acquired
+        directions = piescope.lm.volume.bidirectional_directions(
+            num_timepoints, first_direction=direction)
+    else:
+        directions = [direction] * num_timepoints
+    acquired = []
+
+    def acquire(timepoint):
+        if bidirectional:
+            kwargs['return_to_center'] = timepoint == num_timepoints - 1
+        if checkpoint is not None:
+            kwargs['checkpoint'] = os.path.join(
+                checkpoint, 'timepoint_{}'.format(timepoint))
+        volume_direction = directions[len(acquired)]
+        acquired.append(timepoint)
+        return piescope.lm.volume.volume_acquisition(
+            laser_dict, num_z_slices, z_slice_distance, detector=detector,
+            lasers=lasers, objective_stage=objective_stage,
+            direction=volume_direction, **kwargs)
+
+    scheduler = TimelapseScheduler(interval, num_timepoints, overrun=overrun)
+    volumes = scheduler.run(acquire)
+    if bidirectional and volumes and volumes[-1] is None:
+        # the last timepoint was skipped, so the stage was never returned
+        objective_stage.move_absolute(kwargs['center_position'])
+    return volumes, scheduler.records
@@ -0,0 +1,118 @@
+"""Module for tracing the timeline of an acquisition.
+
+A Tracer records every timed stage of an acquisition (laser switching,
+image grabs, stage movements, settling, correction retries and writes) as
+a span, and exports them in the Chrome trace event format. The trace files
+can be viewed in Perfetto (https://ui.perfetto.dev) or chrome://tracing.
+
+Tracing is off unless a Tracer is passed as the timer of an acquisition,
+the default StageTimer only accumulates the total time of each stage.
+"""
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+from piescope.lm.pipeline import StageTimer
+
+logger = logging.getLogger(__name__)
+
+
+def _json_default(value):
+    """Convert numpy values in span details to JSON types."""
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    return str(value)
+
+
+class Tracer(StageTimer):
+    """Record the timeline of every stage of an acquisition.
+
+    A drop-in replacement for StageTimer, eg:
+    volume_acquisition(..., timer=Tracer()), which also keeps a span
+    for each run of each stage.
+
+    Parameters
+    ----------
+    max_spans : int, optional
+        Maximum number of spans to keep, by default None (no limit).
+        Once the limit is reached, later spans are only counted in the
+        stage totals.
+
+    Attributes
+    ----------
+    spans : list of tuple
+        (name, start, stop, thread id, thread name, args) for each span,
+        with start and stop times from time.perf_counter(), in seconds.
+    num_dropped : int
+        Number of spans not kept because of max_spans.
+    """
+    def __init__(self, max_spans=None):
+        super(Tracer, self).__init__()
+        self.max_spans = max_spans
+        self.spans = []
+        self.num_dropped = 0
+
+    def _record(self, name, start, stop, args):
+        thread = threading.current_thread()
+        with self._lock:
+            self.busy_time[name] += stop - start
+            self.counts[name] += 1
+            if self.max_spans is None or len(self.spans) < self.max_spans:
+                self.spans.append(
+                    (name, start, stop, thread.ident, thread.name, args))
+            else:
+                self.num_dropped += 1
+
+    def to_chrome_trace(self):
+        """Spans in the Chrome trace event format.
+
+        Returns
+        -------
+        dict
+            Dictionary with a 'traceEvents' list of complete ('X') events,
+            with times in microseconds since the acquisition started, and
+            metadata ('M') events naming each thread.
+        """
+        with self._lock:
+            spans = list(self.spans)
+        origin = self.start_time
+        if origin is None:
+            origin = min([span[1] for span in spans], default=0.)
+        pid = os.getpid()
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': pid,
+                   'args': {'name': 'piescope'}}]
+        thread_names = {}
+        for name, start, stop, thread_id, thread_name, args in spans:
+            thread_names[thread_id] = thread_name
+            events.append({
+                'name': name,
+                'cat': 'acquisition',
+                'ph': 'X',
+                'ts': (start - origin) * 1e6,
+                'dur': (stop - start) * 1e6,
+                'pid': pid,
+                'tid': thread_id,
+                'args': args,
+            })
+        for thread_id, thread_name in thread_names.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                           'tid': thread_id, 'args': {'name': thread_name}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save(self, filename):
+        """Save the spans as a Chrome trace event JSON file.
+
+        Parameters
+        ----------
+        filename : str
+            Trace filename, eg: 'acquisition_trace.json'.
+        """
+        with open(filename, 'w') as f:
+            json.dump(self.to_chrome_trace(), f, default=_json_default)
+        if self.num_dropped:
+            logger.warning("Trace {} is missing {} spans, over the max_spans "
+                           "limit".format(filename, self.num_dropped))
+        logger.debug("Saved acquisition trace: {}".format(filename))
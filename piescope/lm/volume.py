@@ -1,18 +1,36 @@
+import collections
 import logging
+import os
+import sys
+import tempfile
 import time
+
 import numpy as np
+import tifffile
 
 import piescope.lm.detector
+import piescope.fibsem
+import piescope.lm.checkpoint
 import piescope.lm.laser
 import piescope.lm.objective
+import piescope.lm.pipeline
+import piescope.lm.planner
 
 
 logger = logging.getLogger(__name__)
 
+# Fraction of the available RAM a volume may use before spilling to disk
+DEFAULT_MAX_MEMORY_FRACTION = 0.5
+
 
 def volume_acquisition(laser_dict, num_z_slices, z_slice_distance,
                        time_delay=1, count_max=5, threshold=5,
-                       detector=None, lasers=None, objective_stage=None):
+                       detector=None, lasers=None, objective_stage=None,
+                       storage='auto', filename=None, pipelined=False,
+                       timer=None, order='auto', timing=None,
+                       checkpoint=None, direction='down',
+                       center_position=None, return_to_center=True,
+                       adaptive=None, projection=None):
     """Acquire an image volume using the fluorescence microscope.
 
     Parameters
@@ -51,10 +69,84 @@ def volume_acquisition(laser_dict, num_z_slices, z_slice_distance,
         Objective lens stage class instance.
         Default value is None.
 
+    storage : {'auto', 'memory', 'disk'}, optional
+        Where to keep the volume while it is acquired, see create_volume().
+        By default 'auto', which only uses disk if the volume is too large
+        to fit comfortably in the available memory.
+
+    filename : str, optional
+        BigTIFF file backing the volume when it is stored on disk.
+        Default value is None, which uses a temporary file that is not
+        deleted automatically, see create_volume().
+
+    pipelined : bool, optional
+        Whether to write acquired frames into the volume in a background
+        thread, overlapping with the objective stage movement and settling.
+        Lasers, exposures and stage movements keep their usual order.
+        By default False.
+
+    timer : piescope.lm.pipeline.StageTimer, optional
+        Records the time spent in each stage of the acquisition
+        (laser, grab, move, settle, correction, retry, write, save).
+        Call timer.utilization() or timer.report() afterwards.
+        Pass a piescope.lm.trace.Tracer to record the whole timeline.
+        A timer shared by several acquisitions keeps timing from the first.
+        Default value is None.
+
+    order : str, optional
+        Order of the z slices and laser channels, see
+        piescope.lm.planner.acquisition_plan() for the available options.
+        By default 'auto', which picks the fastest order for the timing model.
+
+    timing : piescope.lm.planner.TimingModel, optional
+        Timing model used to pick the fastest acquisition order.
+        Default value is None, which uses a TimingModel() with
+        settle_time equal to time_delay.
+
+    checkpoint : str, optional
+        Directory to journal the acquisition progress in. The volume is
+        stored on disk in this directory (the storage and filename arguments
+        are ignored). If the directory holds an unfinished acquisition with
+        the same laser_dict, num_z_slices and z_slice_distance, it is
+        resumed instead of starting again from scratch.
+        See resume_volume_acquisition().
+        Default value is None.
+
+    direction : {'down', 'up'}, optional
+        Sweep the z slices from the top of the volume down ('down'),
+        or from the bottom of the volume up ('up'). Either way, the first
+        slice of the returned volume is the top of the volume.
+        By default 'down'.
+
+    center_position : int, optional
+        Objective stage position in nm at the center of the volume.
+        If the stage is already at the first slice of the sweep, it does
+        not move before the first image.
+        Default value is None, which uses the current stage position.
+
+    return_to_center : bool, optional
+        Whether to move the objective stage back to the center of the volume
+        after the acquisition, by default True.
+        Alternating 'down' and 'up' sweeps with return_to_center=False and
+        a fixed center_position avoids any return travel between volumes.
+
+    adaptive : piescope.lm.focus.AdaptiveZRange, optional
+        Skip empty slices using the signal of a reference channel, which is
+        imaged first at each z slice. Skipped images are filled with zeros.
+        The acquisition order is always 'interleaved' in adaptive mode.
+        Default value is None.
+
+    projection : piescope.projection.RunningProjection, optional
+        Updated with each image as it is written into the volume, so live
+        projections are available during the acquisition. When resuming
+        from a checkpoint, it is first updated with the completed images.
+        Default value is None.
+
     Returns
     -------
     volume : multidimensional numpy array
-        numpy.ndarray with shape (z_slices, columns, rows, channels)
+        numpy.ndarray with shape (z_slices, columns, rows, channels).
+        If the volume is stored on disk this is a numpy.memmap instance.
 
     Notes
     -----
@@ -62,64 +154,689 @@ def volume_acquisition(laser_dict, num_z_slices, z_slice_distance,
     and a maximum 300 microns total height for the volume acquisition.
     """
     logging.info("Acquiring fluorescence volume...")
+    if direction not in ('down', 'up'):
+        raise ValueError("Unknown sweep direction '{}'. Expected either "
+                         "'down' or 'up'.".format(direction))
+    if adaptive is not None:
+        if adaptive.reference_channel not in laser_dict:
+            raise ValueError("Adaptive z range reference channel {} is not "
+                             "in laser_dict".format(adaptive.reference_channel))
+        if order == 'auto':
+            order = 'interleaved'
+        elif order != 'interleaved':
+            raise ValueError("Adaptive z range acquisitions need the "
+                             "'interleaved' acquisition order.")
     num_z_slices = int(num_z_slices)
     z_slice_distance = int(z_slice_distance)
     total_volume_height = (num_z_slices - 1) * z_slice_distance
 
+    if timer is None:
+        timer = piescope.lm.pipeline.StageTimer()
+    timer.resume()
+
     # Initialize hardware
-    if detector is None:
-        detector = piescope.lm.detector.Basler()
-    if lasers is None:
-        lasers = piescope.lm.laser.initialize_lasers()
-    if objective_stage is None:
-        objective_stage = piescope.lm.objective.StageController()
+    detector, lasers, objective_stage = _initialize_hardware(
+        detector, lasers, objective_stage)
 
     for laser_name, (laser_power, exposure_time) in laser_dict.items():
         lasers[laser_name].laser_power = laser_power
 
-    # Move objective lens stage to the top of the volume
-    original_center_position = str(objective_stage.current_position())
-    objective_stage.move_relative(int(total_volume_height / 2))
-    time.sleep(time_delay)  # Pause to be sure movement is completed
-    logger.debug('Objective lens stage moved to top of the image volume.')
+    journal = None
+    if checkpoint is not None:
+        journal = piescope.lm.checkpoint.AcquisitionJournal(checkpoint)
+        storage, filename = 'disk', journal.volume_filename
+    settings = {
+        'laser_dict': [[name, power, exposure] for name, (power, exposure)
+                       in laser_dict.items()],
+        'num_z_slices': num_z_slices,
+        'z_slice_distance': z_slice_distance,
+    }
+    completed = set()
+    if journal is not None and journal.exists():
+        # Resume a previous acquisition
+        previous_settings, completed = journal.load()
+        for key, value in settings.items():
+            if previous_settings[key] != value:
+                raise ValueError(
+                    "Cannot resume acquisition from checkpoint {}, "
+                    "{} does not match: expected {} but found {}".format(
+                        checkpoint, key, previous_settings[key], value))
+        settings = previous_settings
+        original_center_position = settings['original_center_position']
+        order = settings['order']
+        direction = settings.get('direction', 'down')
+        plan = piescope.lm.planner.acquisition_plan(
+            num_z_slices, len(laser_dict), order=order)
+        if direction == 'up':
+            plan = [(num_z_slices - 1 - z, c) for z, c in plan]
+        volume = journal.open_volume()
+        current_z_slice = None  # unknown stage position
+        logging.info("Resuming acquisition from checkpoint {}, {} of {} "
+                     "images already complete.".format(
+                         checkpoint, len(completed), len(plan)))
+    else:
+        # Move objective lens stage to the start of the sweep
+        first_z_slice = 0 if direction == 'down' else num_z_slices - 1
+        if center_position is None:
+            original_center_position = str(objective_stage.current_position())
+            distance = int(total_volume_height / 2)
+            with timer.stage('move'):
+                if direction == 'down':
+                    objective_stage.move_relative(distance)
+                else:
+                    objective_stage.move_relative(-distance)
+            with timer.stage('settle'):
+                time.sleep(time_delay)  # Pause to be sure movement completed
+        else:
+            original_center_position = str(center_position)
+            first_position = (float(original_center_position)
+                              + total_volume_height / 2.
+                              - first_z_slice * z_slice_distance)
+            current_position = float(objective_stage.current_position())
+            if abs(current_position - first_position) > threshold:
+                _move_objective_stage(
+                    objective_stage, None, first_position,
+                    time_delay=time_delay, count_max=count_max,
+                    threshold=threshold, timer=timer)
+        logger.debug('Objective lens stage moved to the {} of the image '
+                     'volume.'.format('top' if direction == 'down'
+                                      else 'bottom'))
+        current_z_slice = first_z_slice
+
+        # Create volume array to put the results into
+        array_shape = np.shape(detector.camera_grab())  # no lasers on
+        volume = create_volume(
+            (num_z_slices, array_shape[0], array_shape[1], len(laser_dict)),
+            dtype=np.uint8, storage=storage, filename=filename)
 
-    # Create volume array to put the results into
-    array_shape = np.shape(detector.camera_grab())  # no lasers on
-    volume = np.ndarray(dtype=np.uint8,
-        shape=(num_z_slices, array_shape[0], array_shape[1], len(laser_dict)))
+        # Plan the order of the z slices and laser channels
+        if order == 'auto':
+            if timing is None:
+                timing = piescope.lm.planner.TimingModel(
+                    settle_time=time_delay)
+            order, plan = piescope.lm.planner.plan_acquisition(
+                laser_dict, num_z_slices, z_slice_distance, timing=timing)
+        else:
+            plan = piescope.lm.planner.acquisition_plan(
+                num_z_slices, len(laser_dict), order=order)
+        if direction == 'up':
+            plan = [(num_z_slices - 1 - z, c) for z, c in plan]
+        if journal is not None:
+            settings.update({
+                'original_center_position': original_center_position,
+                'order': order,
+                'direction': direction,
+            })
+            journal.start(settings)
+    if adaptive is not None:
+        # Image the reference channel first at each z slice
+        laser_names = list(laser_dict)
+        sweep_position = {}
+        for z_slice, _ in plan:
+            sweep_position.setdefault(z_slice, len(sweep_position))
+        plan = sorted(plan, key=lambda step: (
+            sweep_position[step[0]],
+            laser_names[step[1]] != adaptive.reference_channel))
+        adaptive.reset()
+    logger.debug("Acquisition order: {}".format(order))
+    laser_settings = list(laser_dict.items())
+    callbacks = [journal.record] if journal is not None else []
+    if projection is not None:
+        for z_slice, channel in sorted(completed):
+            projection.update(z_slice, channel, volume[z_slice, ..., channel])
+        callbacks.append(projection.update)
 
     # Acquire volume image
-    for z_slice in range(int(num_z_slices)):
-        logging.debug("z_slice: {}".format(z_slice))
-        for channel, (laser_name, (laser_power, exposure_time)) in enumerate(laser_dict.items()):
-            print("z_slice: {}, laser: {}".format(z_slice, laser_name))
-            logging.debug("laser_name: {}".format(laser_name))
-            # Take an image
-            lasers[laser_name].emission_on()
-            volume[z_slice, :, :, channel] = detector.camera_grab(exposure_time)
-            lasers[laser_name].emission_off()
-            # Move objective lens stage
-            target_position = (float(original_center_position)
-                               + float(total_volume_height / 2.)
-                               - (float(z_slice) * float(z_slice_distance))
-                               )
-            objective_stage.move_relative(-int(z_slice_distance))
-            time.sleep(time_delay)  # Pause to be sure movement is completed.
-            # If objective stage movement not accurate enough, try it again
-            count = 0
-            current_position = float(objective_stage.current_position())
-            difference = current_position - target_position
-            while count < count_max and abs(difference) > threshold:
-                objective_stage.move_relative(-int(difference))
-                time.sleep(time_delay)  # Pause to be sure movement completed.
-                current_position = float(objective_stage.current_position())
-                difference = current_position - target_position
-                logger.debug('Difference is: {}'.format(str(difference)))
-                count = count + 1
+    empty_frame = np.zeros(volume.shape[1:3], dtype=volume.dtype)
+    top_position = float(original_center_position) + total_volume_height / 2.
+    try:
+        with piescope.lm.pipeline.FrameWriter(
+                volume, pipelined=pipelined, timer=timer,
+                callbacks=callbacks) as frame_writer:
+            for z_slice, channel in plan:
+                if (z_slice, channel) in completed:
+                    continue
+                laser_name, (laser_power, exposure_time) = \
+                    laser_settings[channel]
+                if adaptive is not None and adaptive.skip(laser_name):
+                    logging.debug("Skipped z_slice: {}, laser_name: "
+                                  "{}".format(z_slice, laser_name))
+                    frame_writer.put(z_slice, channel, empty_frame)
+                    continue
+                # Move objective lens stage, only if we need a new z slice
+                if z_slice != current_z_slice:
+                    target_position = (top_position
+                                       - float(z_slice) * float(z_slice_distance))
+                    if current_z_slice is None:
+                        distance = None  # absolute move when resuming
+                    else:
+                        distance = -int((z_slice - current_z_slice)
+                                        * z_slice_distance)
+                    _move_objective_stage(
+                        objective_stage, distance, target_position,
+                        time_delay=time_delay, count_max=count_max,
+                        threshold=threshold, timer=timer)
+                    current_z_slice = z_slice
+                print("z_slice: {}, laser: {}".format(z_slice, laser_name))
+                logging.debug("z_slice: {}, laser_name: {}".format(
+                    z_slice, laser_name))
+                # Take an image
+                with timer.stage('laser', laser=laser_name, emission='on'):
+                    lasers[laser_name].emission_on()
+                try:
+                    with timer.stage('grab', z_slice=z_slice,
+                                     laser=laser_name,
+                                     exposure_time=exposure_time):
+                        image = detector.camera_grab(exposure_time)
+                finally:
+                    with timer.stage('laser', laser=laser_name,
+                                     emission='off'):
+                        lasers[laser_name].emission_off()
+                if (adaptive is not None
+                        and laser_name == adaptive.reference_channel):
+                    with timer.stage('metric', z_slice=z_slice):
+                        adaptive.update(z_slice, image)
+                frame_writer.put(z_slice, channel, image)
+    except Exception:
+        if journal is not None:
+            logging.error("Volume acquisition interrupted, completed images "
+                          "are saved in checkpoint {}".format(checkpoint))
+        raise
+    finally:
+        if isinstance(volume, np.memmap):
+            with timer.stage('save', filename=volume.filename):
+                volume.flush()
 
     # Finally, return the objective lens stage too original position
-    objective_stage.move_absolute(original_center_position)
-    logging.debug("Volume acquired, stage returned to its original position.")
+    if return_to_center:
+        objective_stage.move_absolute(original_center_position)
+        logging.debug("Volume acquired, stage returned to its original "
+                      "position.")
     logging.debug("Volume array shape: {}".format(volume.shape))
+    timer.stop()
+    logger.debug("Volume acquisition timing:\n{}".format(timer.report()))
     logging.info("Fluorescence volume acquistion finished.")
     return volume
+
+
+def estimate_volume_acquisition(laser_dict, num_z_slices, z_slice_distance,
+                                image_shape, time_delay=1, storage='auto',
+                                pipelined=False, order='auto', timing=None,
+                                max_memory=None):
+    """Estimate the time and memory needed for a volume acquisition.
+
+    Nothing is sent to the hardware, this is a dry run using a timing model.
+    The arguments match those of volume_acquisition().
+
+    Parameters
+    ----------
+    laser_dict : dict
+        Dictionary with structure: {"name": (power, exposure)} with types
+        {str: (int, int)}
+    num_z_slices : int
+        Amount of slices to take for total volume
+    z_slice_distance : int
+        Distance in nm between each z slice
+    image_shape : tuple of int
+        Detector image shape (columns, rows), eg: (1200, 1920)
+    time_delay : int, optional
+        Pause after each objective stage movement, by default 1
+        Ignored if a timing model is given.
+    storage : {'auto', 'memory', 'disk'}, optional
+        Volume storage, see create_volume(). By default 'auto'.
+    pipelined : bool, optional
+        Whether frames are written in a background thread, by default False.
+    order : str, optional
+        Acquisition order, see piescope.lm.planner.acquisition_plan().
+        By default 'auto', which picks the fastest order.
+    timing : piescope.lm.planner.TimingModel, optional
+        Timing model, eg: calibrated from a previous acquisition with
+        piescope.lm.planner.TimingModel.from_timer() or loaded from a
+        saved timing profile with piescope.lm.planner.TimingModel.load().
+        Default value is None, which uses a TimingModel() with
+        settle_time equal to time_delay.
+    max_memory : int, optional
+        Largest volume in bytes to keep in RAM when storage is 'auto'.
+
+    Returns
+    -------
+    dict
+        Dictionary with keys:
+        * 'order': acquisition order
+        * 'phases': estimated time in seconds for each phase,
+          see piescope.lm.planner.plan_phase_times()
+        * 'total_time': estimated wall time in seconds
+        * 'num_images': number of images acquired
+        * 'storage': 'memory' or 'disk'
+        * 'volume_nbytes': size of the volume in bytes
+        * 'peak_memory': estimated peak memory use in bytes
+    """
+    num_z_slices = int(num_z_slices)
+    z_slice_distance = int(z_slice_distance)
+    total_volume_height = (num_z_slices - 1) * z_slice_distance
+    if timing is None:
+        timing = piescope.lm.planner.TimingModel(settle_time=time_delay)
+    if order == 'auto':
+        order, plan = piescope.lm.planner.plan_acquisition(
+            laser_dict, num_z_slices, z_slice_distance, timing=timing)
+    else:
+        plan = piescope.lm.planner.acquisition_plan(
+            num_z_slices, len(laser_dict), order=order)
+    exposure_times = [exposure for (_, exposure) in laser_dict.values()]
+    phases = piescope.lm.planner.plan_phase_times(
+        plan, exposure_times, z_slice_distance, timing)
+    # Move to the top of the volume, test grab, and return to the center
+    phases['move'] += 2 * timing.move_overhead + (
+        total_volume_height / timing.stage_speed)
+    phases['settle'] += timing.settle_time
+    phases['grab'] += timing.grab_time(0)
+
+    shape = (num_z_slices, image_shape[0], image_shape[1], len(laser_dict))
+    volume_nbytes = estimate_volume_nbytes(shape, np.uint8)
+    storage = _select_storage(volume_nbytes, storage, max_memory=max_memory)
+    frame_nbytes = estimate_volume_nbytes(image_shape, np.uint8)
+    # The most recent frame, plus any waiting in the frame writer queue
+    frame_buffers = 1 + (piescope.lm.pipeline.FrameWriter.DEFAULT_MAXSIZE
+                         if pipelined else 0)
+    peak_memory = frame_buffers * frame_nbytes
+    if storage == 'memory':
+        peak_memory += volume_nbytes
+    return {
+        'order': order,
+        'phases': phases,
+        'total_time': sum(phases.values()),
+        'num_images': len(plan),
+        'storage': storage,
+        'volume_nbytes': volume_nbytes,
+        'peak_memory': peak_memory,
+    }
+
+
+def _move_objective_stage(objective_stage, distance, target_position,
+                          time_delay=1, count_max=5, threshold=5, timer=None):
+    """Move the objective stage and correct until it reaches the target.
+
+    Parameters
+    ----------
+    objective_stage : piescope.lm.objective.StageController()
+        Objective lens stage class instance.
+    distance : int or None
+        Relative movement in nm.
+        If None, the stage makes an absolute move to the target position.
+    target_position : float
+        Expected absolute stage position in nm after the movement.
+    time_delay : int, optional
+        Pause after each movement, by default 1
+    count_max : int, optional
+        Maximum number of correction attempts, by default 5
+    threshold : int, optional
+        Largest acceptable difference between the current stage position
+        and the target position, by default 5
+    timer : piescope.lm.pipeline.StageTimer, optional
+        Records the time spent moving, settling and correcting.
+    """
+    if timer is None:
+        timer = piescope.lm.pipeline.StageTimer()
+    with timer.stage('move', distance=distance, target=target_position):
+        if distance is None:
+            objective_stage.move_absolute(int(target_position))
+        else:
+            objective_stage.move_relative(distance)
+    with timer.stage('settle'):
+        time.sleep(time_delay)  # Pause to be sure movement is completed.
+    # If objective stage movement not accurate enough, try it again
+    with timer.stage('correction'):
+        count = 0
+        current_position = float(objective_stage.current_position())
+        difference = current_position - target_position
+        while count < count_max and abs(difference) > threshold:
+            with timer.stage('retry', attempt=count + 1,
+                             difference=difference):
+                objective_stage.move_relative(-int(difference))
+                time.sleep(time_delay)  # Pause to be sure movement completed.
+                current_position = float(objective_stage.current_position())
+            difference = current_position - target_position
+            logger.debug('Difference is: {}'.format(str(difference)))
+            count = count + 1
+
+
+def _initialize_hardware(detector=None, lasers=None, objective_stage=None):
+    """Connect to the light microscope hardware that was not given.
+
+    Returns
+    -------
+    tuple
+        (detector, lasers, objective_stage)
+    """
+    if detector is None:
+        detector = piescope.lm.detector.Basler()
+    if lasers is None:
+        lasers = piescope.lm.laser.initialize_lasers()
+    if objective_stage is None:
+        objective_stage = piescope.lm.objective.StageController()
+    return detector, lasers, objective_stage
+
+
+def _check_no_filename(kwargs):
+    """Reject a filename for a series of volumes.
+
+    Every volume_acquisition() of the series would store its volume in the
+    same file, overwriting the previous one. The checkpoint argument gives
+    each volume its own directory instead.
+    """
+    if kwargs.get('filename') is not None:
+        raise ValueError("Cannot use the same filename for multiple volumes, "
+                         "use the checkpoint argument instead.")
+
+
+def multi_position_acquisition(microscope, positions, laser_dict,
+                               num_z_slices, z_slice_distance,
+                               optimize_order=True, method='two_opt',
+                               detector=None, lasers=None,
+                               objective_stage=None, checkpoint=None,
+                               bidirectional=False, **kwargs):
+    """Acquire an image volume at each of several FIBSEM stage positions.
+
+    Parameters
+    ----------
+    microscope : Autoscript microscope object.
+    positions : list of tuple
+        List of absolute (x, y) FIBSEM sample stage positions, in meters.
+    laser_dict : dict
+        Dictionary with structure: {"name": (power, exposure)} with types
+        {str: (int, int)}
+    num_z_slices : int
+        Amount of slices to take for each volume
+    z_slice_distance : int
+        Distance in nm between each z slice
+    optimize_order : bool, optional
+        Whether to visit the positions in the order that minimizes the total
+        stage travel, see piescope.lm.planner.order_positions().
+        Otherwise the positions are visited in the order given.
+        By default True.
+    method : {'nearest_neighbour', 'two_opt'}, optional
+        Route heuristic used to optimize the order, by default 'two_opt'.
+    detector : piescope.lm.detector.Basler(), optional
+        Fluorescence detector class instance.
+    lasers : piescope.lm.lasers.Laser(), optional
+        Lasers.
+    objective_stage : piescope.lm.objective.StageController(), optional
+        Objective lens stage class instance.
+    checkpoint : str, optional
+        Directory to checkpoint the acquisitions in. Each position gets its
+        own subdirectory named 'position_<index>'. Default value is None.
+    bidirectional : bool, optional
+        Whether to alternate top-down and bottom-up z sweeps between
+        consecutive positions, around the current objective stage position.
+        The first sweep goes in the direction keyword argument, by default
+        'down'. This avoids moving the objective stage back to the top of
+        the volume for every position. By default False.
+    **kwargs
+        Any other keyword arguments for volume_acquisition() except
+        filename, eg: time_delay, storage, pipelined, order.
+
+    Returns
+    -------
+    volumes : list
+        Image volumes, in the same order as the input positions.
+    timings : list of dict
+        Timing for each position, in acquisition order. Each dictionary has
+        keys 'index', 'position', 'move_time' and 'acquisition_time'
+        (times in seconds).
+
+    Raises
+    ------
+    ValueError
+        Raised if a filename is given.
+    """
+    _check_no_filename(kwargs)
+    # Initialize hardware once, for all the positions
+    detector, lasers, objective_stage = _initialize_hardware(
+        detector, lasers, objective_stage)
+
+    if optimize_order:
+        current_position = microscope.specimen.stage.current_position
+        route = piescope.lm.planner.order_positions(
+            positions, start=(current_position.x, current_position.y),
+            method=method)
+    else:
+        route = range(len(positions))
+
+    direction = kwargs.pop('direction', 'down')
+    if bidirectional:
+        kwargs['center_position'] = objective_stage.current_position()
+        directions = bidirectional_directions(len(positions),
+                                              first_direction=direction)
+    else:
+        directions = [direction] * len(positions)
+
+    volumes = [None] * len(positions)
+    timings = []
+    for index, direction in zip(route, directions):
+        index = int(index)
+        x, y = positions[index]
+        logging.info("Position {} of {}: x={}, y={}".format(
+            len(timings) + 1, len(positions), x, y))
+        start_time = time.perf_counter()
+        piescope.fibsem.move_to_position(microscope, x, y)
+        move_time = time.perf_counter() - start_time
+        if checkpoint is not None:
+            kwargs['checkpoint'] = os.path.join(
+                checkpoint, 'position_{}'.format(index))
+        if bidirectional:
+            # only the last volume returns to the center
+            kwargs['return_to_center'] = len(timings) == len(positions) - 1
+        volumes[index] = volume_acquisition(
+            laser_dict, num_z_slices, z_slice_distance, detector=detector,
+            lasers=lasers, objective_stage=objective_stage,
+            direction=direction, **kwargs)
+        acquisition_time = time.perf_counter() - start_time - move_time
+        timings.append({'index': index,
+                        'position': (x, y),
+                        'move_time': move_time,
+                        'acquisition_time': acquisition_time})
+        logger.debug("Position {} timing: move {:.3f} s, acquisition {:.3f} "
+                     "s".format(index, move_time, acquisition_time))
+    return volumes, timings
+
+
+def bidirectional_directions(num_volumes, first_direction='down'):
+    """Alternating z sweep directions for a series of volumes.
+
+    Parameters
+    ----------
+    num_volumes : int
+        Number of consecutive volumes.
+    first_direction : {'down', 'up'}, optional
+        Sweep direction of the first volume, by default 'down'.
+
+    Returns
+    -------
+    list of str
+        Sweep direction for each volume, 'down' or 'up'.
+    """
+    other_direction = 'up' if first_direction == 'down' else 'down'
+    return [first_direction if i % 2 == 0 else other_direction
+            for i in range(int(num_volumes))]
+
+
+def resume_volume_acquisition(checkpoint, **kwargs):
+    """Resume an interrupted volume acquisition from its checkpoint.
+
+    Parameters
+    ----------
+    checkpoint : str
+        Checkpoint directory of the interrupted acquisition.
+    **kwargs
+        Any other keyword arguments for volume_acquisition(),
+        eg: time_delay, detector, lasers, objective_stage.
+
+    Returns
+    -------
+    volume : numpy.memmap
+        Volume with shape (z_slices, columns, rows, channels).
+
+    Raises
+    ------
+    ValueError
+        Raised if there is no acquisition to resume in the directory.
+    """
+    journal = piescope.lm.checkpoint.AcquisitionJournal(checkpoint)
+    if not journal.exists():
+        raise ValueError("No acquisition to resume in checkpoint "
+                         "directory {}".format(checkpoint))
+    settings, _ = journal.load()
+    laser_dict = collections.OrderedDict(
+        (name, (power, exposure))
+        for name, power, exposure in settings['laser_dict'])
+    return volume_acquisition(laser_dict, settings['num_z_slices'],
+                              settings['z_slice_distance'],
+                              checkpoint=checkpoint, **kwargs)
+
+
+def estimate_volume_nbytes(shape, dtype=np.uint8):
+    """Estimate the size in bytes of an image volume array.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        Volume shape, (z_slices, columns, rows, channels).
+    dtype : numpy dtype, optional
+        Pixel datatype, by default numpy.uint8
+
+    Returns
+    -------
+    int
+        Number of bytes needed to hold the volume pixel values.
+    """
+    return int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+
+
+def _windows_available_memory():
+    """Available physical memory from GlobalMemoryStatusEx, on Windows."""
+    import ctypes
+
+    class MEMORYSTATUSEX(ctypes.Structure):
+        _fields_ = [('dwLength', ctypes.c_ulong),
+                    ('dwMemoryLoad', ctypes.c_ulong),
+                    ('ullTotalPhys', ctypes.c_ulonglong),
+                    ('ullAvailPhys', ctypes.c_ulonglong),
+                    ('ullTotalPageFile', ctypes.c_ulonglong),
+                    ('ullAvailPageFile', ctypes.c_ulonglong),
+                    ('ullTotalVirtual', ctypes.c_ulonglong),
+                    ('ullAvailVirtual', ctypes.c_ulonglong),
+                    ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+    status = MEMORYSTATUSEX()
+    status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+    if not ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+        raise OSError("GlobalMemoryStatusEx failed")
+    return int(status.ullAvailPhys)
+
+
+def available_memory():
+    """Available physical memory in bytes, or None if it is unknown.
+
+    Uses psutil, with fallbacks for environments where it is not installed:
+    GlobalMemoryStatusEx on Windows, and the free memory reported by
+    os.sysconf elsewhere, which leaves out reclaimable page cache.
+    """
+    try:
+        import psutil
+    except ImportError:
+        pass
+    else:
+        return int(psutil.virtual_memory().available)
+    if sys.platform == 'win32':
+        try:
+            return _windows_available_memory()
+        except (AttributeError, OSError):
+            return None
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _select_storage(nbytes, storage='auto', max_memory=None):
+    """Resolve 'auto' volume storage to either 'memory' or 'disk'."""
+    if storage != 'auto':
+        return storage
+    if max_memory is None:
+        memory = available_memory()
+        if memory is None:
+            logger.warning("Available memory is unknown, keeping the volume "
+                           "in memory. Pass max_memory or storage='disk' to "
+                           "store large volumes on disk.")
+        else:
+            max_memory = DEFAULT_MAX_MEMORY_FRACTION * memory
+    if max_memory is not None and nbytes > max_memory:
+        return 'disk'
+    return 'memory'
+
+
+def create_volume(shape, dtype=np.uint8, storage='auto', filename=None,
+                  max_memory=None):
+    """Allocate an array to put an image volume into.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        Volume shape, (z_slices, columns, rows, channels).
+    dtype : numpy dtype, optional
+        Pixel datatype, by default numpy.uint8
+    storage : {'auto', 'memory', 'disk'}, optional
+        'memory' allocates a regular numpy array in RAM.
+        'disk' memory-maps a BigTIFF file, so each slice written into the
+        array goes to disk instead of being held in RAM.
+        'auto' (the default) picks 'disk' only if the volume is larger
+        than max_memory.
+    filename : str, optional
+        BigTIFF filename for disk storage.
+        Default value is None, which creates a temporary file, see Notes.
+    max_memory : int, optional
+        Largest volume in bytes to keep in RAM when storage is 'auto'.
+        Default is DEFAULT_MAX_MEMORY_FRACTION of the available memory.
+
+    Returns
+    -------
+    volume : numpy.ndarray or numpy.memmap
+        Uninitialized array with the requested shape and dtype.
+
+    Raises
+    ------
+    ValueError
+        Raised if the storage option is not recognised.
+
+    Notes
+    -----
+    Temporary files are not deleted automatically, since the volume is
+    usually still needed after the acquisition. Once done with the volume,
+    release every reference to it and delete the file:
+
+    >>> filename = volume.filename
+    >>> del volume
+    >>> os.remove(filename)
+    """
+    if storage not in ('auto', 'memory', 'disk'):
+        raise ValueError("Unknown volume storage option '{}'. Expected one "
+                         "of 'auto', 'memory' or 'disk'.".format(storage))
+    nbytes = estimate_volume_nbytes(shape, dtype)
+    storage = _select_storage(nbytes, storage, max_memory=max_memory)
+    logger.debug("Volume size estimate: {} bytes, "
+                 "storage: {}".format(nbytes, storage))
+    if storage == 'memory':
+        return np.ndarray(dtype=dtype, shape=shape)
+    if filename is None:
+        fd, filename = tempfile.mkstemp(prefix='piescope_volume_',
+                                        suffix='.tif')
+        os.close(fd)
+    directory_name = os.path.dirname(filename)
+    if not directory_name == '' and not os.path.isdir(directory_name):
+        os.makedirs(directory_name)
+    # one page of (rows, columns, channels) interleaved pixels per z slice
+    volume = tifffile.memmap(filename, shape=shape, dtype=dtype,
+                             bigtiff=True, photometric='minisblack',
+                             planarconfig='contig', metadata={'axes': 'ZYXC'})
+    logging.info("Volume stored on disk: {}".format(filename))
+    return volume
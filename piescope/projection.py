@@ -0,0 +1,313 @@
+"""Module for projections of image volumes along the z axis.
+
+The projections are computed in a single pass over the volume, a chunk of
+z slices at a time, so peak memory is bounded by the chunk size even for
+memory-mapped volumes larger than the available memory.
+RunningProjection keeps the projections up to date while a volume is
+acquired, one frame at a time.
+"""
+import concurrent.futures
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PROJECTIONS = ('max', 'min', 'mean', 'sum', 'std', 'argmax')
+DEFAULT_CHUNK_NBYTES = 2 ** 26  # 64 MB of temporary arrays per chunk
+
+
+def _check_projections(projections):
+    if isinstance(projections, str):
+        projections = (projections,)
+    for projection in projections:
+        if projection not in PROJECTIONS:
+            raise ValueError("Unknown projection '{}'. Expected one of "
+                             "{}".format(projection, PROJECTIONS))
+    return tuple(projections)
+
+
+def _project_rows(volume, rows, outputs, chunk_size):
+    """Project the rows of the volume, one chunk of z slices at a time."""
+    count = 0
+    shift = 0
+    if 'std' in outputs:
+        # Summing squared differences from the first z slice, rather than
+        # squared values, avoids the loss of precision when subtracting
+        # large sums at the end
+        shift = volume[0, rows].astype(np.float64)
+    for start in range(0, volume.shape[0], chunk_size):
+        chunk = np.asarray(volume[start:start + chunk_size, rows])
+        if 'max' in outputs:
+            if start == 0:
+                chunk.max(axis=0, out=outputs['max'][rows])
+                if 'argmax' in outputs:
+                    chunk.argmax(axis=0, out=outputs['argmax'][rows])
+            elif 'argmax' in outputs:
+                chunk_max = chunk.max(axis=0)
+                # keep the first z slice of the maximum, like np.argmax
+                greater = chunk_max > outputs['max'][rows]
+                np.copyto(outputs['argmax'][rows],
+                          chunk.argmax(axis=0) + start, where=greater)
+                np.maximum(outputs['max'][rows], chunk_max,
+                           out=outputs['max'][rows])
+            else:
+                # one z slice at a time, without temporary arrays
+                for image in chunk:
+                    np.maximum(outputs['max'][rows], image,
+                               out=outputs['max'][rows])
+        if 'min' in outputs:
+            if start == 0:
+                chunk.min(axis=0, out=outputs['min'][rows])
+            else:
+                for image in chunk:
+                    np.minimum(outputs['min'][rows], image,
+                               out=outputs['min'][rows])
+        if 'std' in outputs:
+            difference = chunk - shift
+            outputs['sum'][rows] += difference.sum(axis=0)
+            np.square(difference, out=difference)
+            outputs['std'][rows] += difference.sum(axis=0)
+        elif 'sum' in outputs:
+            outputs['sum'][rows] += chunk.sum(axis=0, dtype=np.float64)
+        count += chunk.shape[0]
+    if 'std' in outputs:
+        shifted_sum = outputs['sum'][rows]
+        variance = (outputs['std'][rows] - shifted_sum ** 2 / count) / count
+        outputs['std'][rows] = np.sqrt(np.maximum(variance, 0))
+        outputs['sum'][rows] += shift * count
+    if 'mean' in outputs:
+        outputs['mean'][rows] = outputs['sum'][rows] / count
+
+
+def project(volume, projections=('max',), start_slice=0, end_slice=None,
+            chunk_nbytes=DEFAULT_CHUNK_NBYTES, num_workers=1):
+    """Project an image volume along the z axis.
+
+    Parameters
+    ----------
+    volume : ndarray
+        Image volume with dimensions (z_slices, rows, columns, channels),
+        eg: an in memory array or a memory-mapped TIFF file.
+    projections : str or tuple of str, optional
+        Any of 'max', 'min', 'mean', 'sum', 'std' (population standard
+        deviation) and 'argmax' (z slice index of the maximum, for depth
+        coded images). By default ('max',).
+    start_slice : int, optional
+        First z slice index of the projected sub-stack, by default 0.
+    end_slice : int, optional
+        Last z slice index of the projected sub-stack, not included.
+        By default None, meaning the last slice of the volume.
+    chunk_nbytes : int, optional
+        Approximate size in bytes of the z slices read at once, and of the
+        temporary arrays used to project them, by default 64 MB.
+    num_workers : int, optional
+        Number of threads projecting separate tiles of image rows,
+        by default 1.
+
+    Returns
+    -------
+    dict
+        Dictionary with structure {"projection name": ndarray}, each array
+        with dimensions (rows, columns, channels). 'max' and 'min' keep
+        the volume data type, 'argmax' is an integer array of z slice
+        indices relative to start_slice, the other projections are float64.
+
+    Raises
+    ------
+    ValueError
+        Raised if the volume does not have 4 dimensions, the sub-stack is
+        empty, or a projection name is not recognised.
+    """
+    projections = _check_projections(projections)
+    if volume.ndim != 4:
+        raise ValueError("expecting numpy.array with dimensions "
+                         "(pln, row, col, ch)")
+    volume = volume[start_slice:end_slice]
+    if volume.shape[0] == 0:
+        raise ValueError("Cannot project an empty sub-stack of z slices.")
+    num_z_slices, num_rows = volume.shape[:2]
+    image_shape = volume.shape[1:]
+
+    outputs = {}
+    if 'max' in projections or 'argmax' in projections:
+        outputs['max'] = np.empty(image_shape, dtype=volume.dtype)
+    if 'argmax' in projections:
+        outputs['argmax'] = np.empty(image_shape, dtype=np.intp)
+    if 'min' in projections:
+        outputs['min'] = np.empty(image_shape, dtype=volume.dtype)
+    if set(projections) & {'mean', 'sum', 'std'}:
+        outputs['sum'] = np.zeros(image_shape, dtype=np.float64)
+    if 'mean' in projections:
+        outputs['mean'] = np.empty(image_shape, dtype=np.float64)
+    if 'std' in projections:
+        # holds the sum of squares until the end of the projection
+        outputs['std'] = np.zeros(image_shape, dtype=np.float64)
+
+    num_workers = max(1, min(int(num_workers), num_rows))
+    tile_rows = -(-num_rows // num_workers)  # ceiling division
+    tiles = [slice(start, start + tile_rows)
+             for start in range(0, num_rows, tile_rows)]
+    # Temporary arrays are float64 for the standard deviation
+    itemsize = max(volume.dtype.itemsize, 8 if 'std' in outputs else 0)
+    tile_nbytes = tile_rows * np.prod(image_shape[1:]) * itemsize
+    chunk_size = int(max(1, chunk_nbytes // (num_workers * tile_nbytes)))
+    logger.debug("Projecting {} z slices in chunks of {}, in {} row "
+                 "tiles".format(num_z_slices, chunk_size, len(tiles)))
+
+    if len(tiles) == 1:
+        _project_rows(volume, tiles[0], outputs, chunk_size)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(num_workers) as executor:
+            futures = [executor.submit(_project_rows, volume, rows,
+                                       outputs, chunk_size)
+                       for rows in tiles]
+            for future in futures:
+                future.result()
+    return {projection: outputs[projection] for projection in projections}
+
+
+class RunningProjection():
+    """Projections of an image volume updated one frame at a time.
+
+    Keeps the projections of all the frames seen so far, so they are
+    available while the volume is still being acquired. Memory use and the
+    cost of each update are constant, whatever the number of z slices.
+    Frames can arrive in any order of z slices and channels.
+
+    Parameters
+    ----------
+    num_channels : int
+        Number of channels in the volume.
+    projections : str or tuple of str, optional
+        Projections to keep, any of PROJECTIONS. By default ('max', 'mean').
+
+    Examples
+    --------
+    >>> projection = RunningProjection(len(laser_dict))
+    >>> volume = volume_acquisition(laser_dict, 10, 500,
+    ...                             projection=projection)
+    >>> max_intensity = projection.result()['max']  # also during acquisition
+    """
+    def __init__(self, num_channels, projections=('max', 'mean')):
+        self.num_channels = int(num_channels)
+        self.projections = _check_projections(projections)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget all the frames seen so far."""
+        with self._lock:
+            self.counts = np.zeros(self.num_channels, dtype=np.intp)
+            # Channel first arrays, so each channel is contiguous in memory
+            self._accumulators = None
+            self._shift = None
+
+    @property
+    def num_frames(self):
+        """Total number of frames seen so far."""
+        return int(self.counts.sum())
+
+    def _allocate(self, frame):
+        shape = (self.num_channels,) + frame.shape
+        accumulators = {}
+        if 'max' in self.projections or 'argmax' in self.projections:
+            accumulators['max'] = np.zeros(shape, dtype=frame.dtype)
+        if 'argmax' in self.projections:
+            accumulators['argmax'] = np.zeros(shape, dtype=np.intp)
+        if 'min' in self.projections:
+            accumulators['min'] = np.zeros(shape, dtype=frame.dtype)
+        if set(self.projections) & {'mean', 'sum', 'std'}:
+            accumulators['sum'] = np.zeros(shape, dtype=np.float64)
+        if 'std' in self.projections:
+            # sum of squared differences from the first frame of a channel
+            accumulators['sum_squares'] = np.zeros(shape, dtype=np.float64)
+            self._shift = np.zeros(shape, dtype=np.float64)
+        self._accumulators = accumulators
+
+    def update(self, z_slice, channel, frame):
+        """Add a frame to the projections.
+
+        The signature matches the frame callbacks of
+        piescope.lm.pipeline.FrameWriter, so it can be used as one.
+
+        Parameters
+        ----------
+        z_slice : int
+            Z slice index of the frame.
+        channel : int
+            Channel index of the frame.
+        frame : ndarray
+            Image with dimensions (rows, columns).
+        """
+        frame = np.asarray(frame)
+        with self._lock:
+            if self._accumulators is None:
+                self._allocate(frame)
+            accumulators = self._accumulators
+            first = self.counts[channel] == 0
+            if 'max' in accumulators:
+                maximum = accumulators['max'][channel]
+                if first:
+                    maximum[...] = frame
+                    if 'argmax' in accumulators:
+                        accumulators['argmax'][channel] = z_slice
+                else:
+                    if 'argmax' in accumulators:
+                        argmax = accumulators['argmax'][channel]
+                        # keep the first z slice of the maximum, like np.argmax
+                        replace = frame > maximum
+                        replace |= (frame == maximum) & (argmax > z_slice)
+                        argmax[replace] = z_slice
+                    np.maximum(maximum, frame, out=maximum)
+            if 'min' in accumulators:
+                minimum = accumulators['min'][channel]
+                if first:
+                    minimum[...] = frame
+                else:
+                    np.minimum(minimum, frame, out=minimum)
+            if 'sum_squares' in accumulators:
+                if first:
+                    self._shift[channel] = frame
+                difference = frame - self._shift[channel]
+                accumulators['sum'][channel] += difference
+                np.square(difference, out=difference)
+                accumulators['sum_squares'][channel] += difference
+            elif 'sum' in accumulators:
+                accumulators['sum'][channel] += frame
+            self.counts[channel] += 1
+
+    def result(self):
+        """Projections of the frames seen so far.
+
+        Returns
+        -------
+        dict
+            Dictionary with structure {"projection name": ndarray}, each
+            array with dimensions (rows, columns, channels), like project().
+            Channels without any frames yet are zero.
+            None if there are no frames yet.
+        """
+        with self._lock:
+            if self._accumulators is None:
+                return None
+            accumulators = self._accumulators
+            counts = np.maximum(self.counts, 1)[:, np.newaxis, np.newaxis]
+            results = {}
+            for projection in self.projections:
+                if projection == 'std':
+                    shifted_sum = accumulators['sum']
+                    variance = (accumulators['sum_squares']
+                                - shifted_sum ** 2 / counts) / counts
+                    result = np.sqrt(np.maximum(variance, 0))
+                elif projection in ('sum', 'mean'):
+                    result = accumulators['sum']
+                    if self._shift is not None:
+                        result = result + self._shift * counts
+                    if projection == 'mean':
+                        result = result / counts
+                else:
+                    result = accumulators[projection]
+                results[projection] = np.moveaxis(result, 0, -1).copy()
+            return results
@@ -0,0 +1,271 @@
+"""Module for multiscale image pyramids of large images.
+
+Each level of a pyramid is half the size of the previous one. The levels
+are stored as tiled sub-images (SubIFDs) of a single TIFF file, so a viewer
+can read just the tiles it displays from the coarsest level with enough
+resolution, instead of decoding the whole full resolution image.
+"""
+import json
+import logging
+import threading
+
+import numpy as np
+import tifffile
+
+import piescope.utils
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TILE_SIZE = 256
+
+
+def build_pyramid(image, min_size=DEFAULT_TILE_SIZE):
+    """Downsample an image until it fits in min_size x min_size pixels.
+
+    Parameters
+    ----------
+    image : ndarray
+        Image with dimensions (rows, columns) or (rows, columns, channels).
+    min_size : int, optional
+        Largest number of rows and columns of the coarsest level,
+        by default DEFAULT_TILE_SIZE.
+
+    Returns
+    -------
+    list of ndarray
+        Pyramid levels, starting from the full resolution image.
+    """
+    levels = [image]
+    while max(levels[-1].shape[:2]) > min_size:
+        levels.append(piescope.utils.downsample(levels[-1]))
+    return levels
+
+
+def write_pyramid(filename, image, metadata=None, tile_size=DEFAULT_TILE_SIZE,
+                  min_size=None, bigtiff=None, **compression_options):
+    """Write an image and its downsampled levels to a pyramidal TIFF file.
+
+    The full resolution image is the main image of the file, and the other
+    levels are its sub-images (SubIFDs), which tifffile and PyramidReader
+    read as a multiscale series. All levels are tiled. Bio-Formats (Fiji,
+    QuPath) only reads sub-image pyramids from OME-TIFF files, so it opens
+    the full resolution image alone.
+
+    Parameters
+    ----------
+    filename : str
+        TIFF filename.
+    image : ndarray
+        Image with dimensions (rows, columns) or (rows, columns, channels).
+    metadata : dict, optional
+        Any JSON serializable metadata, saved as JSON in the image
+        description of the full resolution image.
+    tile_size : int, optional
+        Tile rows and columns, a multiple of 16. By default 256.
+    min_size : int, optional
+        Largest number of rows and columns of the coarsest level,
+        by default the tile size.
+    bigtiff : bool, optional
+        Whether to write a BigTIFF file. By default None, meaning only
+        when the image is larger than 2 GB.
+    **compression_options
+        Any of the compression, compression_level, predictor and
+        max_workers keyword arguments of piescope.utils.save_image().
+
+    Returns
+    -------
+    list of tuple
+        Shape of each level.
+    """
+    if image.ndim not in (2, 3):
+        raise ValueError("Wrong number of dimensions in input image! "
+                         "Expected an image with 2 or 3 dimensions, "
+                         "but found {} dimensions".format(image.ndim))
+    if tile_size % 16:
+        raise ValueError("Tile size must be a multiple of 16, "
+                         "found {}".format(tile_size))
+    if min_size is None:
+        min_size = tile_size
+    if bigtiff is None:
+        bigtiff = image.nbytes > 2 ** 31
+    levels = build_pyramid(image, min_size=min_size)
+    options = {'tile': (tile_size, tile_size), 'photometric': 'minisblack'}
+    if image.ndim == 3:
+        options['planarconfig'] = 'contig'
+    options.update(piescope.utils._compression_options(**compression_options))
+    with tifffile.TiffWriter(filename, bigtiff=bigtiff) as tif:
+        # Plain JSON description, tifffile's shaped series metadata is
+        # invalid on an image with sub-images
+        description = json.dumps(metadata) if metadata is not None else None
+        tif.write(levels[0], subifds=len(levels) - 1,
+                  description=description, metadata=None, **options)
+        for level in levels[1:]:
+            tif.write(level, subfiletype=1, metadata=None, **options)
+    logging.debug("Saved: {}".format(filename))
+    return [level.shape for level in levels]
+
+
+class PyramidReader():
+    """Level of detail reader for pyramidal TIFF files.
+
+    Only the tiles overlapping the requested region are read and decoded.
+
+    Parameters
+    ----------
+    filename : str
+        TIFF filename, eg: written by write_pyramid().
+
+    Examples
+    --------
+    >>> with PyramidReader('ion_image.tif') as pyramid:
+    ...     # whole image, downsampled to fit in a 512 x 512 pixel window
+    ...     overview, level = pyramid.read_region(max_shape=(512, 512))
+    ...     # full resolution detail
+    ...     detail = pyramid.read(0, slice(1000, 1512), slice(2000, 2512))
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._tif = tifffile.TiffFile(filename)
+        self._pages = [level.keyframe for level in self._tif.series[0].levels]
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the TIFF file."""
+        self._tif.close()
+
+    @property
+    def num_levels(self):
+        """Number of pyramid levels, including full resolution."""
+        return len(self._pages)
+
+    @property
+    def shapes(self):
+        """Shape of each pyramid level."""
+        return [page.shape for page in self._pages]
+
+    @property
+    def dtype(self):
+        """Data type of the image."""
+        return self._pages[0].dtype
+
+    def level_for_downsample(self, downsample):
+        """Coarsest level with at least 1 / downsample of full resolution.
+
+        Parameters
+        ----------
+        downsample : float
+            Number of full resolution pixels per displayed pixel.
+
+        Returns
+        -------
+        int
+            Pyramid level index, 0 is full resolution.
+        """
+        if downsample <= 1:
+            return 0
+        level = int(np.floor(np.log2(downsample)))
+        return min(level, self.num_levels - 1)
+
+    def read(self, level=0, rows=slice(None), columns=slice(None)):
+        """Read a region of a pyramid level.
+
+        Parameters
+        ----------
+        level : int, optional
+            Pyramid level index, by default 0 (full resolution).
+        rows : slice, optional
+            Rows of the region, in level pixel coordinates.
+            By default all rows.
+        columns : slice, optional
+            Columns of the region, in level pixel coordinates.
+            By default all columns.
+
+        Returns
+        -------
+        ndarray
+            Image region with dimensions (rows, columns) or
+            (rows, columns, channels).
+        """
+        page = self._pages[level]
+        num_rows, num_columns = page.shape[:2]
+        row_start, row_stop, _ = rows.indices(num_rows)
+        column_start, column_stop, _ = columns.indices(num_columns)
+        row_stop = max(row_start, row_stop)
+        column_stop = max(column_start, column_stop)
+        if not page.is_tiled:
+            return page.asarray()[row_start:row_stop,
+                                  column_start:column_stop]
+        out = np.empty((row_stop - row_start, column_stop - column_start)
+                       + page.shape[2:], dtype=page.dtype)
+        tile_rows, tile_columns = page.tilelength, page.tilewidth
+        tiles_across = -(-num_columns // tile_columns)
+        decode = page.decode
+        filehandle = self._tif.filehandle
+        for tile_row in range(row_start // tile_rows,
+                              -(-row_stop // tile_rows)):
+            for tile_column in range(column_start // tile_columns,
+                                     -(-column_stop // tile_columns)):
+                index = tile_row * tiles_across + tile_column
+                with self._lock:
+                    filehandle.seek(page.dataoffsets[index])
+                    data = filehandle.read(page.databytecounts[index])
+                tile = decode(data, index)[0]
+                tile = tile.reshape(tile.shape[1:3] + page.shape[2:])
+                # Overlap of the tile with the region, in image coordinates
+                top = max(row_start, tile_row * tile_rows)
+                bottom = min(row_stop, (tile_row + 1) * tile_rows)
+                left = max(column_start, tile_column * tile_columns)
+                right = min(column_stop, (tile_column + 1) * tile_columns)
+                out[top - row_start:bottom - row_start,
+                    left - column_start:right - column_start] = tile[
+                        top - tile_row * tile_rows:
+                        bottom - tile_row * tile_rows,
+                        left - tile_column * tile_columns:
+                        right - tile_column * tile_columns]
+        return out
+
+    def read_region(self, rows=slice(None), columns=slice(None),
+                    max_shape=None):
+        """Read a region from the coarsest level that resolves it.
+
+        Parameters
+        ----------
+        rows : slice, optional
+            Rows of the region, in full resolution pixel coordinates.
+            By default all rows.
+        columns : slice, optional
+            Columns of the region, in full resolution pixel coordinates.
+            By default all columns.
+        max_shape : tuple of int, optional
+            Number of (rows, columns) the region is displayed with.
+            By default None, meaning full resolution.
+
+        Returns
+        -------
+        image : ndarray
+            Image region from the selected level, with at least max_shape
+            pixels unless it is the coarsest level.
+        level : int
+            Pyramid level index the region was read from. Each pixel covers
+            2**level x 2**level full resolution pixels.
+        """
+        num_rows, num_columns = self._pages[0].shape[:2]
+        row_start, row_stop, _ = rows.indices(num_rows)
+        column_start, column_stop, _ = columns.indices(num_columns)
+        level = 0
+        if max_shape is not None:
+            level = self.level_for_downsample(min(
+                (row_stop - row_start) / max_shape[0],
+                (column_stop - column_start) / max_shape[1]))
+        scale = 2 ** level
+        image = self.read(level,
+                          slice(row_start // scale, -(-row_stop // scale)),
+                          slice(column_start // scale,
+                                -(-column_stop // scale)))
+        return image, level
@@ -1,16 +1,72 @@
+import atexit
+import concurrent.futures
 from datetime import datetime
+import functools
 import logging
 import os
+import queue
 import re
+import threading
+import time
+import weakref
 
 import numpy as np
 import skimage.color
 import skimage.io
 import skimage.util
+import tifffile
+
+import piescope.projection
+
+COMPRESSION_CODECS = ('zlib', 'lzw', 'zstd')
+STRIP_NBYTES = 2 ** 18  # target size of compressed TIFF strips, in bytes
+
+
+def available_compression():
+    """Compression codecs available to save images with.
+
+    zlib (deflate) compression is always available. LZW and zstd need the
+    optional imagecodecs package.
+
+    Returns
+    -------
+    tuple of str
+        Names of the available codecs, see COMPRESSION_CODECS.
+    """
+    try:
+        import imagecodecs  # noqa: F401
+    except ImportError:
+        return ('zlib',)
+    return COMPRESSION_CODECS
+
+
+def _compression_options(compression=None, compression_level=None,
+                         predictor=False, max_workers=None, row_nbytes=None):
+    """Keyword arguments for tifffile to write compressed images."""
+    if compression is None:
+        return {}
+    if compression == 'deflate':
+        compression = 'zlib'
+    if compression not in COMPRESSION_CODECS:
+        raise ValueError("Unknown compression '{}'. Expected one of "
+                         "{}".format(compression, COMPRESSION_CODECS))
+    if compression not in available_compression():
+        raise ValueError("Compression '{}' needs the imagecodecs package, "
+                         "install it with: pip install imagecodecs".format(
+                             compression))
+    options = {'compression': compression, 'predictor': bool(predictor),
+               'maxworkers': max_workers}
+    if compression_level is not None:
+        options['compressionargs'] = {'level': compression_level}
+    if row_nbytes:
+        # Several strips per image, so they can be compressed in parallel
+        options['rowsperstrip'] = max(1, STRIP_NBYTES // row_nbytes)
+    return options
 
 
 def save_image(image, destination, metadata={}, *, allow_overwrite=False,
-               timestamp=True):
+               timestamp=True, compression=None, compression_level=None,
+               predictor=False, max_workers=None):
     """Save image to file.
 
     Parameters
@@ -32,6 +88,26 @@ def save_image(image, destination, metadata={}, *, allow_overwrite=False,
         Time stamp appended to filename.
         Uses ISO 8601 standard format, YYYY-mm-ddTTHHmmsszz
         ISO 8601 reference: https://en.wikipedia.org/wiki/ISO_8601
+    compression : {None, 'zlib', 'lzw', 'zstd'}, optional
+        Lossless compression codec, by default None (uncompressed).
+        'deflate' is an alias for 'zlib'. See available_compression().
+        Only used for numpy arrays.
+    compression_level : int, optional
+        Compression level, by default None, the codec's default level.
+        Lower levels are faster, higher levels give smaller files.
+    predictor : bool, optional
+        Whether to store the difference between neighbouring pixels
+        instead of their values, by default False. This compresses smooth
+        images like fluorescence microscopy data better.
+    max_workers : int, optional
+        Number of threads compressing image strips in parallel,
+        by default None, meaning tifffile picks a number based on the CPUs.
+
+    Returns
+    -------
+    str
+        Filename the image was saved to, including any time stamp
+        and "_(1)" style suffix.
 
     Notes
     -----
@@ -55,24 +131,104 @@ def save_image(image, destination, metadata={}, *, allow_overwrite=False,
         timestamp_string = datetime.now().strftime("_%Y-%m-%dT%H%M%S%f")
         base, ext = os.path.splitext(destination)
         destination = base + timestamp_string + ext
-    # Modify filename to prevent overwriting, if allow_overwrite is False
-    # Appends filenames with "_(1)", "_(2)", etc.
-    if allow_overwrite is False:
-        while os.path.exists(destination):
-            base, ext = os.path.splitext(destination)
-            regex_match = re.search("_\([0-9]*\)$", base)
-            if regex_match:
-                current_idx = int(regex_match.group(0)[2:-1])  # strip "_(" ")"
-                suffix_len = len(regex_match.group(0))
-                destination = (
-                    base[:-suffix_len] + "_({})".format(current_idx + 1) + ext
-                )
-            else:
-                destination = base + "_(1)" + ext
     # If directory does not currently exist, create it
     directory_name = os.path.dirname(destination)
     if not directory_name == '' and not os.path.isdir(directory_name):
         os.makedirs(directory_name)
+    # Modify filename to prevent overwriting, if allow_overwrite is False
+    # Appends filenames with "_(1)", "_(2)", etc.
+    if allow_overwrite is False:
+        destination = _reserve_filename(destination)
+    compression_options = {
+        'compression': compression,
+        'compression_level': compression_level,
+        'predictor': predictor,
+        'max_workers': max_workers,
+    }
+    try:
+        _write_image(image, destination, metadata, compression_options)
+    except Exception:
+        if allow_overwrite is False:
+            os.remove(destination)  # the empty reserved file
+        raise
+    return destination
+
+
+_SUFFIX_PATTERN = re.compile(r"_\(([0-9]+)\)$")
+_filename_counters = {}
+_filename_lock = threading.Lock()
+
+
+def _next_filename_index(root, ext):
+    """Index after the largest "_(n)" suffix of a filename in its directory."""
+    directory = os.path.dirname(root) or os.curdir
+    pattern = re.compile(re.escape(os.path.basename(root))
+                         + r"(?:_\(([0-9]+)\))?" + re.escape(ext) + "$")
+    index = 0
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            match = pattern.match(entry.name)
+            if match:
+                index = max(index, int(match.group(1) or 0) + 1)
+    return index
+
+
+def _reserve_filename(destination):
+    """Create an empty file at the first free numbered filename.
+
+    The candidates are destination, then "_(1)", "_(2)", etc. appended to
+    its base name. After the first name collision the directory is scanned
+    once, and from then on the next index for the base name is cached, so
+    finding a free filename takes constant time even in directories with
+    thousands of images of the same name. Files are created with O_EXCL,
+    so concurrent writers, in this or other processes, never get the same
+    file.
+
+    Parameters
+    ----------
+    destination : str
+        Filename with extension, eg: "image.tif" or "image_(3).tif".
+
+    Returns
+    -------
+    str
+        The reserved filename.
+    """
+    base, ext = os.path.splitext(destination)
+    regex_match = _SUFFIX_PATTERN.search(base)
+    if regex_match:
+        root = base[:regex_match.start()]
+        first_index = int(regex_match.group(1))
+    else:
+        root = base
+        first_index = 0
+    key = os.path.normcase(os.path.abspath(root + ext))
+    with _filename_lock:
+        scanned = key in _filename_counters
+        index = max(_filename_counters.get(key, 0), first_index)
+        while True:
+            if index == 0:
+                candidate = root + ext
+            else:
+                candidate = "{}_({}){}".format(root, index, ext)
+            try:
+                file_descriptor = os.open(
+                    candidate, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if scanned:
+                    index += 1  # created by another process
+                else:
+                    scanned = True
+                    index = max(index + 1, _next_filename_index(root, ext))
+                continue
+            os.close(file_descriptor)
+            if scanned:
+                _filename_counters[key] = index + 1
+            return candidate
+
+
+def _write_image(image, destination, metadata, compression_options):
+    """Write an image to a TIFF file, see save_image()."""
     try:
         image.save(destination)  # eg: for AutoScript AdornedImage datatypes
         logging.debug("Saved: {}".format(destination))
@@ -83,26 +239,29 @@ def save_image(image, destination, metadata={}, *, allow_overwrite=False,
     except AttributeError:
         # numpy array metadata is saved with regular metadata (not OME-TIFF)
         if isinstance(image, np.ndarray):
+            metadata = dict(metadata)  # don't modify the caller's dict
             # Make sure we have the right datatype to svae for ImageJ
             if image.dtype.char not in 'BHhf':  # uint8, uint16, int16, or ?
                 image = skimage.util.img_as_uint(image)  # 16 bit unsigned int
-            # If it's a volume image, must move channel axis before saving
             if image.ndim == 4:  # (ZYXC)
-                image = np.moveaxis(image, -1, 1)  # move channel axis (ZCYX)
-                metadata.update({'axes':'ZCYX'})
-                skimage.io.imsave(destination, image, imagej=True,
-                    metadata=metadata)
-                logging.debug("Saved: {}".format(destination))
-            if image.ndim == 3:  # (YXC)
+                # Written one YX image at a time in ZCYX page order,
+                # so the whole volume is never copied
+                write_volume(destination, image, metadata=metadata,
+                             **compression_options)
+            elif image.ndim == 3:  # (YXC)
                 image = np.moveaxis(image, -1, 0)  # move channel axis (CYX)
                 metadata.update({'axes':'CYX'})
-                skimage.io.imsave(destination, image, imagej=True,
-                    metadata=metadata)
-                logging.debug("Saved: {}".format(destination))
+                # not skimage.io.imsave, which would treat 3 channels as RGB
+                tifffile.imwrite(destination, image, imagej=True,
+                    metadata=metadata, photometric='minisblack',
+                    **_compression_options(
+                        row_nbytes=image[0, 0].nbytes, **compression_options))
             else:  # Save all other images without changes
+                row_nbytes = image[0].nbytes if image.ndim > 0 else None
                 skimage.io.imsave(destination, image, imagej=True,
-                    metadata=metadata)
-                logging.debug("Saved: {}".format(destination))
+                    metadata=metadata, **_compression_options(
+                        row_nbytes=row_nbytes, **compression_options))
+            logging.debug("Saved: {}".format(destination))
         else:
             raise ValueError(
                 "Cannot save image! Expected a numpy array or AdornedImage, "
@@ -110,6 +269,417 @@ def save_image(image, destination, metadata={}, *, allow_overwrite=False,
                 )
 
 
+def _shutdown_at_exit(reference):
+    """Shut down a SaveQueue at interpreter exit, if it is still alive."""
+    save_queue = reference()
+    if save_queue is not None:
+        save_queue.shutdown()
+
+
+class SaveQueue():
+    """Save images in background threads, so imaging can continue.
+
+    Images are saved with save_image() by a pool of worker threads.
+    Any images still waiting to be saved are flushed when the queue is
+    shut down, or when the Python interpreter exits.
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        Number of images saved at the same time, by default 2.
+    maxsize : int, optional
+        Maximum number of images waiting to be saved, by default 8.
+        save() blocks when the queue is full, limiting memory use.
+
+    Attributes
+    ----------
+    errors : list of Exception
+        Errors raised while saving images.
+
+    Examples
+    --------
+    >>> with SaveQueue() as save_queue:
+    ...     future = save_queue.save(image, 'image.tif')
+    >>> future.result()  # the saved filename
+    """
+    def __init__(self, max_workers=2, maxsize=8):
+        self.errors = []
+        self.num_saved = 0
+        self.bytes_written = 0
+        self.write_time = 0.
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._slots = threading.BoundedSemaphore(maxsize + max_workers)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='SaveQueue')
+        # A weak reference, so the exit hook doesn't keep queues that are
+        # no longer used alive until the interpreter exits
+        self._atexit_hook = functools.partial(_shutdown_at_exit,
+                                              weakref.ref(self))
+        atexit.register(self._atexit_hook)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    @property
+    def queue_depth(self):
+        """Number of images waiting to be saved, or being saved."""
+        return self._pending
+
+    def save(self, image, destination, metadata=None, **kwargs):
+        """Save an image in the background.
+
+        Parameters
+        ----------
+        image : ndarray or AdornedImage
+            Image to save. It must not be modified after it is passed in.
+        destination : str
+            Filename of saved image, see save_image().
+        metadata : dict, optional
+            Image metadata, see save_image().
+        **kwargs
+            Any other keyword arguments for save_image(),
+            eg: allow_overwrite, timestamp.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Future holding the saved filename, or the error raised while
+            saving the image.
+        """
+        if metadata is None:
+            metadata = {}
+        self._slots.acquire()
+        with self._lock:
+            self._pending += 1
+        try:
+            future = self._executor.submit(
+                self._save, image, destination, metadata, kwargs)
+        except Exception:
+            self._done()
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def flush(self):
+        """Wait for all the images queued so far to be saved.
+
+        Raises
+        ------
+        Exception
+            The first error raised while saving images since the last flush.
+        """
+        with self._idle:
+            while self._pending > 0:
+                self._idle.wait()
+            errors, self.errors = self.errors, []
+        if errors:
+            raise errors[0]
+
+    def shutdown(self):
+        """Save all the queued images and stop the worker threads."""
+        atexit.unregister(self._atexit_hook)
+        self._executor.shutdown(wait=True)
+        if self.errors:
+            logging.error("{} images could not be saved, first error: "
+                          "{}".format(len(self.errors), self.errors[0]))
+
+    def stats(self):
+        """Save queue depth and write throughput.
+
+        Returns
+        -------
+        dict
+            Dictionary with keys 'queue_depth', 'num_saved', 'num_errors',
+            'bytes_written' and 'throughput' (bytes written per second
+            spent saving, in MB/s).
+        """
+        with self._lock:
+            write_time = self.write_time
+            return {
+                'queue_depth': self._pending,
+                'num_saved': self.num_saved,
+                'num_errors': len(self.errors),
+                'bytes_written': self.bytes_written,
+                'throughput': (self.bytes_written / write_time / 1e6
+                               if write_time > 0 else 0.),
+            }
+
+    def _save(self, image, destination, metadata, kwargs):
+        start = time.perf_counter()
+        try:
+            filename = save_image(image, destination, metadata, **kwargs)
+        except Exception as e:
+            logging.error("Error saving image {}: {}".format(destination, e))
+            with self._lock:
+                self.errors.append(e)
+            raise
+        nbytes = os.path.getsize(filename)
+        with self._lock:
+            self.num_saved += 1
+            self.bytes_written += nbytes
+            self.write_time += time.perf_counter() - start
+        return filename
+
+    def _done(self, future=None):
+        with self._idle:
+            self._pending -= 1
+            if self._pending == 0:
+                self._idle.notify_all()
+        self._slots.release()
+
+
+def _volume_pages(z_slices, num_z_slices):
+    """Pages of a ZYXC volume, in ZCYX order, one YX image at a time."""
+    for _, z_slice in zip(range(num_z_slices), z_slices):
+        z_slice = np.asarray(z_slice)
+        for channel in range(z_slice.shape[-1]):
+            yield np.ascontiguousarray(z_slice[..., channel])
+
+
+def _volume_writer_options(shape, dtype, metadata, bigtiff,
+                           **compression_options):
+    """Keyword arguments for tifffile to write a ZYXC volume as ZCYX."""
+    metadata = dict(metadata) if metadata is not None else {}
+    metadata['axes'] = 'ZCYX'
+    num_z_slices, rows, columns, channels = shape
+    if bigtiff is None:
+        nbytes = np.prod(shape, dtype=np.int64) * np.dtype(dtype).itemsize
+        bigtiff = nbytes > 2 ** 32 - 2 ** 25
+    options = {'shape': (num_z_slices, channels, rows, columns),
+               'dtype': dtype, 'metadata': metadata,
+               'photometric': 'minisblack'}
+    options.update(_compression_options(
+        row_nbytes=columns * np.dtype(dtype).itemsize, **compression_options))
+    if bigtiff:
+        # ImageJ can't open BigTIFF files, write a generic hyperstack
+        return {'bigtiff': True}, options
+    return {'imagej': True}, options
+
+
+def write_volume(filename, volume, metadata=None, bigtiff=None,
+                 **compression_options):
+    """Write a ZYXC image volume to a TIFF file in ZCYX page order.
+
+    Each YX image is copied on its own as it is written,
+    so the whole volume is never copied.
+
+    Parameters
+    ----------
+    filename : str
+        TIFF filename.
+    volume : ndarray
+        Image volume with dimensions (z_slices, rows, columns, channels).
+    metadata : dict, optional
+        Any ImageJ metadata, eg: {'spacing': 0.5, 'unit': 'um'}.
+    bigtiff : bool, optional
+        Whether to write a BigTIFF file instead of an ImageJ hyperstack.
+        By default None, meaning only when the volume is larger than 4 GB.
+    **compression_options
+        Any of the compression, compression_level, predictor and
+        max_workers keyword arguments of save_image().
+    """
+    writer_options, options = _volume_writer_options(
+        volume.shape, volume.dtype, metadata, bigtiff, **compression_options)
+    with tifffile.TiffWriter(filename, **writer_options) as tif:
+        tif.write(_volume_pages(volume, volume.shape[0]), **options)
+
+
+def load_image(filename, memmap=True, channels_last=True):
+    """Load an image or image volume saved by save_image().
+
+    Uncompressed files are memory-mapped instead of read, so opening even
+    the largest volumes is instant, and only the pixels that are accessed
+    are read from disk.
+
+    Parameters
+    ----------
+    filename : str
+        TIFF filename, eg: saved by save_image() or write_volume(), or
+        the disk storage of piescope.lm.volume.create_volume().
+    memmap : bool, optional
+        Whether to memory-map uncompressed files, by default True.
+        Compressed files are always read into memory.
+    channels_last : bool, optional
+        Whether to return images with the channel axis last, like
+        save_image() takes them: (pln, row, col, ch) volumes and
+        (row, col, ch) images. Otherwise the axes are in the file order,
+        eg: (pln, ch, row, col) and (ch, row, col) for files saved by
+        save_image(). By default True.
+
+    Returns
+    -------
+    ndarray
+        Image array, a read-only numpy.memmap view of the file if it was
+        memory-mapped.
+
+    Notes
+    -----
+    ImageJ hyperstacks don't store axes of length 1, so volumes with a
+    single channel or z slice are returned with 3 dimensions.
+    """
+    with tifffile.TiffFile(filename) as tif:
+        series = tif.series[0]
+        axes = series.axes
+        mappable = series.dataoffset is not None
+    if memmap and mappable:
+        image = tifffile.memmap(filename, mode='r')
+    else:
+        if memmap:
+            logging.debug("Cannot memory-map {}, it is compressed or not "
+                          "contiguous. Reading it instead.".format(filename))
+        image = tifffile.imread(filename)
+    if not channels_last or not set(axes) <= set('ZCYX'):
+        return image
+    if 'Z' in axes and 'C' not in axes:
+        image = image[..., np.newaxis]  # single channel volume (ZYX)
+        axes += 'C'
+    # ZCYX files from save_image(), ZYXC files from create_volume()
+    return np.transpose(image, [axes.index(axis) for axis in 'ZYXC'
+                                if axis in axes])
+
+
+class VolumeWriter():
+    """Stream an image volume to a TIFF file, one z slice at a time.
+
+    Each z slice can be written as soon as it is acquired, so the whole
+    volume never needs to be held in memory. The TIFF file is written by
+    a background thread, in ZCYX page order, and each byte is written once.
+
+    Parameters
+    ----------
+    filename : str
+        TIFF filename.
+    shape : tuple of int
+        Volume shape (z_slices, rows, columns, channels).
+    dtype : numpy dtype
+        Volume data type, eg: np.uint8 or np.uint16.
+    metadata : dict, optional
+        Any ImageJ metadata, eg: {'spacing': 0.5, 'unit': 'um'}.
+    bigtiff : bool, optional
+        Whether to write a BigTIFF file instead of an ImageJ hyperstack.
+        By default None, meaning only when the volume is larger than 4 GB.
+    maxsize : int, optional
+        Maximum number of z slices waiting to be written, by default 4.
+        write() blocks when the queue is full, limiting memory use.
+    **compression_options
+        Any of the compression, compression_level, predictor and
+        max_workers keyword arguments of save_image().
+
+    Examples
+    --------
+    >>> with VolumeWriter('volume.tif', (10, 1200, 1920, 2), np.uint8) as w:
+    ...     for z_slice in acquire_z_slices():
+    ...         w.write(z_slice)
+    """
+    def __init__(self, filename, shape, dtype, metadata=None, bigtiff=None,
+                 maxsize=4, **compression_options):
+        if len(shape) != 4:
+            raise ValueError("Expected a volume shape (z_slices, rows, "
+                             "columns, channels), got {}".format(shape))
+        self.filename = filename
+        self.shape = tuple(int(length) for length in shape)
+        self.dtype = np.dtype(dtype)
+        self.num_written = 0
+        self.error = None
+        self._closed = False
+        self._writer_options, self._options = _volume_writer_options(
+            self.shape, self.dtype, metadata, bigtiff, **compression_options)
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='VolumeWriter')
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, z_slice):
+        """Append the next z slice to the volume.
+
+        Parameters
+        ----------
+        z_slice : ndarray
+            Image with shape (rows, columns, channels).
+            The image must not be modified after it is passed in.
+
+        Raises
+        ------
+        ValueError
+            Raised if the image has the wrong shape, or all the z slices
+            have already been written.
+        """
+        self._raise_error()
+        if self.num_written >= self.shape[0]:
+            raise ValueError("All {} z slices of the volume have already "
+                             "been written.".format(self.shape[0]))
+        z_slice = np.asarray(z_slice)
+        if z_slice.shape != self.shape[1:]:
+            raise ValueError("Expected a z slice with shape {}, got "
+                             "{}".format(self.shape[1:], z_slice.shape))
+        self._queue.put(z_slice.astype(self.dtype, copy=False))
+        self.num_written += 1
+
+    def close(self):
+        """Wait for the file to be written.
+
+        If fewer z slices were written than the volume shape, the remaining
+        z slices are filled with zeros.
+
+        Raises
+        ------
+        Exception
+            Any error raised while writing the file in the background thread.
+        """
+        if self._thread is not None:
+            if self.num_written < self.shape[0]:
+                logging.warning("Volume {} closed after {} of {} z slices, "
+                                "the rest are empty.".format(
+                                    self.filename, self.num_written,
+                                    self.shape[0]))
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._raise_error()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _z_slices(self):
+        empty = None
+        for _ in range(self.shape[0]):
+            z_slice = self._queue.get() if empty is None else None
+            if z_slice is None:  # closed early
+                if empty is None:
+                    self._closed = True
+                    empty = np.zeros(self.shape[1:], self.dtype)
+                z_slice = empty
+            yield z_slice
+
+    def _run(self):
+        try:
+            with tifffile.TiffWriter(self.filename,
+                                     **self._writer_options) as tif:
+                tif.write(_volume_pages(self._z_slices(), self.shape[0]),
+                          **self._options)
+            logging.debug("Saved: {}".format(self.filename))
+        except Exception as e:
+            logging.error("Error writing volume {}: {}".format(
+                self.filename, e))
+            self.error = e
+            # unblock write() and close() calls waiting on a full queue
+            while not self._closed:
+                self._closed = self._queue.get() is None
+
+
 def max_intensity_projection(image, start_slice=0, end_slice=None):
     """Returns maximum intensity projection of fluorescence image volume.
 
@@ -124,22 +694,8 @@ def max_intensity_projection(image, start_slice=0, end_slice=None):
     projected_max_intensity
         numpy array
     """
-    # Check input validity
-    if image.ndim != 4:
-        raise ValueError("expecting numpy.array with dimensions "
-                         "(pln, row, col, ch)")
-    # Slice image stack
-    if end_slice is None:
-        image = image[start_slice:, ...]
-    else:
-        image = image[start_slice:end_slice, ...]
-    image = np.moveaxis(image, -1, 0)
-    results = []
-    for channel_image in image:
-        max_intensity = np.max(channel_image, axis=0)
-        results.append(max_intensity)
-    projected_max_intensity = np.stack(results, axis=-1)
-    return projected_max_intensity
+    return piescope.projection.project(
+        image, 'max', start_slice=start_slice, end_slice=end_slice)['max']
 
 
 def rgb_image(image):
@@ -151,6 +707,7 @@ def rgb_image(image):
         Input image array to convert to an RGB image.
         Must have 2 (grayscale) or 3 (color) image dimensions.
         The number of color channels must be less than 3.
+        See ChannelCompositor for more channels and contrast windows.
 
     Returns
     -------
@@ -172,12 +729,12 @@ def rgb_image(image):
     elif image.ndim == 3:
         if image.shape[-1] == 1:
             rgb_image = np.zeros(shape=(image.shape[0], image.shape[1], 3),
-                                dtype=np.uint8)
+                                 dtype=image.dtype)
             rgb_image[:, :, 0] = image[:, :, 0]
             return rgb_image
         elif image.shape[-1] == 2:
             rgb_image = np.zeros(shape=(image.shape[0], image.shape[1], 3),
-                                dtype=np.uint8)
+                                 dtype=image.dtype)
             rgb_image[:, :, 0] = image[:, :, 0]
             rgb_image[:, :, 1] = image[:, :, 1]
             return rgb_image
@@ -188,3 +745,347 @@ def rgb_image(image):
              raise ValueError("Wrong number of image channels! "
                               "Expected up to 3 image channels, "
                               "but found {} channels.".format(image.shape[-1]))
+
+
+COMPOSITE_BLOCK_NPIXELS = 2 ** 17  # pixels composited at a time
+
+# Display colors of the channels, as (red, green, blue) fractions
+DEFAULT_CHANNEL_COLORS = (
+    (1., 0., 0.),  # red
+    (0., 1., 0.),  # green
+    (0., 0., 1.),  # blue
+    (1., 0., 1.),  # magenta
+    (0., 1., 1.),  # cyan
+    (1., 1., 0.),  # yellow
+)
+
+
+class ChannelCompositor():
+    """Blends any number of image channels into an RGB display image.
+
+    Each channel is mapped through a lookup table (LUT) combining its
+    contrast window and display color, and the channels are added together.
+    LUTs and working buffers are kept between calls, so compositing a stream
+    of camera frames only costs one lookup and one addition per channel.
+
+    The red, green and blue values of all channels are packed into a single
+    integer per pixel, with enough spare bits to add the channels together
+    without overflow, then clipped to 255 when unpacked.
+
+    Parameters
+    ----------
+    colors : list of tuple, optional
+        Display color of each channel, as (red, green, blue) fractions
+        between 0 and 1. By default DEFAULT_CHANNEL_COLORS for color
+        images, and white for grayscale images.
+    windows : list of tuple, optional
+        Contrast window (low, high) of each channel, mapped to the darkest
+        and brightest display values. A window of None uses the full range
+        of the image data type. By default None for all channels.
+
+    Examples
+    --------
+    >>> compositor = ChannelCompositor(windows=[(0, 1000)] * 4)
+    >>> display_image = compositor.composite(image)  # (row, col, 4) uint16
+    """
+    def __init__(self, colors=None, windows=None):
+        self.colors = list(colors) if colors is not None else None
+        self.windows = {}
+        if windows is not None:
+            self.windows = {channel: window for channel, window
+                            in enumerate(windows) if window is not None}
+        self._luts = {}
+        self._lut_key = None
+        self._buffers = None
+
+    def set_window(self, channel, low, high):
+        """Set the contrast window of a channel, None for the full range."""
+        if low is None or high is None:
+            self.windows.pop(channel, None)
+        else:
+            self.windows[channel] = (low, high)
+        self._luts.pop(channel, None)
+
+    def set_color(self, channel, color):
+        """Set the display color of a channel, as (red, green, blue)."""
+        if self.colors is None:
+            self.colors = list(DEFAULT_CHANNEL_COLORS)
+        self.colors[channel] = tuple(color)
+        self._luts.pop(channel, None)
+
+    def _color(self, channel, num_channels):
+        if self.colors is not None:
+            colors = self.colors
+        elif num_channels == 1:
+            colors = [(1., 1., 1.)]
+        else:
+            colors = DEFAULT_CHANNEL_COLORS
+        if channel >= len(colors):
+            raise ValueError("No display color for channel {}, found {} "
+                             "colors.".format(channel, len(colors)))
+        return colors[channel]
+
+    def _lut(self, channel, num_channels, dtype, field_bits, packed_dtype):
+        lut = self._luts.get(channel)
+        if lut is None:
+            levels = np.arange(np.iinfo(dtype).max + 1, dtype=np.float64)
+            low, high = self.windows.get(
+                channel, (0, np.iinfo(dtype).max))
+            intensity = np.clip((levels - low) / max(high - low, 1), 0, 1)
+            lut = np.zeros(levels.shape, dtype=packed_dtype)
+            for component, fraction in enumerate(
+                    self._color(channel, num_channels)):
+                values = np.round(intensity * fraction * 255)
+                lut |= values.astype(packed_dtype) << (component * field_bits)
+            self._luts[channel] = lut
+        return lut
+
+    def composite(self, image, out=None):
+        """Blend the image channels into an RGB display image.
+
+        Parameters
+        ----------
+        image : ndarray
+            uint8 or uint16 image with dimensions (rows, columns) or
+            (rows, columns, channels).
+        out : ndarray, optional
+            uint8 array with dimensions (rows, columns, 3) to write the
+            result into. By default a new array is allocated.
+
+        Returns
+        -------
+        ndarray (M, N, 3)
+            uint8 RGB image.
+
+        Raises
+        ------
+        ValueError
+            Raised if the image data type or dimensions are not supported,
+            or there are more channels than display colors.
+        """
+        if image.dtype not in (np.uint8, np.uint16):
+            raise ValueError("Expected a uint8 or uint16 image, but found "
+                             "{}".format(image.dtype))
+        if image.ndim == 2:
+            image = image[..., np.newaxis]
+        elif image.ndim != 3:
+            raise ValueError("Wrong number of dimensions in input image! "
+                             "Expected an image with 2 or 3 dimensions, "
+                             "but found {} dimensions".format(image.ndim))
+        num_channels = image.shape[-1]
+        # 10 bits per color fit the sum of 4 channels of up to 255 each
+        if num_channels <= 4:
+            field_bits, packed_dtype = 10, np.uint32
+        else:
+            field_bits, packed_dtype = 21, np.uint64
+        lut_key = (image.dtype, num_channels)
+        if lut_key != self._lut_key:
+            self._luts = {}
+            self._lut_key = lut_key
+        num_rows, num_columns = image.shape[:2]
+        # Work on blocks of rows that fit in the CPU cache
+        block_rows = max(1, COMPOSITE_BLOCK_NPIXELS // num_columns)
+        block_shape = (min(block_rows, num_rows), num_columns)
+        if (self._buffers is None or self._buffers[0].shape != block_shape
+                or self._buffers[0].dtype != packed_dtype):
+            self._buffers = tuple(np.empty(block_shape, dtype=packed_dtype)
+                                  for _ in range(2))
+        if out is None:
+            out = np.empty((num_rows, num_columns, 3), dtype=np.uint8)
+        luts = [self._lut(channel, num_channels, image.dtype, field_bits,
+                          packed_dtype) for channel in range(num_channels)]
+        mask = packed_dtype((1 << field_bits) - 1)
+
+        for start in range(0, num_rows, block_rows):
+            rows = slice(start, start + block_rows)
+            block = image[rows]
+            total, lookup = (buffer[:block.shape[0]]
+                             for buffer in self._buffers)
+            np.take(luts[0], block[..., 0], out=total)
+            for channel in range(1, num_channels):
+                np.take(luts[channel], block[..., channel], out=lookup)
+                total += lookup
+            for component in range(3):
+                np.right_shift(total, packed_dtype(component * field_bits),
+                               out=lookup)
+                lookup &= mask
+                np.minimum(lookup, packed_dtype(255), out=lookup)
+                out[rows, :, component] = lookup
+        return out
+
+
+def downsample(image, factor=2, edges='pad', dtype=None):
+    """Downsample an image, averaging blocks of factor x factor pixels.
+
+    Parameters
+    ----------
+    image : ndarray
+        Image with dimensions (rows, columns) or (rows, columns, channels).
+    factor : int, optional
+        Downsampling factor, by default 2.
+    edges : {'pad', 'drop'}, optional
+        What to do with the rows and columns at the edge that don't fill
+        a whole block. 'pad' (the default) averages them with copies of the
+        last row and column, giving ceil(rows / factor) rows. 'drop' leaves
+        them out, giving rows // factor rows.
+    dtype : numpy dtype, optional
+        Data type of the downsampled image, by default the image data type.
+        Integer images are rounded to the nearest integer.
+
+    Returns
+    -------
+    ndarray
+        Downsampled image.
+
+    Raises
+    ------
+    ValueError
+        Raised if the edges option is not recognised.
+    """
+    if edges not in ('pad', 'drop'):
+        raise ValueError("Unknown edges option '{}'. Expected either 'pad' "
+                         "or 'drop'.".format(edges))
+    image = np.asarray(image)
+    dtype = np.dtype(image.dtype if dtype is None else dtype)
+    factor = int(factor)
+    if factor <= 1:
+        return image.astype(dtype)
+    if edges == 'drop':
+        image = image[:image.shape[0] - image.shape[0] % factor,
+                      :image.shape[1] - image.shape[1] % factor]
+    elif image.shape[0] % factor or image.shape[1] % factor:
+        padding = [(0, -image.shape[0] % factor),
+                   (0, -image.shape[1] % factor)]
+        padding += [(0, 0)] * (image.ndim - 2)
+        image = np.pad(image, padding, mode='edge')
+    # Sum the pixels of each block with strided views, without temporary
+    # arrays for the blocks
+    if dtype.kind == 'f':
+        accumulator = dtype
+    elif image.dtype.kind == 'f':
+        accumulator = np.float64
+    elif image.dtype.kind == 'u' and image.dtype.itemsize <= 2:
+        accumulator = np.uint32
+    else:
+        accumulator = np.int64
+    total = image[0::factor, 0::factor].astype(accumulator)
+    for row in range(factor):
+        for column in range(factor):
+            if row or column:
+                total += image[row::factor, column::factor]
+    block_size = factor * factor
+    if total.dtype.kind == 'f':
+        total /= block_size
+        if dtype.kind != 'f':
+            np.rint(total, out=total)
+    else:
+        # round to the nearest integer
+        total += block_size // 2
+        total //= block_size
+    return total.astype(dtype, copy=False)
+
+
+def approximate_percentile(image, percentiles, max_samples=2 ** 18):
+    """Percentiles of the image intensities, from a subsample of pixels.
+
+    Much faster than np.percentile on large images, which sorts all the
+    pixels. A regular grid of at most max_samples pixels is sampled, and
+    uint8 and uint16 percentiles are read from its histogram.
+
+    Parameters
+    ----------
+    image : ndarray
+        Single channel image or image volume.
+    percentiles : float or sequence of float
+        Percentiles to compute, between 0 and 100.
+    max_samples : int, optional
+        Largest number of pixels to sample, by default 2**18.
+
+    Returns
+    -------
+    float or ndarray
+        Percentile values, with the shape of percentiles.
+        uint8 and uint16 images give the nearest lower pixel value.
+
+    Raises
+    ------
+    ValueError
+        Raised if the image is empty.
+    """
+    image = np.asarray(image)
+    if image.size == 0:
+        raise ValueError("Cannot compute percentiles of an empty image.")
+    step = int(np.ceil((image.size / max_samples) ** (1. / image.ndim)))
+    sample = image[(slice(None, None, max(step, 1)),) * image.ndim]
+    percentiles = np.asarray(percentiles, dtype=np.float64)
+    if image.dtype in (np.uint8, np.uint16):
+        histogram = np.bincount(sample.ravel(),
+                                minlength=np.iinfo(image.dtype).max + 1)
+        ranks = percentiles / 100. * (sample.size - 1)
+        values = np.searchsorted(np.cumsum(histogram), ranks, side='right')
+        return values.astype(np.float64)[()]
+    return np.percentile(sample, percentiles)
+
+
+class AutoContrast():
+    """Contrast window of a stream of images, from intensity percentiles.
+
+    The window only changes when the percentiles of a new image move by
+    more than a fraction of its width (hysteresis), so the display doesn't
+    flicker with the noise of each frame.
+
+    Parameters
+    ----------
+    low_percentile : float, optional
+        Percentile mapped to the darkest display value, by default 0.5.
+    high_percentile : float, optional
+        Percentile mapped to the brightest display value, by default 99.5.
+    hysteresis : float, optional
+        Fraction of the window width either end must move by before the
+        window is updated, by default 0.05.
+    max_samples : int, optional
+        Largest number of pixels sampled, see approximate_percentile().
+
+    Examples
+    --------
+    >>> auto_contrast = AutoContrast()
+    >>> compositor.set_window(0, *auto_contrast.update(frame))
+    """
+    def __init__(self, low_percentile=0.5, high_percentile=99.5,
+                 hysteresis=0.05, max_samples=2 ** 18):
+        self.low_percentile = low_percentile
+        self.high_percentile = high_percentile
+        self.hysteresis = hysteresis
+        self.max_samples = max_samples
+        self.window = None
+
+    def reset(self):
+        """Forget the current window, the next image sets a new one."""
+        self.window = None
+
+    def update(self, image):
+        """Update the contrast window with a new image.
+
+        Parameters
+        ----------
+        image : ndarray
+            Single channel image or image volume.
+
+        Returns
+        -------
+        tuple
+            Contrast window (low, high).
+        """
+        low, high = approximate_percentile(
+            image, (self.low_percentile, self.high_percentile),
+            max_samples=self.max_samples)
+        if self.window is None:
+            self.window = (low, high)
+        else:
+            tolerance = self.hysteresis * (self.window[1] - self.window[0])
+            if (abs(low - self.window[0]) > tolerance
+                    or abs(high - self.window[1]) > tolerance):
+                logging.debug("Contrast window changed from {} to "
+                              "{}".format(self.window, (low, high)))
+                self.window = (low, high)
+        return self.window
@@ -0,0 +1,89 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import piescope.chunked
+
+
+@pytest.fixture
+def volume():
+    random = np.random.RandomState(0)
+    return random.randint(0, 4000, (2, 3, 5, 40, 30)).astype(np.uint16)
+
+
+@pytest.mark.parametrize("compression", [
+    ('zlib'),
+    (None),
+])
+def test_write_chunked(tmpdir, volume, compression):
+    path = str(tmpdir.join('volume.zarr'))
+    laser_dict = {"laser640": (5, 200), "laser561": (1, 100),
+                  "laser488": (2, 300)}
+    piescope.chunked.write_chunked(
+        path, volume, voxel_size=(0.5, 0.1, 0.1), laser_dict=laser_dict,
+        metadata={'sample': 'embryo'}, chunks=(1, 1, 2, 16, 16),
+        compression=compression)
+    with open(os.path.join(path, '0', '.zarray')) as f:
+        assert json.load(f)['chunks'] == [1, 1, 2, 16, 16]
+    # edge chunks are stored at full size
+    assert os.path.exists(os.path.join(path, '0', '1', '2', '2', '2', '1'))
+    output = piescope.chunked.ChunkedVolume(path)
+    assert output.shape == volume.shape
+    assert output.dtype == volume.dtype
+    assert output.voxel_size == [0.5, 0.1, 0.1]
+    assert output.metadata['channels'][0] == {
+        'name': 'laser640', 'laser_power': 5, 'exposure_time': 200}
+    assert output.metadata['metadata'] == {'sample': 'embryo'}
+    assert (output.attributes['multiscales'][0]['datasets'][0]
+            ['coordinateTransformations'][0]['scale']
+            == [1, 1, 0.5, 0.1, 0.1])
+    assert np.array_equal(np.asarray(output), volume)
+
+
+@pytest.mark.parametrize("key", [
+    (1),
+    ((0, 2)),
+    ((slice(None), 1, slice(1, 4), slice(10, 35))),
+    ((0, slice(None), -1, slice(3, 40, 7), 29)),
+    ((Ellipsis, 3)),
+    ((1, Ellipsis, slice(2, 9))),
+])
+def test_chunked_volume_getitem(tmpdir, volume, key):
+    path = str(tmpdir.join('volume.zarr'))
+    piescope.chunked.write_chunked(path, volume, chunks=(1, 2, 2, 16, 16))
+    output = piescope.chunked.ChunkedVolume(path)
+    assert np.array_equal(output[key], volume[key])
+
+
+def test_chunked_volume_partial_read(tmpdir, volume, monkeypatch):
+    path = str(tmpdir.join('volume.zarr'))
+    piescope.chunked.write_chunked(path, volume, chunks=(1, 1, 5, 16, 16))
+    output = piescope.chunked.ChunkedVolume(path)
+    chunks_read = []
+    read_chunk = output._read_chunk
+    monkeypatch.setattr(output, '_read_chunk', lambda index: (
+        chunks_read.append(index), read_chunk(index))[1])
+    assert np.array_equal(output[1, 2, :, :16, 20:], volume[1, 2, :, :16, 20:])
+    assert chunks_read == [(1, 2, 0, 0, 1)]
+
+
+def test_write_chunked_acquisition_volume(tmpdir):
+    volume = np.random.randint(0, 255, (4, 20, 10, 2)).astype(np.uint8)
+    path = str(tmpdir.join('volume.zarr'))
+    piescope.chunked.write_chunked(path, volume)
+    output = piescope.chunked.ChunkedVolume(path)
+    assert output.shape == (1, 2, 4, 20, 10)
+    assert np.array_equal(output[0, 1], volume[..., 1])
+
+
+def test_write_chunked_invalid(tmpdir, volume):
+    path = str(tmpdir.join('volume.zarr'))
+    with pytest.raises(ValueError):
+        piescope.chunked.write_chunked(path, volume[0, 0])
+    with pytest.raises(ValueError):
+        piescope.chunked.write_chunked(path, volume, compression='lz4')
+    piescope.chunked.write_chunked(path, volume)
+    with pytest.raises(ValueError):
+        piescope.chunked.write_chunked(path, volume)  # already exists
@@ -76,3 +76,35 @@ def test_MockStagePosition():
     assert output.z == 0
     assert output.t == 0
     assert output.r == 0
+
+
+def test_MockStageController():
+    stage = piescope.data.mocktypes.MockStageController(position=100)
+    assert stage.current_position() == '100'
+    stage.move_relative(-50)
+    stage.move_absolute('1000')
+    assert stage.current_position() == '1000'
+    assert stage.num_moves == 2
+    assert stage.travel == 50 + 950
+
+
+def test_MockLaser():
+    lasers = piescope.data.mocktypes.mock_lasers()
+    assert sorted(lasers) == ["laser405", "laser488", "laser561", "laser640"]
+    laser = lasers["laser488"]
+    laser.emission_on()
+    assert laser.emitting
+    laser.emission_off()
+    assert not laser.emitting
+
+
+def test_MockBasler():
+    stage = piescope.data.mocktypes.MockStageController(position=0)
+    detector = piescope.data.mocktypes.MockBasler(stage, focus_position=0)
+    output = detector.camera_grab(exposure_time=200)
+    assert np.allclose(output, piescope.data.basler_image())
+    stage.move_absolute(5000)
+    output = detector.camera_grab()
+    assert output.shape == (1040, 1024)
+    assert output.std() < piescope.data.basler_image().std()
+    assert detector.num_grabs == 2
@@ -57,6 +57,18 @@ def test_move_to_electron_microscope(microscope):
     assert np.isclose(final_position.t, original_position.t)
 
 
+def test_move_to_position(microscope):
+    original_position = microscope.specimen.stage.current_position
+    x = original_position.x + 1e-4
+    y = original_position.y - 1e-4
+    final_position = piescope.fibsem.move_to_position(microscope, x, y)
+    assert np.isclose(final_position.x, x, atol=1e-7)
+    assert np.isclose(final_position.y, y, atol=1e-7)
+    assert np.isclose(final_position.z, original_position.z)
+    assert np.isclose(final_position.r, original_position.r)
+    assert np.isclose(final_position.t, original_position.t)
+
+
 def test_new_ion_image(microscope):
     result = piescope.fibsem.new_ion_image(microscope)
     assert microscope.imaging.get_active_view() == 2
@@ -0,0 +1,36 @@
+import os
+
+import numpy as np
+import pytest
+
+from piescope.lm.checkpoint import AcquisitionJournal
+
+
+def test_acquisition_journal(tmpdir):
+    journal = AcquisitionJournal(os.path.join(tmpdir, 'checkpoint'))
+    assert not journal.exists()
+    settings = {'num_z_slices': 3, 'order': 'interleaved'}
+    journal.start(settings)
+    journal.record(0, 0)
+    journal.record(0, 1, np.zeros((2, 2)))
+    output_settings, completed = journal.load()
+    assert output_settings == settings
+    assert completed == {(0, 0), (0, 1)}
+
+
+def test_acquisition_journal_incomplete_entry(tmpdir):
+    journal = AcquisitionJournal(str(tmpdir))
+    journal.start({'num_z_slices': 3})
+    journal.record(0, 0)
+    with open(journal.journal_filename, 'a') as f:
+        f.write('{"completed": [0,')  # crashed while writing
+    _, completed = journal.load()
+    assert completed == {(0, 0)}
+
+
+def test_acquisition_journal_no_settings(tmpdir):
+    journal = AcquisitionJournal(str(tmpdir))
+    with open(journal.journal_filename, 'w') as f:
+        f.write('{"completed": [0, 0]}\n')
+    with pytest.raises(ValueError):
+        journal.load()
@@ -55,3 +55,11 @@ def test_camera_grab_exposure(basler_detector, exposure):
             output_exposure_time = basler_detector.camera.ExposureTimeAbs.GetValue()
         basler_detector.camera.Close()
         assert exposure == output_exposure_time
+
+
+def test_free_run(basler_detector):
+    images, timestamps = basler_detector.free_run(3, exposure_time=500)
+    assert images.ndim == 3
+    assert images.shape[0] == 3
+    assert timestamps.shape == (3,)
+    assert np.all(np.diff(timestamps) >= 0)
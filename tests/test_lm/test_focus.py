@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+from piescope.data.mocktypes import MockBasler, MockLaser, MockStageController
+import piescope.lm.focus
+from piescope.lm.focus import AdaptiveZRange
+
+
+def test_signal_metric():
+    background = np.full((64, 64), 10, dtype=np.uint16)
+    assert piescope.lm.focus.signal_metric(background) == 0
+    image = background.copy()
+    image[:16, :16] = 200
+    assert piescope.lm.focus.signal_metric(image) == pytest.approx(190)
+
+
+@pytest.mark.parametrize("mode, signal, expected_skipped", [
+    # signal rises, then stays low for 2 slices: stop
+    ('stop', [0, 5, 5, 0, 0, 5], [4, 5]),
+    # empty slices before the specimen don't stop the sweep
+    ('stop', [0, 0, 0, 5, 0, 5], []),
+    # skip the other channel after 2 consecutive empty slices
+    ('skip', [0, 0, 0, 5, 0, 0], [1, 2, 5]),
+])
+def test_adaptive_z_range(mode, signal, expected_skipped):
+    adaptive = AdaptiveZRange("laser488", threshold=1, patience=2, mode=mode,
+                              metric=lambda image: image.max())
+    skipped = []
+    for z_slice, value in enumerate(signal):
+        if adaptive.skip("laser488"):
+            skipped.append(z_slice)
+            continue
+        adaptive.update(z_slice, np.array([value]))
+        if adaptive.skip("laser640"):
+            skipped.append(z_slice)
+    assert skipped == expected_skipped
+
+
+def test_adaptive_z_range_invalid():
+    with pytest.raises(ValueError):
+        AdaptiveZRange("laser488", 1, mode='sometimes')
+    with pytest.raises(ValueError):
+        AdaptiveZRange("laser488", 1, metric='magic')
+
+
+@pytest.mark.parametrize("metric", [
+    ('variance_of_laplacian'),
+    ('brenner'),
+    ('normalized_variance'),
+])
+def test_focus_metrics(metric):
+    stage = MockStageController()
+    detector = MockBasler(stage, focus_position=0)
+    metric_function = piescope.lm.focus.METRICS[metric]
+    values = []
+    for position in [0, 2000, 5000]:
+        stage.move_absolute(position)
+        values.append(metric_function(detector.camera_grab()))
+    assert values[0] > values[1] > values[2]
+
+
+def test_focus_metrics_flat_image():
+    image = np.zeros((16, 16))
+    assert piescope.lm.focus.variance_of_laplacian(image) == 0
+    assert piescope.lm.focus.brenner_gradient(image) == 0
+    assert piescope.lm.focus.normalized_variance(image) == 0
+
+
+@pytest.mark.parametrize("method", [
+    ('golden'),
+    ('coarse_to_fine'),
+])
+@pytest.mark.parametrize("focus_position", [
+    (-6300),
+    (2500),
+])
+def test_autofocus(method, focus_position):
+    stage = MockStageController(position=0)
+    detector = MockBasler(stage, focus_position=focus_position)
+    laser = MockLaser("laser488")
+    result = piescope.lm.focus.autofocus(
+        detector, stage, search_range=20000, tolerance=200, method=method,
+        roi=(slice(200, 800), slice(200, 800)), laser=laser, time_delay=0)
+    assert abs(result['position'] - focus_position) <= 200
+    assert float(stage.current_position()) == result['position']
+    assert result['num_grabs'] == detector.num_grabs
+    assert result['num_grabs'] <= 20
+    assert not laser.emitting
+
+
+def test_autofocus_coarse_steps():
+    # 3 coarse steps with the focus in the middle must still converge
+    stage = MockStageController(position=0)
+    detector = MockBasler(stage, focus_position=0)
+    result = piescope.lm.focus.autofocus(
+        detector, stage, search_range=20000, tolerance=200,
+        method='coarse_to_fine', coarse_steps=3,
+        roi=(slice(200, 800), slice(200, 800)), time_delay=0)
+    assert abs(result['position']) <= 200
+    assert result['num_grabs'] < 50
+
+
+def test_autofocus_invalid_method():
+    with pytest.raises(ValueError):
+        piescope.lm.focus.autofocus(None, None, method='guess')
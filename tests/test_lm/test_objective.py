@@ -3,6 +3,8 @@ import mock
 import numpy as np
 import pytest
 import socket
+import threading
+import time
 
 from piescope.lm.objective import StageController
 
@@ -186,3 +188,50 @@ def test_send_command_error(stage):
     with mock.patch.object(StageController, 'sendall', side_effect=Exception):
         with pytest.raises(Exception):
             stage.send_command('command')
+
+
+@mock.patch.object(StageController, 'recv')
+@mock.patch.object(StageController, 'sendall')
+def test_set_closed_loop_speed(mock_sendall, mock_recv, stage):
+    speed = 5000  # in nanometers per second
+    stage.set_closed_loop_speed(speed)
+    cmd = 'SCLS0,' + str(speed)
+    mock_sendall.assert_called_with(bytes(':' + cmd + '\012', 'utf-8'))
+
+
+def test_set_closed_loop_speed_error(stage):
+    with mock.patch.object(StageController, 'sendall', side_effect=Exception):
+        with pytest.raises(Exception):
+            stage.set_closed_loop_speed(5000)
+
+
+def test_send_command_threads(stage):
+    # No command is sent before the reply to the previous one is received,
+    # so each reply goes to the thread that sent the command
+    pending = []
+    max_pending = []
+
+    def sendall(cmd):
+        pending.append(cmd)
+        max_pending.append(len(pending))
+
+    def recv(size):
+        time.sleep(0.001)  # give other threads a chance to send
+        return pending.pop(0)
+
+    replies = {}
+
+    def send(name):
+        replies[name] = [stage.send_command(name) for _ in range(20)]
+
+    with mock.patch.object(StageController, 'sendall', side_effect=sendall), \
+            mock.patch.object(StageController, 'recv', side_effect=recv):
+        threads = [threading.Thread(target=send, args=(name,))
+                   for name in ('GP0', 'MPA0,100,0')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert max(max_pending) == 1
+    for name, received in replies.items():
+        assert received == [bytes(':' + name + '\012', 'utf-8')] * 20
@@ -0,0 +1,64 @@
+import time
+
+import numpy as np
+import pytest
+
+from piescope.lm.pipeline import FrameWriter, StageTimer
+
+
+def test_stage_timer():
+    timer = StageTimer()
+    timer.start()
+    with timer.stage('grab'):
+        time.sleep(0.01)
+    with timer.stage('grab'):
+        pass
+    timer.stop()
+    assert timer.counts['grab'] == 2
+    assert timer.busy_time['grab'] >= 0.01
+    assert 0 < timer.utilization()['grab'] <= 1
+    assert 'grab' in timer.report()
+
+
+def test_stage_timer_not_started():
+    timer = StageTimer()
+    with timer.stage('move'):
+        pass
+    assert timer.wall_time == 0.
+    assert timer.utilization() == {'move': 0.}
+
+
+def test_stage_timer_resume():
+    timer = StageTimer()
+    timer.resume()
+    start_time = timer.start_time
+    assert start_time is not None
+    timer.stop()
+    timer.resume()  # a later acquisition keeps the same wall clock
+    assert timer.start_time == start_time
+    assert timer.stop_time is None
+
+
+@pytest.mark.parametrize("pipelined", [
+    (True),
+    (False),
+])
+def test_frame_writer(pipelined):
+    volume = np.zeros((3, 4, 5, 2), dtype=np.uint8)
+    with FrameWriter(volume, pipelined=pipelined, maxsize=2) as writer:
+        for z_slice in range(3):
+            for channel in range(2):
+                frame = np.full((4, 5), 10 * z_slice + channel)
+                writer.put(z_slice, channel, frame)
+    for z_slice in range(3):
+        for channel in range(2):
+            assert np.all(volume[z_slice, ..., channel] == 10*z_slice + channel)
+    assert writer.timer.counts['write'] == 6
+
+
+def test_frame_writer_error():
+    volume = np.zeros((3, 4, 5, 2), dtype=np.uint8)
+    writer = FrameWriter(volume, pipelined=True)
+    writer.put(0, 0, np.zeros((7, 7)))  # wrong shape, fails in the thread
+    with pytest.raises(ValueError):
+        writer.close()
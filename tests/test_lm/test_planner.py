@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+
+import piescope.lm.planner
+from piescope.lm.pipeline import StageTimer
+from piescope.lm.planner import TimingModel
+
+
+@pytest.mark.parametrize("order, expected", [
+    ('interleaved', [(0, 0), (0, 1), (1, 0), (1, 1), (2, 0), (2, 1)]),
+    ('channel_major', [(0, 0), (1, 0), (2, 0), (0, 1), (1, 1), (2, 1)]),
+    ('snake', [(0, 0), (1, 0), (2, 0), (2, 1), (1, 1), (0, 1)]),
+])
+def test_acquisition_plan(order, expected):
+    output = piescope.lm.planner.acquisition_plan(3, 2, order=order)
+    assert output == expected
+
+
+def test_acquisition_plan_invalid_order():
+    with pytest.raises(ValueError):
+        piescope.lm.planner.acquisition_plan(3, 2, order='random')
+
+
+def test_plan_time():
+    timing = TimingModel(settle_time=1, move_overhead=0, stage_speed=1e6,
+                         channel_switch_time=0.5, grab_overhead=0,
+                         laser_time=0, correction_time=0)
+    plan = piescope.lm.planner.acquisition_plan(3, 2, order='interleaved')
+    output = piescope.lm.planner.plan_time(plan, [1e6, 2e6], 1000, timing)
+    # 2 moves of 1 um, 5 channel switches, 3 * (1 + 2) seconds of exposure
+    assert output == pytest.approx(2 * 1.001 + 5 * 0.5 + 9)
+
+
+@pytest.mark.parametrize("channel_switch_time, expected_order", [
+    (0.01, 'interleaved'),
+    (10., 'snake'),
+])
+def test_plan_acquisition(channel_switch_time, expected_order):
+    laser_dict = {"laser640": (1, 200), "laser561": (1, 200)}
+    timing = TimingModel(settle_time=1,
+                         channel_switch_time=channel_switch_time)
+    order, plan = piescope.lm.planner.plan_acquisition(
+        laser_dict, 10, 500, timing=timing)
+    assert order == expected_order
+    assert sorted(plan) == sorted(
+        piescope.lm.planner.acquisition_plan(10, 2, order='interleaved'))
+
+
+def test_plan_phase_times():
+    timing = TimingModel(settle_time=1, move_overhead=0.1,
+                         channel_switch_time=0.5, grab_overhead=0.2,
+                         laser_time=0.01, correction_time=0.05)
+    plan = piescope.lm.planner.acquisition_plan(3, 2, order='interleaved')
+    output = piescope.lm.planner.plan_phase_times(plan, [0, 0], 1000, timing)
+    assert output['grab'] == pytest.approx(6 * 0.2)
+    assert output['laser'] == pytest.approx(6 * 0.01)
+    assert output['channel_switch'] == pytest.approx(5 * 0.5)
+    assert output['move'] == pytest.approx(2 * (0.1 + 0.001))
+    assert output['settle'] == pytest.approx(2 * 1)
+    assert output['retries'] == pytest.approx(2 * 0.05)
+
+
+def test_timing_model_save_load(tmpdir):
+    filename = str(tmpdir.join('timing.json'))
+    timing = TimingModel(settle_time=0.5, grab_overhead=0.2)
+    timing.save(filename)
+    output = TimingModel.load(filename)
+    assert output.to_dict() == timing.to_dict()
+
+
+def test_timing_model_from_timer():
+    timer = StageTimer()
+    timer.busy_time.update({'grab': 3.0, 'settle': 1.0, 'move': 0.2})
+    timer.counts.update({'grab': 10, 'settle': 4, 'move': 4})
+    laser_dict = {"laser640": (1, 100000), "laser561": (1, 300000)}
+    default = TimingModel(correction_time=0.5)
+    output = TimingModel.from_timer(timer, laser_dict, default=default)
+    assert output.grab_overhead == pytest.approx(0.3 - 0.2)
+    assert output.settle_time == pytest.approx(0.25)
+    assert output.move_overhead == pytest.approx(0.05)
+    assert output.correction_time == 0.5  # no measurements, use default
+
+
+def test_path_length():
+    positions = [(0, 0), (3, 4), (3, 0)]
+    assert piescope.lm.planner.path_length(positions) == pytest.approx(9)
+    output = piescope.lm.planner.path_length(positions, start=(0, -1))
+    assert output == pytest.approx(10)
+
+
+@pytest.mark.parametrize("method", [
+    ('nearest_neighbour'),
+    ('two_opt'),
+])
+def test_order_positions_line(method):
+    positions = [(5, 0), (1, 0), (3, 0), (4, 0), (2, 0)]
+    output = piescope.lm.planner.order_positions(
+        positions, start=(0, 0), method=method)
+    assert list(output) == [1, 4, 2, 3, 0]
+
+
+def test_order_positions_two_opt_improves():
+    rng = np.random.RandomState(0)
+    positions = rng.uniform(0, 1e-3, size=(200, 2))
+    nearest = piescope.lm.planner.order_positions(
+        positions, method='nearest_neighbour')
+    two_opt = piescope.lm.planner.order_positions(positions, method='two_opt')
+    assert sorted(two_opt) == list(range(200))
+    assert two_opt[0] == 0
+    nearest_length = piescope.lm.planner.path_length(positions[nearest])
+    two_opt_length = piescope.lm.planner.path_length(positions[two_opt])
+    assert two_opt_length < nearest_length
+    assert two_opt_length < piescope.lm.planner.path_length(positions)
+
+
+@pytest.mark.parametrize("positions", [
+    ([]),
+    ([(1, 2)]),
+])
+def test_order_positions_trivial(positions):
+    output = piescope.lm.planner.order_positions(positions, start=(0, 0))
+    assert list(output) == list(range(len(positions)))
+
+
+def test_order_positions_invalid_method():
+    with pytest.raises(ValueError):
+        piescope.lm.planner.order_positions([(0, 0), (1, 1)], method='random')
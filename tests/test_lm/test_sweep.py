@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+import piescope.lm.sweep
+from piescope.data.mocktypes import MockBasler, MockStageController
+from piescope.data.mocktypes import mock_lasers
+from piescope.lm.pipeline import StageTimer
+
+
+def test_interpolate_positions():
+    output = piescope.lm.sweep.interpolate_positions(
+        [0.5, 1.5, 5.], [0., 1., 2.], [100., 200., 400.])
+    assert np.allclose(output, [150., 300., 400.])
+
+
+def test_position_sampler():
+    stage = MockStageController(position=0, speed=1e5)
+    with piescope.lm.sweep.PositionSampler(stage, interval=0.001) as sampler:
+        stage.move_absolute(5000)
+        stage.wait()
+    assert len(sampler.times) > 2
+    assert sampler.positions[0] == 0
+    assert sampler.positions[-1] == 5000
+    assert np.all(np.diff(sampler.times) > 0)
+    assert np.all(np.diff(sampler.positions) >= 0)
+
+
+@pytest.fixture
+def sweep_hardware():
+    stage = MockStageController(position=0)
+    image = np.random.RandomState(0).randint(0, 255, (16, 16)).astype(np.uint8)
+    detector = MockBasler(stage, image=image, focus_position=0.)
+    return detector, mock_lasers(), stage
+
+
+@pytest.mark.parametrize("direction", ['down', 'up'])
+def test_sweep_acquisition(sweep_hardware, direction):
+    detector, lasers, stage = sweep_hardware
+    num_z_slices, z_slice_distance, frame_rate = 11, 1000, 50
+    timer = StageTimer()
+    volume, z_positions = piescope.lm.sweep.sweep_acquisition(
+        {'laser488': (10, 1000)}, num_z_slices, z_slice_distance,
+        frame_rate=frame_rate, time_delay=0, direction=direction,
+        detector=detector, lasers=lasers, objective_stage=stage,
+        sample_interval=0.001, timer=timer)
+    assert volume.shape == (num_z_slices, 16, 16, 1)
+    assert z_positions.shape == (num_z_slices,)
+    # the first image of the volume is at the top
+    assert np.all(np.diff(z_positions) < 0)
+    assert z_positions[0] > z_positions[-1] + 8 * z_slice_distance
+    # positions are interpolated from the stage position samples, so they
+    # match the simulated stage during each exposure, however late it runs
+    exposure_positions = np.array(detector.exposure_positions)
+    if direction == 'up':
+        exposure_positions = exposure_positions[::-1]
+    assert np.allclose(z_positions, exposure_positions,
+                       atol=z_slice_distance / 4)
+    # the sharpest image is the one nearest the focus position
+    sharpness = [volume[z, ..., 0].std() for z in range(num_z_slices)]
+    assert np.argmax(sharpness) == np.argmin(np.abs(z_positions))
+    assert stage.current_position() == '0'
+    assert not lasers['laser488'].emitting
+    assert timer.counts['grab'] == 1
+    assert detector.num_grabs == num_z_slices
+
+
+def test_sweep_acquisition_multiple_lasers(sweep_hardware):
+    detector, lasers, stage = sweep_hardware
+    with pytest.raises(ValueError):
+        piescope.lm.sweep.sweep_acquisition(
+            {'laser488': (10, 1000), 'laser561': (10, 1000)}, 5, 1000,
+            detector=detector, lasers=lasers, objective_stage=stage)
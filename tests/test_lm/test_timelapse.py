@@ -0,0 +1,117 @@
+import functools
+import mock
+
+import numpy as np
+import pytest
+
+import piescope.lm.timelapse
+from piescope.lm.timelapse import TimelapseScheduler
+
+
+class FakeClock():
+    """Clock where time only passes when sleeping or acquiring."""
+    def __init__(self):
+        self.time = 100.
+
+    def __call__(self):
+        return self.time
+
+    def sleep(self, seconds):
+        self.time += seconds
+
+
+def run_timelapse(overrun, durations, interval=10, num_timepoints=4):
+    clock = FakeClock()
+    scheduler = TimelapseScheduler(interval, num_timepoints, overrun=overrun,
+                                   clock=clock, sleep=clock.sleep)
+
+    def acquire(timepoint):
+        clock.time += durations[timepoint]
+        return timepoint
+
+    results = scheduler.run(acquire)
+    return results, scheduler.records
+
+
+def test_timelapse_no_drift():
+    results, records = run_timelapse('skip', [3, 3, 3, 3])
+    assert results == [0, 1, 2, 3]
+    assert [r['actual'] for r in records] == [0, 10, 20, 30]
+    assert [r['planned'] for r in records] == [0, 10, 20, 30]
+
+
+def test_timelapse_overrun_skip():
+    results, records = run_timelapse('skip', [15, 3, 3, 3])
+    assert results == [0, None, 2, 3]
+    assert [r['skipped'] for r in records] == [False, True, False, False]
+    assert [r['actual'] for r in records] == [0, None, 20, 30]
+
+
+def test_timelapse_overrun_compress():
+    results, records = run_timelapse('compress', [15, 3, 3, 3])
+    assert results == [0, 1, 2, 3]
+    assert [r['planned'] for r in records] == [0, 10, 20, 30]
+    assert [r['actual'] for r in records] == [0, 15, 20, 30]
+
+
+def test_timelapse_overrun_shift():
+    results, records = run_timelapse('shift', [15, 3, 3, 3])
+    assert results == [0, 1, 2, 3]
+    assert [r['planned'] for r in records] == [0, 15, 25, 35]
+    assert [r['actual'] for r in records] == [0, 15, 25, 35]
+
+
+def test_timelapse_invalid_overrun():
+    with pytest.raises(ValueError):
+        TimelapseScheduler(10, 4, overrun='panic')
+
+
+def test_timelapse_volume_acquisition():
+    detector = mock.MagicMock()
+    detector.camera_grab.return_value = np.zeros((8, 6), dtype=np.uint8)
+    lasers = {"laser640": mock.MagicMock()}
+    objective_stage = mock.MagicMock()
+    objective_stage.current_position.return_value = '0'
+    with mock.patch('piescope.lm.volume.volume_acquisition') as mock_volume:
+        volumes, records = piescope.lm.timelapse.timelapse_volume_acquisition(
+            {"laser640": (1, 200)}, 3, 10, 0, 3, overrun='compress',
+            bidirectional=True,
+            detector=detector, lasers=lasers, objective_stage=objective_stage)
+    assert len(volumes) == 3
+    assert len(records) == 3
+    directions = [call[1]['direction'] for call in mock_volume.call_args_list]
+    assert directions == ['down', 'up', 'down']
+    return_to_center = [call[1]['return_to_center']
+                        for call in mock_volume.call_args_list]
+    assert return_to_center == [False, False, True]
+
+
+def test_timelapse_volume_acquisition_skipped_up():
+    clock = FakeClock()
+    scheduler = functools.partial(TimelapseScheduler, clock=clock,
+                                  sleep=clock.sleep)
+    durations = iter([15, 3, 15, 3])
+
+    def acquisition(*args, **kwargs):
+        clock.time += next(durations)
+        return kwargs['direction']
+
+    objective_stage = mock.MagicMock()
+    objective_stage.current_position.return_value = '0'
+    with mock.patch('piescope.lm.timelapse.TimelapseScheduler', scheduler), \
+            mock.patch('piescope.lm.volume.volume_acquisition',
+                       side_effect=acquisition):
+        volumes, records = piescope.lm.timelapse.timelapse_volume_acquisition(
+            {"laser640": (1, 200)}, 3, 10, 10, 6, overrun='skip',
+            bidirectional=True, direction='up', detector=mock.MagicMock(),
+            lasers=mock.MagicMock(), objective_stage=objective_stage)
+    # timepoints 1 and 4 are skipped, the acquired volumes still alternate
+    assert volumes == ['up', None, 'down', 'up', None, 'down']
+
+
+def test_timelapse_volume_acquisition_filename():
+    with pytest.raises(ValueError):
+        piescope.lm.timelapse.timelapse_volume_acquisition(
+            {"laser640": (1, 200)}, 3, 10, 0, 3, detector=mock.MagicMock(),
+            lasers=mock.MagicMock(), objective_stage=mock.MagicMock(),
+            filename='volume.tif')
@@ -0,0 +1,94 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+import piescope.lm.volume
+from piescope.data.mocktypes import MockBasler, MockStageController
+from piescope.data.mocktypes import mock_lasers
+from piescope.lm.trace import Tracer
+
+
+def test_tracer_spans():
+    tracer = Tracer()
+    tracer.start()
+    with tracer.stage('grab', z_slice=np.int64(2), laser='laser488'):
+        pass
+    with tracer.stage('write'):
+        pass
+    tracer.stop()
+    assert [span[0] for span in tracer.spans] == ['grab', 'write']
+    assert tracer.counts == {'grab': 1, 'write': 1}
+    assert tracer.spans[0][5] == {'z_slice': 2, 'laser': 'laser488'}
+    assert tracer.spans[0][1] <= tracer.spans[0][2] <= tracer.spans[1][1]
+
+
+def test_tracer_max_spans():
+    tracer = Tracer(max_spans=2)
+    for _ in range(5):
+        with tracer.stage('move'):
+            pass
+    assert len(tracer.spans) == 2
+    assert tracer.num_dropped == 3
+    assert tracer.counts['move'] == 5
+
+
+def test_tracer_save(tmpdir):
+    tracer = Tracer()
+    tracer.start()
+    with tracer.stage('grab', z_slice=np.int64(0), target=np.float32(1.5)):
+        pass
+    filename = os.path.join(str(tmpdir), 'trace.json')
+    tracer.save(filename)
+    with open(filename) as f:
+        trace = json.load(f)
+    spans = [event for event in trace['traceEvents'] if event['ph'] == 'X']
+    assert len(spans) == 1
+    assert spans[0]['name'] == 'grab'
+    assert spans[0]['ts'] >= 0
+    assert spans[0]['dur'] >= 0
+    assert spans[0]['args'] == {'z_slice': 0, 'target': 1.5}
+    thread_names = [event['args']['name'] for event in trace['traceEvents']
+                    if event['name'] == 'thread_name']
+    assert thread_names == [threading.current_thread().name]
+
+
+def test_volume_acquisition_trace():
+    stage = MockStageController(position=0)
+    image = np.zeros((8, 6), dtype=np.uint8)
+    detector = MockBasler(stage, image=image)
+    tracer = Tracer()
+    piescope.lm.volume.volume_acquisition(
+        {"laser640": (1, 200), "laser561": (1, 200)}, 3, 10, time_delay=0,
+        detector=detector, lasers=mock_lasers(), objective_stage=stage,
+        pipelined=True, timer=tracer)
+    trace = tracer.to_chrome_trace()
+    names = [event['name'] for event in trace['traceEvents']
+             if event['ph'] == 'X']
+    for name in ['laser', 'grab', 'move', 'settle', 'correction', 'write']:
+        assert name in names
+    assert names.count('grab') == 6
+    assert names.count('laser') == 12
+    grabs = [event for event in trace['traceEvents']
+             if event['name'] == 'grab']
+    assert grabs[0]['args']['laser'] in ("laser640", "laser561")
+    # frames are written in the background thread
+    write_threads = {event['tid'] for event in trace['traceEvents']
+                     if event['name'] == 'write'}
+    assert write_threads != {threading.get_ident()}
+
+
+def test_tracer_multiple_volumes():
+    stage = MockStageController(position=0)
+    detector = MockBasler(stage, image=np.zeros((8, 6), dtype=np.uint8))
+    tracer = Tracer()
+    for _ in range(2):
+        piescope.lm.volume.volume_acquisition(
+            {"laser640": (1, 200)}, 3, 10, time_delay=0, detector=detector,
+            lasers=mock_lasers(), objective_stage=stage, timer=tracer)
+    assert tracer.counts['grab'] == 6
+    spans = [event for event in tracer.to_chrome_trace()['traceEvents']
+             if event['ph'] == 'X']
+    assert all(span['ts'] >= 0 for span in spans)
+    assert tracer.utilization()['grab'] <= 1
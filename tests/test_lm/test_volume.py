@@ -1,13 +1,19 @@
 import mock
+import os
 
 import numpy as np
 import pytest
+import tifffile
 
 import pypylon.pylon
 import pypylon.genicam
 
 import piescope.data
+import piescope.lm.focus
+import piescope.lm.pipeline
+import piescope.lm.planner
 import piescope.lm.volume
+import piescope.projection
 from piescope.lm.detector import Basler
 from piescope.lm.objective import StageController
 
@@ -69,3 +75,396 @@ def test_volume_acquisition(mock_sendall, mock_recv, mock_connect,
         expected = np.stack([emulated_image for _ in range(4)], axis=-1)
         expected = np.stack([expected, expected, expected], axis=0)
         assert np.allclose(output, expected)
+
+
+def test_estimate_volume_nbytes():
+    shape = (3, 1040, 1024, 4)
+    assert piescope.lm.volume.estimate_volume_nbytes(shape) == 3*1040*1024*4
+    nbytes = piescope.lm.volume.estimate_volume_nbytes(shape, dtype=np.uint16)
+    assert nbytes == 2*3*1040*1024*4
+
+
+def test_create_volume_memory():
+    volume = piescope.lm.volume.create_volume((2, 8, 6, 3), storage='memory')
+    assert type(volume) is np.ndarray
+    assert volume.shape == (2, 8, 6, 3)
+    assert volume.dtype == np.uint8
+
+
+def test_create_volume_disk(tmpdir):
+    filename = os.path.join(tmpdir, 'volume.tif')
+    volume = piescope.lm.volume.create_volume((2, 8, 6, 3), storage='disk',
+                                              filename=filename)
+    assert isinstance(volume, np.memmap)
+    volume[1, :, :, 2] = 7
+    volume.flush()
+    del volume
+    with tifffile.TiffFile(filename) as tif:
+        assert len(tif.pages) == 2
+        assert tif.pages[0].planarconfig == tifffile.PLANARCONFIG.CONTIG
+        result = tif.asarray()
+    assert result.shape == (2, 8, 6, 3)
+    assert np.all(result[1, :, :, 2] == 7)
+    assert np.all(result[0] == 0)
+
+
+@pytest.mark.parametrize("max_memory, expected_type", [
+    (10, np.memmap),
+    (10**9, np.ndarray),
+])
+def test_create_volume_auto(tmpdir, max_memory, expected_type):
+    filename = os.path.join(tmpdir, 'volume.tif')
+    volume = piescope.lm.volume.create_volume(
+        (2, 8, 6, 3), filename=filename, max_memory=max_memory)
+    assert type(volume) is expected_type
+
+
+def test_create_volume_auto_unknown_memory(tmpdir, caplog):
+    filename = os.path.join(tmpdir, 'volume.tif')
+    with mock.patch('piescope.lm.volume.available_memory',
+                    return_value=None):
+        volume = piescope.lm.volume.create_volume(
+            (2, 8, 6, 3), filename=filename)
+    assert type(volume) is np.ndarray
+    assert 'Available memory is unknown' in caplog.text
+
+
+def test_available_memory():
+    memory = piescope.lm.volume.available_memory()
+    assert memory is None or memory > 0
+
+
+def test_create_volume_invalid_storage():
+    with pytest.raises(ValueError):
+        piescope.lm.volume.create_volume((2, 8, 6, 3), storage='cloud')
+
+
+@pytest.fixture
+def mock_hardware():
+    detector = mock.MagicMock()
+    frames = iter(np.arange(100))
+    detector.camera_grab.side_effect = lambda *args: np.full(
+        (8, 6), next(frames), dtype=np.uint8)
+    lasers = {name: mock.MagicMock() for name in ["laser640", "laser561"]}
+    objective_stage = mock.MagicMock()
+    objective_stage.current_position.return_value = '0'
+    return detector, lasers, objective_stage
+
+
+@pytest.mark.parametrize("pipelined", [
+    (True),
+    (False),
+])
+def test_volume_acquisition_pipelined(mock_hardware, pipelined):
+    detector, lasers, objective_stage = mock_hardware
+    laser_dict = {"laser640": (1, 200), "laser561": (1, 200)}
+    timer = piescope.lm.pipeline.StageTimer()
+    output = piescope.lm.volume.volume_acquisition(
+        laser_dict, 3, 10, time_delay=0, count_max=0,
+        detector=detector, lasers=lasers, objective_stage=objective_stage,
+        pipelined=pipelined, timer=timer)
+    assert output.shape == (3, 8, 6, 2)
+    # frame zero is the test grab used to find the image shape
+    expected = np.arange(1, 7).reshape(3, 2)
+    assert np.allclose(output[:, 0, 0, :], expected)
+    assert timer.counts['grab'] == 6
+    assert timer.counts['write'] == 6
+    assert set(timer.utilization()) >= {'grab', 'move', 'settle', 'write'}
+
+
+@pytest.mark.parametrize("order", [
+    ('interleaved'),
+    ('channel_major'),
+])
+def test_volume_acquisition_projection(mock_hardware, order):
+    detector, lasers, objective_stage = mock_hardware
+    laser_dict = {"laser640": (1, 200), "laser561": (1, 200)}
+    projection = piescope.projection.RunningProjection(
+        2, projections=('max', 'argmax', 'mean'))
+    output = piescope.lm.volume.volume_acquisition(
+        laser_dict, 3, 10, time_delay=0, count_max=0,
+        detector=detector, lasers=lasers, objective_stage=objective_stage,
+        order=order, pipelined=True, projection=projection)
+    expected = piescope.projection.project(
+        output, ('max', 'argmax', 'mean'))
+    result = projection.result()
+    assert projection.num_frames == 6
+    for name in expected:
+        assert np.allclose(result[name], expected[name])
+
+
+@pytest.mark.parametrize("order, expected_moves", [
+    ('interleaved', 2),
+    ('channel_major', 5),
+    ('snake', 4),
+])
+def test_volume_acquisition_order(mock_hardware, order, expected_moves):
+    detector, lasers, objective_stage = mock_hardware
+    laser_dict = {"laser640": (1, 200), "laser561": (1, 200)}
+    output = piescope.lm.volume.volume_acquisition(
+        laser_dict, 3, 10, time_delay=0, count_max=0,
+        detector=detector, lasers=lasers, objective_stage=objective_stage,
+        order=order)
+    plan = piescope.lm.planner.acquisition_plan(3, 2, order=order)
+    for frame_number, (z_slice, channel) in enumerate(plan, start=1):
+        assert output[z_slice, 0, 0, channel] == frame_number
+    # one more move to the top of the volume before the first image
+    assert objective_stage.move_relative.call_count == expected_moves + 1
+    objective_stage.move_absolute.assert_called_once_with('0')
+
+
+@pytest.mark.parametrize("max_memory, expected_storage", [
+    (10**9, 'memory'),
+    (10**3, 'disk'),
+])
+def test_estimate_volume_acquisition(max_memory, expected_storage):
+    laser_dict = {"laser640": (1, 200000), "laser561": (1, 200000)}
+    timing = piescope.lm.planner.TimingModel(
+        settle_time=1, move_overhead=0, channel_switch_time=0,
+        grab_overhead=0, laser_time=0, correction_time=0)
+    output = piescope.lm.volume.estimate_volume_acquisition(
+        laser_dict, 5, 1000, (120, 100), timing=timing, max_memory=max_memory)
+    assert output['order'] == 'interleaved'
+    assert output['num_images'] == 10
+    assert output['phases']['grab'] == pytest.approx(10 * 0.2)
+    assert output['phases']['settle'] == pytest.approx(4 + 1)
+    assert output['total_time'] == pytest.approx(
+        sum(output['phases'].values()))
+    assert output['storage'] == expected_storage
+    assert output['volume_nbytes'] == 5 * 120 * 100 * 2
+    if expected_storage == 'memory':
+        assert output['peak_memory'] == 5 * 120 * 100 * 2 + 120 * 100
+    else:
+        assert output['peak_memory'] == 120 * 100
+
+
+@pytest.mark.parametrize("pipelined", [
+    (True),
+    (False),
+])
+def test_volume_acquisition_resume(tmpdir, mock_hardware, pipelined):
+    detector, lasers, objective_stage = mock_hardware
+    objective_stage.current_position.return_value = '100'
+    frames = iter(range(1, 100))
+
+    def interrupted_grab(*args):
+        frame = next(frames)
+        if frame == 4:
+            raise RuntimeError("Camera timeout")
+        return np.full((8, 6), frame, dtype=np.uint8)
+
+    detector.camera_grab.side_effect = interrupted_grab
+    laser_dict = {"laser640": (1, 200), "laser561": (1, 200)}
+    checkpoint = os.path.join(tmpdir, 'checkpoint')
+    with pytest.raises(RuntimeError):
+        piescope.lm.volume.volume_acquisition(
+            laser_dict, 3, 10, time_delay=0, count_max=0,
+            detector=detector, lasers=lasers, objective_stage=objective_stage,
+            order='interleaved', pipelined=pipelined, checkpoint=checkpoint)
+    # Stage has moved somewhere else since the acquisition was interrupted
+    objective_stage.reset_mock()
+    objective_stage.current_position.return_value = '-500'
+    projection = piescope.projection.RunningProjection(2)
+    output = piescope.lm.volume.resume_volume_acquisition(
+        checkpoint, time_delay=0, count_max=0, detector=detector,
+        lasers=lasers, objective_stage=objective_stage, pipelined=pipelined,
+        projection=projection)
+    assert isinstance(output, np.memmap)
+    # frame 1 was the test grab, frames 2 & 3 completed, frame 4 failed
+    expected = np.array([[2, 3], [5, 6], [7, 8]])
+    assert np.allclose(output[:, 0, 0, :], expected)
+    # the projection includes the images completed before the interruption
+    assert np.allclose(projection.result()['max'][0, 0], [7, 8])
+    assert np.allclose(projection.result()['mean'][0, 0], [14 / 3, 17 / 3])
+    # stage moved back to z_slice 1, relative to the original center
+    objective_stage.move_absolute.assert_any_call(100)
+    objective_stage.move_absolute.assert_called_with('100')
+
+
+def test_volume_acquisition_resume_mismatch(tmpdir, mock_hardware):
+    detector, lasers, objective_stage = mock_hardware
+    laser_dict = {"laser640": (1, 200), "laser561": (1, 200)}
+    checkpoint = os.path.join(tmpdir, 'checkpoint')
+    piescope.lm.volume.volume_acquisition(
+        laser_dict, 3, 10, time_delay=0, count_max=0,
+        detector=detector, lasers=lasers, objective_stage=objective_stage,
+        checkpoint=checkpoint)
+    with pytest.raises(ValueError):
+        piescope.lm.volume.volume_acquisition(
+            laser_dict, 4, 10, time_delay=0, count_max=0,
+            detector=detector, lasers=lasers, objective_stage=objective_stage,
+            checkpoint=checkpoint)
+
+
+def test_resume_volume_acquisition_missing(tmpdir):
+    with pytest.raises(ValueError):
+        piescope.lm.volume.resume_volume_acquisition(str(tmpdir))
+
+
+@pytest.mark.parametrize("optimize_order, expected_route", [
+    (True, [1, 2, 0]),
+    (False, [0, 1, 2]),
+])
+def test_multi_position_acquisition(mock_hardware, optimize_order,
+                                    expected_route):
+    detector, lasers, objective_stage = mock_hardware
+    microscope = mock.MagicMock()
+    microscope.specimen.stage.current_position.x = 0.
+    microscope.specimen.stage.current_position.y = 0.
+    positions = [(3e-3, 0.), (1e-3, 0.), (2e-3, 0.)]
+    laser_dict = {"laser640": (1, 200)}
+    with mock.patch('piescope.fibsem.move_to_position') as mock_move:
+        volumes, timings = piescope.lm.volume.multi_position_acquisition(
+            microscope, positions, laser_dict, 2, 10,
+            optimize_order=optimize_order, detector=detector, lasers=lasers,
+            objective_stage=objective_stage, time_delay=0, count_max=0)
+    assert [timing['index'] for timing in timings] == expected_route
+    assert [call[0][1:] for call in mock_move.call_args_list] == [
+        positions[index] for index in expected_route]
+    assert len(volumes) == 3
+    assert all(volume.shape == (2, 8, 6, 1) for volume in volumes)
+    assert all(timing['acquisition_time'] >= 0 for timing in timings)
+
+
+def test_multi_position_acquisition_filename(mock_hardware):
+    with pytest.raises(ValueError):
+        piescope.lm.volume.multi_position_acquisition(
+            mock.MagicMock(), [(0, 0)], {"laser640": (1, 200)}, 2, 10,
+            filename='volume.tif')
+
+
+class FakeObjectiveStage():
+    """Objective stage that keeps track of its position and travel."""
+    def __init__(self, position=0):
+        self.position = position
+        self.travel = 0
+
+    def current_position(self):
+        return str(self.position)
+
+    def move_relative(self, distance, hold=0):
+        self.travel += abs(int(distance))
+        self.position += int(distance)
+
+    def move_absolute(self, position, hold=0):
+        self.travel += abs(int(position) - self.position)
+        self.position = int(position)
+
+
+@pytest.mark.parametrize("direction", [
+    ('down'),
+    ('up'),
+])
+def test_volume_acquisition_direction(mock_hardware, direction):
+    detector, lasers, _ = mock_hardware
+    objective_stage = FakeObjectiveStage(position=1000)
+    positions = []
+    grab = detector.camera_grab.side_effect
+
+    def grab_with_position(*args):
+        positions.append(objective_stage.position)
+        return grab(*args)
+
+    detector.camera_grab.side_effect = grab_with_position
+    output = piescope.lm.volume.volume_acquisition(
+        {"laser640": (1, 200)}, 3, 10, time_delay=0, count_max=0,
+        detector=detector, lasers=lasers, objective_stage=objective_stage,
+        direction=direction)
+    if direction == 'down':
+        assert positions[1:] == [1010, 1000, 990]
+        assert list(output[:, 0, 0, 0]) == [1, 2, 3]
+    else:
+        assert positions[1:] == [990, 1000, 1010]
+        assert list(output[:, 0, 0, 0]) == [3, 2, 1]
+    assert objective_stage.position == 1000
+
+
+def test_volume_acquisition_invalid_direction(mock_hardware):
+    detector, lasers, objective_stage = mock_hardware
+    with pytest.raises(ValueError):
+        piescope.lm.volume.volume_acquisition(
+            {"laser640": (1, 200)}, 3, 10, detector=detector, lasers=lasers,
+            objective_stage=objective_stage, direction='sideways')
+
+
+def test_bidirectional_directions():
+    output = piescope.lm.volume.bidirectional_directions(3)
+    assert output == ['down', 'up', 'down']
+    output = piescope.lm.volume.bidirectional_directions(2, 'up')
+    assert output == ['up', 'down']
+
+
+@pytest.mark.parametrize("bidirectional, expected_travel", [
+    (False, 3 * (10 + 20 + 10)),
+    (True, 10 + 2 * 20 + 20 + 10),
+])
+def test_multi_position_acquisition_bidirectional(
+        mock_hardware, bidirectional, expected_travel):
+    detector, lasers, _ = mock_hardware
+    objective_stage = FakeObjectiveStage(position=0)
+    microscope = mock.MagicMock()
+    positions = [(0., 0.), (1e-3, 0.), (2e-3, 0.)]
+    with mock.patch('piescope.fibsem.move_to_position'):
+        volumes, timings = piescope.lm.volume.multi_position_acquisition(
+            microscope, positions, {"laser640": (1, 200)}, 3, 10,
+            optimize_order=False, detector=detector, lasers=lasers,
+            objective_stage=objective_stage, bidirectional=bidirectional,
+            time_delay=0, count_max=0)
+    assert objective_stage.travel == expected_travel
+    assert objective_stage.position == 0
+    # every volume has its top slice first, after a test grab (frames 0, 4, 8)
+    assert list(volumes[0][:, 0, 0, 0]) == [1, 2, 3]
+    if bidirectional:
+        assert list(volumes[1][:, 0, 0, 0]) == [7, 6, 5]
+    else:
+        assert list(volumes[1][:, 0, 0, 0]) == [5, 6, 7]
+    assert list(volumes[2][:, 0, 0, 0]) == [9, 10, 11]
+
+
+def test_multi_position_acquisition_bidirectional_up(mock_hardware):
+    detector, lasers, _ = mock_hardware
+    objective_stage = FakeObjectiveStage(position=0)
+    positions = [(0., 0.), (1e-3, 0.)]
+    with mock.patch('piescope.fibsem.move_to_position'):
+        volumes, timings = piescope.lm.volume.multi_position_acquisition(
+            mock.MagicMock(), positions, {"laser640": (1, 200)}, 3, 10,
+            optimize_order=False, detector=detector, lasers=lasers,
+            objective_stage=objective_stage, bidirectional=True,
+            direction='up', time_delay=0, count_max=0)
+    assert objective_stage.position == 0
+    # the first volume is acquired bottom-up, the second top-down
+    assert list(volumes[0][:, 0, 0, 0]) == [3, 2, 1]
+    assert list(volumes[1][:, 0, 0, 0]) == [5, 6, 7]
+
+
+def test_volume_acquisition_adaptive(mock_hardware):
+    detector, lasers, objective_stage = mock_hardware
+    # Reference channel laser561 has signal at z_slice 1 only
+    signal = iter([0, 0, 0, 9, 0, 0, 0, 0])
+    detector.camera_grab.side_effect = lambda *args: np.full(
+        (8, 6), next(signal), dtype=np.uint8)
+    laser_dict = {"laser640": (1, 200), "laser561": (1, 200)}
+    adaptive = piescope.lm.focus.AdaptiveZRange(
+        "laser561", threshold=1, patience=1, mode='stop',
+        metric=lambda image: image.max())
+    output = piescope.lm.volume.volume_acquisition(
+        laser_dict, 5, 10, time_delay=0, count_max=0,
+        detector=detector, lasers=lasers, objective_stage=objective_stage,
+        adaptive=adaptive)
+    # test grab, (z=0, laser561), (z=0, laser640), (z=1, laser561), ...
+    assert detector.camera_grab.call_count == 6
+    assert adaptive.stopped
+    assert sorted(adaptive.signal) == [0, 1, 2]
+    assert np.all(output[1, ..., 1] == 9)
+    assert np.all(output[3:] == 0)
+    # one move to the top of the volume, then down to z_slice 1 and 2
+    assert objective_stage.move_relative.call_count == 3
+
+
+def test_volume_acquisition_adaptive_invalid(mock_hardware):
+    detector, lasers, objective_stage = mock_hardware
+    adaptive = piescope.lm.focus.AdaptiveZRange("laser405", threshold=1)
+    with pytest.raises(ValueError):
+        piescope.lm.volume.volume_acquisition(
+            {"laser640": (1, 200)}, 3, 10, detector=detector, lasers=lasers,
+            objective_stage=objective_stage, adaptive=adaptive)
@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+
+import piescope.projection
+
+
+@pytest.fixture
+def volume():
+    random = np.random.RandomState(0)
+    return random.randint(0, 4000, (13, 9, 7, 2)).astype(np.uint16)
+
+
+@pytest.mark.parametrize("chunk_nbytes", [
+    (1),  # one z slice per chunk
+    (5 * 9 * 7 * 2 * 8),
+    (piescope.projection.DEFAULT_CHUNK_NBYTES),
+])
+@pytest.mark.parametrize("num_workers", [
+    (1),
+    (3),
+])
+def test_project(volume, chunk_nbytes, num_workers):
+    output = piescope.projection.project(
+        volume, piescope.projection.PROJECTIONS, chunk_nbytes=chunk_nbytes,
+        num_workers=num_workers)
+    assert output['max'].dtype == volume.dtype
+    assert output['min'].dtype == volume.dtype
+    assert np.array_equal(output['max'], volume.max(axis=0))
+    assert np.array_equal(output['min'], volume.min(axis=0))
+    assert np.array_equal(output['argmax'], volume.argmax(axis=0))
+    assert np.allclose(output['sum'], volume.sum(axis=0))
+    assert np.allclose(output['mean'], volume.mean(axis=0))
+    assert np.allclose(output['std'], volume.std(axis=0))
+
+
+@pytest.mark.parametrize("projection", piescope.projection.PROJECTIONS)
+def test_project_single(volume, projection):
+    output = piescope.projection.project(volume, projection, chunk_nbytes=1)
+    assert list(output) == [projection]
+    expected = getattr(np, projection)(volume, axis=0)
+    assert np.allclose(output[projection], expected)
+
+
+def test_project_argmax_ties():
+    volume = np.zeros((6, 2, 2, 1), dtype=np.uint8)
+    volume[2:] = 5
+    output = piescope.projection.project(volume, 'argmax', chunk_nbytes=1)
+    assert np.all(output['argmax'] == 2)
+
+
+def test_project_substack(volume):
+    output = piescope.projection.project(
+        volume, ('max', 'argmax'), start_slice=3, end_slice=10)
+    assert np.array_equal(output['max'], volume[3:10].max(axis=0))
+    assert np.array_equal(output['argmax'], volume[3:10].argmax(axis=0))
+
+
+def test_project_memmap(tmpdir, volume):
+    filename = str(tmpdir.join('volume.dat'))
+    memmap = np.memmap(filename, dtype=volume.dtype, mode='w+',
+                       shape=volume.shape)
+    memmap[:] = volume
+    memmap.flush()
+    memmap = np.memmap(filename, dtype=volume.dtype, mode='r',
+                       shape=volume.shape)
+    output = piescope.projection.project(memmap, ('max', 'mean'),
+                                         chunk_nbytes=1)
+    assert np.array_equal(output['max'], volume.max(axis=0))
+    assert np.allclose(output['mean'], volume.mean(axis=0))
+
+
+@pytest.mark.parametrize("projections, start_slice, end_slice", [
+    (('median',), 0, None),
+    (('max',), 5, 5),
+])
+def test_project_invalid(volume, projections, start_slice, end_slice):
+    with pytest.raises(ValueError):
+        piescope.projection.project(volume, projections,
+                                    start_slice=start_slice,
+                                    end_slice=end_slice)
+
+
+@pytest.mark.parametrize("reverse", [
+    (False),
+    (True),
+])
+def test_running_projection(volume, reverse):
+    projection = piescope.projection.RunningProjection(
+        volume.shape[-1], piescope.projection.PROJECTIONS)
+    assert projection.result() is None
+    frames = [(z_slice, channel) for z_slice in range(volume.shape[0])
+              for channel in range(volume.shape[-1])]
+    if reverse:
+        frames = frames[::-1]
+    for z_slice, channel in frames:
+        projection.update(z_slice, channel, volume[z_slice, ..., channel])
+    assert projection.num_frames == len(frames)
+    result = projection.result()
+    expected = piescope.projection.project(
+        volume, piescope.projection.PROJECTIONS)
+    assert result['max'].dtype == volume.dtype
+    for name in piescope.projection.PROJECTIONS:
+        assert np.allclose(result[name], expected[name])
+
+
+def test_running_projection_partial(volume):
+    projection = piescope.projection.RunningProjection(2, ('max', 'mean'))
+    for z_slice in range(4):
+        projection.update(z_slice, 1, volume[z_slice, ..., 1])
+    result = projection.result()
+    assert np.array_equal(result['max'][..., 1], volume[:4, ..., 1].max(0))
+    assert np.allclose(result['mean'][..., 1], volume[:4, ..., 1].mean(0))
+    assert np.all(result['max'][..., 0] == 0)  # no frames yet
+    projection.reset()
+    assert projection.num_frames == 0
+    assert projection.result() is None
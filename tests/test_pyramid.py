@@ -0,0 +1,74 @@
+import json
+import logging
+
+import numpy as np
+import pytest
+import tifffile
+
+import piescope.data
+import piescope.pyramid
+
+
+def test_build_pyramid():
+    image = np.zeros((1000, 700), dtype=np.uint8)
+    levels = piescope.pyramid.build_pyramid(image, min_size=256)
+    assert [level.shape for level in levels] == [
+        (1000, 700), (500, 350), (250, 175)]
+
+
+@pytest.mark.parametrize("image", [
+    (piescope.data.autoscript_image()),
+    (np.random.randint(0, 4000, (300, 500, 2)).astype(np.uint16)),
+])
+@pytest.mark.parametrize("compression", [
+    (None),
+    ('zlib'),
+])
+def test_write_pyramid(tmpdir, caplog, image, compression):
+    filename = str(tmpdir.join('pyramid.tif'))
+    shapes = piescope.pyramid.write_pyramid(
+        filename, image, metadata={'pixel_size': 5e-9}, tile_size=64,
+        min_size=100, compression=compression)
+    levels = piescope.pyramid.build_pyramid(image, min_size=100)
+    assert shapes == [level.shape for level in levels]
+    with caplog.at_level(logging.WARNING, logger='tifffile'):
+        with tifffile.TiffFile(filename) as tif:
+            assert np.array_equal(tif.asarray(), image)
+            assert len(tif.series[0].levels) == len(levels)
+            description = json.loads(tif.pages[0].description)
+    assert not caplog.records
+    assert description == {'pixel_size': 5e-9}
+    with piescope.pyramid.PyramidReader(filename) as pyramid:
+        assert pyramid.num_levels == len(levels)
+        assert pyramid.shapes == shapes
+        for level, expected in enumerate(levels):
+            assert np.array_equal(pyramid.read(level), expected)
+        region = pyramid.read(1, slice(10, 90), slice(-70, None))
+        assert np.array_equal(region, levels[1][10:90, -70:])
+
+
+def test_pyramid_reader_region(tmpdir):
+    image = np.random.randint(0, 255, (512, 768), dtype=np.uint8)
+    filename = str(tmpdir.join('pyramid.tif'))
+    piescope.pyramid.write_pyramid(filename, image, tile_size=64, min_size=64)
+    levels = piescope.pyramid.build_pyramid(image, min_size=64)
+    with piescope.pyramid.PyramidReader(filename) as pyramid:
+        assert pyramid.level_for_downsample(0.5) == 0
+        assert pyramid.level_for_downsample(3) == 1
+        assert pyramid.level_for_downsample(1000) == len(levels) - 1
+        overview, level = pyramid.read_region(max_shape=(128, 128))
+        assert level == 2
+        assert np.array_equal(overview, levels[2])
+        detail, level = pyramid.read_region(
+            slice(100, 200), slice(300, 400), max_shape=(50, 50))
+        assert level == 1
+        assert np.array_equal(detail, levels[1][50:100, 150:200])
+
+
+def test_write_pyramid_invalid(tmpdir):
+    filename = str(tmpdir.join('pyramid.tif'))
+    with pytest.raises(ValueError):
+        piescope.pyramid.write_pyramid(filename, np.zeros((2, 16, 16, 1)))
+    with pytest.raises(ValueError):
+        piescope.pyramid.write_pyramid(filename, np.zeros((16, 16)),
+                                       tile_size=100)
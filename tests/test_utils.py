@@ -1,14 +1,18 @@
 from datetime import datetime
+import gc
 import mock
 import os
+import weakref
 
 import numpy as np
 import pytest
 import skimage.data
 import skimage.io
 import skimage.util
+import tifffile
 
 import piescope.data
+import piescope.lm.volume
 import piescope.utils
 
 
@@ -78,6 +82,223 @@ def test_multiple_save_image(tmpdir):
     assert os.path.exists(expected_file_3)
 
 
+@pytest.mark.parametrize("n_channels", [
+    (1),
+    (2),
+    (3),
+])
+def test_save_image_volume(tmpdir, n_channels):
+    image = np.random.randint(0, 255, (4, 16, 8, n_channels), dtype=np.uint8)
+    save_filename = os.path.join(tmpdir, 'volume.tif')
+    piescope.utils.save_image(image, save_filename, timestamp=False)
+    with tifffile.TiffFile(save_filename) as tif:
+        assert len(tif.pages) == 4 * n_channels  # written only once
+        assert tif.series[0].axes.endswith('YX')
+        retrieved_image = tif.asarray().reshape(4, n_channels, 16, 8)
+    assert np.array_equal(np.moveaxis(retrieved_image, 1, -1), image)
+
+
+@pytest.mark.parametrize("n_channels", [
+    (1),
+    (2),
+    (3),
+])
+def test_save_image_channels(tmpdir, n_channels):
+    image = np.random.randint(0, 255, (16, 8, n_channels), dtype=np.uint8)
+    save_filename = os.path.join(tmpdir, 'channels.tif')
+    piescope.utils.save_image(image, save_filename, timestamp=False)
+    retrieved_image = tifffile.imread(save_filename).reshape(n_channels, 16, 8)
+    assert np.array_equal(np.moveaxis(retrieved_image, 0, -1), image)
+
+
+@pytest.mark.parametrize("shape", [
+    ((64, 48)),
+    ((64, 48, 2)),
+    ((3, 64, 48, 2)),
+])
+@pytest.mark.parametrize("predictor", [
+    (False),
+    (True),
+])
+def test_save_image_compression(tmpdir, shape, predictor):
+    # smooth image, so it compresses well
+    columns = np.arange(48, dtype=np.uint16)
+    if len(shape) > 2:
+        columns = columns[:, np.newaxis]  # channel axis last
+    image = np.broadcast_to(columns, shape).copy()
+    raw_filename = os.path.join(tmpdir, 'raw.tif')
+    piescope.utils.save_image(image, raw_filename, timestamp=False)
+    save_filename = os.path.join(tmpdir, 'compressed.tif')
+    piescope.utils.save_image(image, save_filename, timestamp=False,
+                              compression='zlib', compression_level=6,
+                              predictor=predictor, max_workers=2)
+    with tifffile.TiffFile(save_filename) as tif:
+        assert tif.pages[0].compression == tifffile.COMPRESSION.ADOBE_DEFLATE
+        retrieved_image = tif.asarray()
+    assert np.array_equal(retrieved_image.ravel(),
+                          np.moveaxis(image, -1, -3).ravel()
+                          if image.ndim > 2 else image.ravel())
+    assert os.path.getsize(save_filename) < os.path.getsize(raw_filename)
+
+
+def test_save_image_compression_invalid(tmpdir):
+    image = np.zeros((8, 8), dtype=np.uint8)
+    save_filename = os.path.join(tmpdir, 'compressed.tif')
+    with pytest.raises(ValueError):
+        piescope.utils.save_image(image, save_filename, compression='jpeg')
+    if 'zstd' not in piescope.utils.available_compression():
+        with pytest.raises(ValueError):
+            piescope.utils.save_image(image, save_filename,
+                                      compression='zstd')
+
+
+@pytest.mark.parametrize("bigtiff", [
+    (False),
+    (True),
+])
+def test_volume_writer(tmpdir, bigtiff):
+    volume = np.random.randint(0, 4000, (5, 16, 8, 2), dtype=np.uint16)
+    save_filename = os.path.join(tmpdir, 'streamed.tif')
+    with piescope.utils.VolumeWriter(save_filename, volume.shape, np.uint16,
+                                     metadata={'spacing': 0.5},
+                                     bigtiff=bigtiff) as writer:
+        for z_slice in volume:
+            writer.write(z_slice)
+    with tifffile.TiffFile(save_filename) as tif:
+        assert tif.is_bigtiff == bigtiff
+        assert tif.series[0].shape == (5, 2, 16, 8)
+        assert tif.series[0].axes == 'ZCYX'
+        retrieved_volume = tif.asarray()
+    assert np.array_equal(np.moveaxis(retrieved_volume, 1, -1), volume)
+
+
+def test_volume_writer_closed_early(tmpdir):
+    volume = np.ones((3, 4, 4, 1), dtype=np.uint8)
+    save_filename = os.path.join(tmpdir, 'streamed.tif')
+    with piescope.utils.VolumeWriter(save_filename, volume.shape,
+                                     np.uint8) as writer:
+        writer.write(volume[0])
+    retrieved_volume = tifffile.imread(save_filename)
+    assert retrieved_volume.shape == (3, 4, 4)
+    assert retrieved_volume[0].sum() == 16
+    assert retrieved_volume[1:].sum() == 0
+
+
+def test_volume_writer_invalid(tmpdir):
+    save_filename = os.path.join(tmpdir, 'streamed.tif')
+    with piescope.utils.VolumeWriter(save_filename, (1, 4, 4, 1),
+                                     np.uint8) as writer:
+        with pytest.raises(ValueError):
+            writer.write(np.zeros((4, 4, 2)))
+        writer.write(np.zeros((4, 4, 1)))
+        with pytest.raises(ValueError):
+            writer.write(np.zeros((4, 4, 1)))
+
+
+def test_write_volume(tmpdir):
+    volume = np.random.randint(0, 255, (3, 6, 5, 2), dtype=np.uint8)
+    save_filename = os.path.join(tmpdir, 'volume.tif')
+    piescope.utils.write_volume(save_filename, volume)
+    retrieved_volume = tifffile.imread(save_filename)
+    assert np.array_equal(np.moveaxis(retrieved_volume, 1, -1), volume)
+
+
+def test_save_image_filename_index(tmpdir):
+    image = np.zeros((16, 16), dtype=np.uint8)
+    for index in range(1, 51):
+        open(os.path.join(tmpdir, 'many_({}).tif'.format(index)), 'w').close()
+    open(os.path.join(tmpdir, 'many.tif'), 'w').close()
+    save_filename = os.path.join(tmpdir, 'many.tif')
+    with mock.patch('os.scandir', side_effect=os.scandir) as mock_scandir:
+        output = [piescope.utils.save_image(image, save_filename,
+                                            timestamp=False)
+                  for _ in range(3)]
+    assert output == [os.path.join(tmpdir, 'many_({}).tif'.format(index))
+                      for index in (51, 52, 53)]
+    assert mock_scandir.call_count == 1  # the next index is cached
+    output = piescope.utils.save_image(
+        image, os.path.join(tmpdir, 'many_(60).tif'), timestamp=False)
+    assert output == os.path.join(tmpdir, 'many_(60).tif')
+
+
+def test_save_image_concurrent_filenames(tmpdir):
+    image = np.zeros((16, 16), dtype=np.uint8)
+    save_filename = os.path.join(tmpdir, 'concurrent.tif')
+    with piescope.utils.SaveQueue(max_workers=4) as save_queue:
+        futures = [save_queue.save(image, save_filename, timestamp=False)
+                   for _ in range(20)]
+    filenames = [future.result() for future in futures]
+    assert len(set(filenames)) == 20
+    assert len(os.listdir(tmpdir)) == 20
+
+
+def test_save_image_error_removes_file(tmpdir):
+    save_filename = os.path.join(tmpdir, 'failed.tif')
+    with pytest.raises(Exception):
+        piescope.utils.save_image('not an image', save_filename,
+                                  timestamp=False)
+    assert os.listdir(tmpdir) == []
+
+
+@pytest.mark.parametrize("shape, expected_shape", [
+    ((3, 16, 16, 2), (3, 16, 16, 2)),
+    ((3, 16, 16, 1), (3, 16, 16, 1)),
+    ((16, 16, 3), (16, 16, 3)),
+    ((16, 16), (16, 16)),
+    ((1, 16, 16, 2), (16, 16, 2)),  # ImageJ drops the z axis
+])
+def test_load_image(tmpdir, shape, expected_shape):
+    image = np.random.randint(0, 4000, shape).astype(np.uint16)
+    filename = piescope.utils.save_image(
+        image, os.path.join(tmpdir, 'image.tif'), timestamp=False)
+    output = piescope.utils.load_image(filename)
+    assert isinstance(output, np.memmap)
+    assert output.shape == expected_shape
+    assert np.array_equal(output, image.reshape(expected_shape))
+    with pytest.raises(ValueError):
+        output[0] = 1  # read only
+
+
+@pytest.mark.parametrize("bigtiff", [
+    (True),
+    (False),
+])
+def test_load_image_volume(tmpdir, bigtiff):
+    volume = np.random.randint(0, 255, (4, 8, 6, 3)).astype(np.uint8)
+    filename = os.path.join(tmpdir, 'volume.tif')
+    piescope.utils.write_volume(filename, volume, bigtiff=bigtiff)
+    output = piescope.utils.load_image(filename)
+    assert isinstance(output, np.memmap)
+    assert np.array_equal(output, volume)
+    output = piescope.utils.load_image(filename, channels_last=False)
+    assert np.array_equal(output, np.moveaxis(volume, -1, 1))
+
+
+def test_load_image_compressed(tmpdir):
+    volume = np.random.randint(0, 255, (4, 8, 6, 3)).astype(np.uint8)
+    filename = piescope.utils.save_image(
+        volume, os.path.join(tmpdir, 'volume.tif'), timestamp=False,
+        compression='zlib')
+    output = piescope.utils.load_image(filename)
+    assert not isinstance(output, np.memmap)
+    assert np.array_equal(output, volume)
+
+
+def test_load_image_create_volume(tmpdir):
+    volume = np.random.randint(0, 255, (4, 8, 6, 3)).astype(np.uint8)
+    filename = os.path.join(tmpdir, 'volume.tif')
+    disk_volume = piescope.lm.volume.create_volume(
+        volume.shape, volume.dtype, storage='disk', filename=filename)
+    disk_volume[:] = volume
+    disk_volume.flush()
+    del disk_volume
+    output = piescope.utils.load_image(filename)
+    assert isinstance(output, np.memmap)
+    assert np.array_equal(output, volume)
+    output = piescope.utils.load_image(filename, channels_last=False)
+    assert np.array_equal(output, volume)  # already in ZYXC file order
+
+
 @pytest.mark.parametrize("array_type", [
     (int),
     (float),
@@ -176,3 +397,187 @@ def test_rgb_image_astronaut(input_image):
     result = piescope.utils.rgb_image(input_image)
     assert result.shape[-1] == 3
     assert np.allclose(result[:, :, 0], skimage.data.astronaut()[:, :, 0])
+
+
+@pytest.mark.parametrize("dtype", [
+    (np.uint8),
+    (np.uint16),
+])
+def test_rgb_image_dtype(dtype):
+    input_image = np.full((4, 4, 2), 300, dtype=dtype)
+    result = piescope.utils.rgb_image(input_image)
+    assert result.dtype == dtype
+    assert np.all(result[..., :2] == input_image)
+    assert np.all(result[..., 2] == 0)
+
+
+@pytest.mark.parametrize("n_channels", [
+    (1),
+    (3),
+    (4),
+    (6),
+])
+@pytest.mark.parametrize("dtype", [
+    (np.uint8),
+    (np.uint16),
+])
+def test_channel_compositor(n_channels, dtype):
+    image = np.random.randint(0, np.iinfo(dtype).max, (5, 7, n_channels),
+                              dtype=dtype)
+    compositor = piescope.utils.ChannelCompositor()
+    result = compositor.composite(image)
+    assert result.shape == (5, 7, 3)
+    assert result.dtype == np.uint8
+    scaled = np.round(image / np.iinfo(dtype).max * 255)
+    colors = piescope.utils.DEFAULT_CHANNEL_COLORS[:n_channels]
+    if n_channels == 1:
+        colors = [(1, 1, 1)]
+    expected = np.minimum(np.dot(scaled, np.array(colors)), 255)
+    assert np.array_equal(result, expected)
+    # the LUTs and buffers are reused
+    out = np.empty((5, 7, 3), dtype=np.uint8)
+    assert compositor.composite(image, out=out) is out
+    assert np.array_equal(out, expected)
+
+
+def test_channel_compositor_windows():
+    image = np.array([[[0, 100], [50, 200]]], dtype=np.uint16)
+    compositor = piescope.utils.ChannelCompositor(
+        colors=[(1, 0, 0), (0, 0.5, 1)], windows=[(0, 100), None])
+    result = compositor.composite(image)
+    assert np.array_equal(result[0, :, 0], [0, 128])
+    compositor.set_window(1, 100, 200)
+    compositor.set_color(0, (0, 1, 0))
+    result = compositor.composite(image)
+    assert np.array_equal(result[0, 0], [0, 0, 0])
+    assert np.array_equal(result[0, 1], [0, 255, 255])  # 128 + 128 clipped
+
+
+@pytest.mark.parametrize("input_image", [
+    (np.zeros((10, 10), dtype=np.float32)),
+    (np.zeros((10, 10, 2, 2), dtype=np.uint8)),
+    (np.zeros((10, 10, 7), dtype=np.uint8)),
+])
+def test_channel_compositor_invalid(input_image):
+    with pytest.raises(ValueError):
+        piescope.utils.ChannelCompositor().composite(input_image)
+
+
+@pytest.mark.parametrize("dtype", [
+    (np.uint8),
+    (np.uint16),
+    (np.float32),
+])
+def test_downsample(dtype):
+    image = np.array([[0, 2, 4],
+                      [2, 4, 8],
+                      [6, 6, 1]], dtype=dtype)
+    output = piescope.utils.downsample(image)
+    assert output.dtype == dtype
+    # odd edge pixels are averaged with themselves
+    expected = np.array([[2, 6], [6, 1]])
+    assert np.allclose(output, expected)
+
+
+def test_downsample_channels():
+    image = np.random.randint(0, 255, (6, 10, 3), dtype=np.uint8)
+    output = piescope.utils.downsample(image)
+    assert output.shape == (3, 5, 3)
+    expected = image.reshape(3, 2, 5, 2, 3).mean(axis=(1, 3))
+    assert np.all(np.abs(output - expected) <= 0.5)
+
+
+def test_downsample_drop_edges():
+    image = np.arange(16).reshape(4, 4)
+    output = piescope.utils.downsample(image, 2, edges='drop',
+                                       dtype=np.float32)
+    expected = np.array([[2.5, 4.5], [10.5, 12.5]])
+    assert output.dtype == np.float32
+    assert np.allclose(output, expected)
+    output = piescope.utils.downsample(np.ones((5, 7)), 2, edges='drop')
+    assert output.shape == (2, 3)
+    output = piescope.utils.downsample(np.ones((5, 7)), 3)
+    assert output.shape == (2, 3)
+    assert piescope.utils.downsample(image, 1).shape == (4, 4)
+    with pytest.raises(ValueError):
+        piescope.utils.downsample(image, edges='wrap')
+
+
+@pytest.mark.parametrize("dtype", [
+    (np.uint8),
+    (np.uint16),
+    (np.float32),
+])
+def test_approximate_percentile(dtype):
+    image = skimage.data.camera().astype(dtype)
+    if dtype == np.uint16:
+        image *= 200
+    output = piescope.utils.approximate_percentile(image, (1, 50, 99))
+    expected = np.percentile(image, (1, 50, 99))
+    assert output.shape == (3,)
+    # within 1% of the intensity range of the full percentiles
+    tolerance = 0.01 * (image.max() - image.min())
+    assert np.allclose(output, expected, atol=tolerance)
+    assert np.isscalar(piescope.utils.approximate_percentile(image, 50))
+
+
+def test_approximate_percentile_small():
+    image = np.arange(11, dtype=np.uint8)
+    output = piescope.utils.approximate_percentile(image, (0, 50, 100))
+    assert np.allclose(output, [0, 5, 10])
+    with pytest.raises(ValueError):
+        piescope.utils.approximate_percentile(image[:0], 50)
+
+
+def test_auto_contrast():
+    random = np.random.RandomState(0)
+    auto_contrast = piescope.utils.AutoContrast(
+        low_percentile=0, high_percentile=100, hysteresis=0.1)
+    image = random.randint(100, 1101, (64, 64)).astype(np.uint16)
+    image[0, :2] = [100, 1100]
+    assert auto_contrast.update(image) == (100, 1100)
+    # small changes keep the window
+    assert auto_contrast.update(image + 50) == (100, 1100)
+    # large changes update it
+    assert auto_contrast.update(image + 500) == (600, 1600)
+    auto_contrast.reset()
+    assert auto_contrast.update(image + 50) == (150, 1150)
+
+
+def test_save_queue(tmpdir):
+    image = np.random.randint(0, 255, (16, 8), dtype=np.uint8)
+    with piescope.utils.SaveQueue(max_workers=2, maxsize=2) as save_queue:
+        futures = [save_queue.save(
+            image, os.path.join(tmpdir, 'queued_{}.tif'.format(i)),
+            timestamp=False) for i in range(5)]
+        save_queue.flush()
+        assert save_queue.queue_depth == 0
+        stats = save_queue.stats()
+    filenames = [future.result() for future in futures]
+    assert len(set(filenames)) == 5
+    for filename in filenames:
+        assert np.array_equal(skimage.io.imread(filename), image)
+    assert stats['num_saved'] == 5
+    assert stats['num_errors'] == 0
+    assert stats['bytes_written'] >= 5 * image.nbytes
+    assert stats['throughput'] > 0
+
+
+def test_save_queue_error(tmpdir):
+    save_queue = piescope.utils.SaveQueue()
+    future = save_queue.save('not an image', os.path.join(tmpdir, 'bad.tif'))
+    with pytest.raises(Exception):
+        future.result()
+    with pytest.raises(Exception):
+        save_queue.flush()
+    assert save_queue.stats()['num_errors'] == 0  # reported by flush()
+    save_queue.flush()  # errors are only raised once
+    save_queue.shutdown()
+
+
+def test_save_queue_garbage_collected():
+    save_queue = piescope.utils.SaveQueue()
+    reference = weakref.ref(save_queue)
+    del save_queue
+    gc.collect()
+    assert reference() is None  # not kept alive by the exit hook